@@ -0,0 +1,640 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Iterator, Sequence
+import operator
+from typing import TYPE_CHECKING, cast
+
+from app import util
+from app.constants import CONSTRUCTOR_METHOD_NAME
+from app.environment import Cell, Frame
+from app import expression as Expr
+from app.runtime import LoxObject
+from app.schema import Storage, Token, TokenType
+from app import statement as Stmt
+
+if TYPE_CHECKING:
+    from app.interpreter import Interpreter
+
+# Opcodes. Each takes the operands listed, inline in the code after it, and
+# the stack effect in brackets. Jump targets are absolute offsets.
+OPCODES = (
+    "CONSTANT",  # index [-> value]
+    "NIL",  # [-> nil]
+    "TRUE",  # [-> true]
+    "FALSE",  # [-> false]
+    "POP",  # [value ->]
+    "GET_LOCAL",  # slot [-> value]
+    "SET_LOCAL",  # slot [value -> value]
+    "STORE_LOCAL",  # slot [value ->]
+    "GET_CELL",  # slot [-> value]
+    "SET_CELL",  # slot [value -> value]
+    "NEW_CELL",  # slot []
+    "DEFINE_CELL",  # slot [value ->]
+    "GET_GLOBAL",  # slot [-> value]
+    "SET_GLOBAL",  # slot [value -> value]
+    "DEFINE_GLOBAL",  # slot [value ->]
+    "GET_PROPERTY",  # name [instance -> value]
+    "CHECK_INSTANCE",  # name [instance -> instance]
+    "SET_PROPERTY",  # name [instance, value -> value]
+    "GET_SUPER",  # name [superclass, this -> method]
+    "EQUAL",  # [a, b -> a == b]
+    "NOT_EQUAL",  # [a, b -> a != b]
+    "GREATER",  # [a, b -> a > b]
+    "GREATER_EQUAL",  # [a, b -> a >= b]
+    "LESS",  # [a, b -> a < b]
+    "LESS_EQUAL",  # [a, b -> a <= b]
+    "ADD",  # [a, b -> a + b]
+    "SUBTRACT",  # [a, b -> a - b]
+    "MULTIPLY",  # [a, b -> a * b]
+    "DIVIDE",  # [a, b -> a / b]
+    "NOT",  # [value -> !value]
+    "NEGATE",  # [value -> -value]
+    "PRINT",  # [value ->]
+    "JUMP",  # target []
+    "JUMP_IF_FALSE",  # target [condition ->]
+    "JUMP_IF_FALSE_OR_POP",  # target [value -> value if jumping]
+    "JUMP_IF_TRUE_OR_POP",  # target [value -> value if jumping]
+    "CALL",  # argument count [callee, arguments... -> result]
+    "CLOSURE",  # function [-> function]
+    "CLASS",  # class [superclass if it has one -> class]
+    "RETURN",  # [value ->]
+    "FLOW_ERROR",  # []
+)
+
+(
+    CONSTANT,
+    NIL,
+    TRUE,
+    FALSE,
+    POP,
+    GET_LOCAL,
+    SET_LOCAL,
+    STORE_LOCAL,
+    GET_CELL,
+    SET_CELL,
+    NEW_CELL,
+    DEFINE_CELL,
+    GET_GLOBAL,
+    SET_GLOBAL,
+    DEFINE_GLOBAL,
+    GET_PROPERTY,
+    CHECK_INSTANCE,
+    SET_PROPERTY,
+    GET_SUPER,
+    EQUAL,
+    NOT_EQUAL,
+    GREATER,
+    GREATER_EQUAL,
+    LESS,
+    LESS_EQUAL,
+    ADD,
+    SUBTRACT,
+    MULTIPLY,
+    DIVIDE,
+    NOT,
+    NEGATE,
+    PRINT,
+    JUMP,
+    JUMP_IF_FALSE,
+    JUMP_IF_FALSE_OR_POP,
+    JUMP_IF_TRUE_OR_POP,
+    CALL,
+    CLOSURE,
+    CLASS,
+    RETURN,
+    FLOW_ERROR,
+) = range(len(OPCODES))
+
+# How many operands each opcode takes.
+OPERAND_COUNTS = tuple(
+    (
+        0
+        if opcode
+        in (
+            NIL,
+            TRUE,
+            FALSE,
+            POP,
+            EQUAL,
+            NOT_EQUAL,
+            GREATER,
+            GREATER_EQUAL,
+            LESS,
+            LESS_EQUAL,
+            ADD,
+            SUBTRACT,
+            MULTIPLY,
+            DIVIDE,
+            NOT,
+            NEGATE,
+            PRINT,
+            RETURN,
+            FLOW_ERROR,
+        )
+        else 1
+    )
+    for opcode in range(len(OPCODES))
+)
+
+_BINARY_OPCODES = {
+    TokenType.EQUAL_EQUAL: EQUAL,
+    TokenType.BANG_EQUAL: NOT_EQUAL,
+    TokenType.GREATER: GREATER,
+    TokenType.GREATER_EQUAL: GREATER_EQUAL,
+    TokenType.LESS: LESS,
+    TokenType.LESS_EQUAL: LESS_EQUAL,
+    TokenType.PLUS: ADD,
+    TokenType.MINUS: SUBTRACT,
+    TokenType.STAR: MULTIPLY,
+    TokenType.SLASH: DIVIDE,
+}
+
+
+class Chunk:
+    """
+    Compiled code: the opcodes with their operands, the constants they refer
+    to, and for each opcode that can fail at run time, or declares something,
+    the token to report errors at and to take line numbers from.
+    """
+
+    __slots__ = ("name", "code", "constants", "tokens")
+
+    name: str
+    code: list[int]
+    constants: list[object]
+    tokens: list[Token | None]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.code = []
+        self.constants = []
+        self.tokens = []
+
+
+class FunctionProto:
+    """
+    A function declaration as the VM sees it. Its chunk is compiled on the
+    first call, once its body is loaded if it was lazy, and shared by every
+    closure made from it.
+    """
+
+    __slots__ = ("declaration", "is_initializer", "captures", "capture", "chunk")
+
+    declaration: Stmt.Function
+    is_initializer: bool
+    # The frame indices of the cells a closure over it captures, and a function
+    # that takes them from a frame.
+    captures: tuple[int, ...]
+    capture: Callable[[Frame], tuple[Cell, ...]]
+    chunk: Chunk | None
+
+    def __init__(
+        self, declaration: Stmt.Function, is_initializer: bool, captures: list[int]
+    ) -> None:
+        self.declaration = declaration
+        self.is_initializer = is_initializer
+        self.captures = tuple(captures)
+        self.chunk = None
+
+        if len(captures) == 0:
+            self.capture = lambda frame: ()
+        elif len(captures) == 1:
+            (index,) = captures
+            self.capture = lambda frame: (frame[index],)  # type: ignore[return-value]
+        else:
+            self.capture = cast(
+                Callable[[Frame], tuple[Cell, ...]], operator.itemgetter(*captures)
+            )
+
+    def __str__(self) -> str:
+        return f"<fn {self.declaration.name.lexeme}>"
+
+
+class ClassProto:
+    __slots__ = ("name", "superclass", "super_slot", "methods")
+
+    name: str
+    # The superclass's name, to report if it isn't a class.
+    superclass: Token | None
+    super_slot: int
+    methods: tuple[tuple[str, FunctionProto], ...]
+
+    def __init__(
+        self,
+        name: str,
+        superclass: Token | None,
+        super_slot: int,
+        methods: tuple[tuple[str, FunctionProto], ...],
+    ) -> None:
+        self.name = name
+        self.superclass = superclass
+        self.super_slot = super_slot
+        self.methods = methods
+
+    def __str__(self) -> str:
+        return f"<class {self.name}>"
+
+
+class BytecodeCompiler(Expr.Visitor[None], Stmt.Visitor[None]):
+    """
+    Lowers a resolved function body, or top-level statement, to a Chunk. Locals
+    keep the slots the resolver gave them, captured ones in cells, and a
+    function's frame holds the cells it captured after its locals, as in the
+    closure engine. Loops compile to jumps, so break and continue don't raise.
+    """
+
+    _interpreter: Interpreter
+    _chunk: Chunk
+    _free_base: int
+    # For each loop being compiled, where continue jumps to, and the jumps
+    # break added, to point at the end of the loop once it's known.
+    _loops: list[tuple[int, list[int]]]
+
+    def __init__(self, interpreter: Interpreter, chunk: Chunk, free_base: int) -> None:
+        self._interpreter = interpreter
+        self._chunk = chunk
+        self._free_base = free_base
+        self._loops = []
+
+    @classmethod
+    def function(cls, interpreter: Interpreter, proto: FunctionProto) -> Chunk:
+        declaration = proto.declaration
+        chunk = Chunk(declaration.name.lexeme)
+
+        compiler = cls(interpreter, chunk, declaration.frame_size)
+        for statement in declaration.body:
+            compiler.compile(statement)
+        compiler._emit(NIL)
+        compiler._emit(RETURN)
+
+        return chunk
+
+    @classmethod
+    def script(
+        cls, interpreter: Interpreter, statements: Sequence[Stmt.Stmt]
+    ) -> Chunk:
+        chunk = Chunk("<script>")
+
+        compiler = cls(interpreter, chunk, 0)
+        for statement in statements:
+            compiler.compile(statement)
+        compiler._emit(NIL)
+        compiler._emit(RETURN)
+
+        return chunk
+
+    @classmethod
+    def expression(cls, interpreter: Interpreter, expr: Expr.Expr) -> Chunk:
+        chunk = Chunk("<script>")
+
+        compiler = cls(interpreter, chunk, 0)
+        compiler.compile(expr)
+        compiler._emit(RETURN)
+
+        return chunk
+
+    def compile(self, node: Expr.Expr | Stmt.Stmt) -> None:
+        node.accept(self)
+
+    def _emit(self, opcode: int, *operands: int, token: Token | None = None) -> int:
+        code = self._chunk.code
+        tokens = self._chunk.tokens
+        offset = len(code)
+
+        code.append(opcode)
+        tokens.append(token)
+        for operand in operands:
+            code.append(operand)
+            tokens.append(None)
+
+        return offset
+
+    def _constant(self, value: object) -> int:
+        constants = self._chunk.constants
+        constants.append(value)
+        return len(constants) - 1
+
+    def _jump(self, opcode: int) -> int:
+        # Returns the offset of the target, to patch later.
+        return self._emit(opcode, -1) + 1
+
+    def _patch(self, operand: int) -> None:
+        self._chunk.code[operand] = len(self._chunk.code)
+
+    def _load(
+        self, node: Expr.Variable | Expr.This | Expr.Super, name: Token
+    ) -> None:
+        storage = node.storage
+
+        if storage is Storage.LOCAL:
+            self._emit(GET_LOCAL, node.slot)
+        elif storage is Storage.CELL:
+            self._emit(GET_CELL, node.slot)
+        elif storage is Storage.FREE:
+            self._emit(GET_CELL, self._free_base + node.slot)
+        else:
+            self._emit(GET_GLOBAL, node.slot, token=name)
+
+    def _define(self, stmt: Stmt.Var | Stmt.Function | Stmt.Class) -> None:
+        storage = stmt.storage
+
+        if storage is Storage.LOCAL:
+            self._emit(STORE_LOCAL, stmt.slot)
+        elif storage is Storage.CELL:
+            self._emit(DEFINE_CELL, stmt.slot)
+        else:
+            slot = self._interpreter.globals.slot(stmt.name.lexeme)
+            self._emit(DEFINE_GLOBAL, slot)
+
+    def _proto(self, function: Stmt.Function, is_initializer: bool) -> FunctionProto:
+        captures = [
+            capture if capture >= 0 else self._free_base + ~capture
+            for capture in function.captures
+        ]
+        return FunctionProto(function, is_initializer, captures)
+
+    def visit_binary_expr(self, expr: Expr.Binary) -> None:
+        self.compile(expr.left)
+        self.compile(expr.right)
+
+        opcode = _BINARY_OPCODES.get(expr.operator.type_)
+        if opcode is None:
+            # As in the tree walker, anything else evaluates to nil.
+            self._emit(POP)
+            self._emit(POP)
+            self._emit(NIL)
+            return
+
+        self._emit(opcode, token=expr.operator)
+
+    def visit_grouping_expr(self, expr: Expr.Grouping) -> None:
+        self.compile(expr.expr)
+
+    def visit_literal_expr(self, expr: Expr.Literal) -> None:
+        value = expr.value
+
+        if value is None:
+            self._emit(NIL)
+        elif value is True:
+            self._emit(TRUE)
+        elif value is False:
+            self._emit(FALSE)
+        else:
+            self._emit(CONSTANT, self._constant(value))
+
+    def visit_unary_expr(self, expr: Expr.Unary) -> None:
+        self.compile(expr.expr)
+
+        if expr.operator.type_ == TokenType.MINUS:
+            self._emit(NEGATE, token=expr.operator)
+        elif expr.operator.type_ == TokenType.BANG:
+            self._emit(NOT)
+        else:
+            self._emit(POP)
+            self._emit(NIL)
+
+    def visit_ternary_expr(self, expr: Expr.Ternary) -> None:
+        self.compile(expr.condition)
+        to_false = self._jump(JUMP_IF_FALSE)
+        self.compile(expr.true_expr)
+        to_end = self._jump(JUMP)
+        self._patch(to_false)
+        self.compile(expr.false_expr)
+        self._patch(to_end)
+
+    def visit_variable_expr(self, expr: Expr.Variable) -> None:
+        self._load(expr, expr.name)
+
+    def visit_assign_expr(self, expr: Expr.Assign) -> None:
+        self.compile(expr.value_expr)
+        storage = expr.storage
+
+        if storage is Storage.LOCAL:
+            self._emit(SET_LOCAL, expr.slot)
+        elif storage is Storage.CELL:
+            self._emit(SET_CELL, expr.slot)
+        elif storage is Storage.FREE:
+            self._emit(SET_CELL, self._free_base + expr.slot)
+        else:
+            self._emit(SET_GLOBAL, expr.slot, token=expr.name)
+
+    def visit_logical_expr(self, expr: Expr.Logical) -> None:
+        self.compile(expr.left)
+
+        if expr.operator.type_ == TokenType.OR:
+            to_end = self._jump(JUMP_IF_TRUE_OR_POP)
+        else:
+            to_end = self._jump(JUMP_IF_FALSE_OR_POP)
+
+        self.compile(expr.right)
+        self._patch(to_end)
+
+    def visit_call_expr(self, expr: Expr.Call) -> None:
+        self.compile(expr.callee)
+        for argument in expr.arguments:
+            self.compile(argument)
+
+        self._emit(CALL, len(expr.arguments), token=expr.paren)
+
+    def visit_get_expr(self, expr: Expr.Get) -> None:
+        self.compile(expr.object)
+        self._emit(GET_PROPERTY, self._constant(expr.name))
+
+    def visit_set_expr(self, expr: Expr.Set) -> None:
+        name = self._constant(expr.name)
+
+        # The tree walker checks the object before it evaluates the value.
+        self.compile(expr.object)
+        self._emit(CHECK_INSTANCE, name)
+        self.compile(expr.value)
+        self._emit(SET_PROPERTY, name)
+
+    def visit_this_expr(self, expr: Expr.This) -> None:
+        self._load(expr, expr.keyword)
+
+    def visit_super_expr(self, expr: Expr.Super) -> None:
+        self._load(expr, expr.keyword)
+        self._load(expr.this, expr.keyword)
+        self._emit(GET_SUPER, self._constant(expr.method))
+
+    def visit_expression_stmt(self, stmt: Stmt.Expression) -> None:
+        self.compile(stmt.expr)
+        self._emit(POP)
+
+    def visit_print_stmt(self, stmt: Stmt.Print) -> None:
+        self.compile(stmt.expr)
+        self._emit(PRINT)
+
+    def visit_var_stmt(self, stmt: Stmt.Var) -> None:
+        if stmt.initializer is not None:
+            self.compile(stmt.initializer)
+        else:
+            self._emit(NIL)
+
+        self._define(stmt)
+
+    def visit_block_stmt(self, stmt: Stmt.Block) -> None:
+        for statement in stmt.statements:
+            self.compile(statement)
+
+    def visit_if_stmt(self, stmt: Stmt.If) -> None:
+        self.compile(stmt.condition)
+        to_else = self._jump(JUMP_IF_FALSE)
+        self.compile(stmt.then_stmt)
+
+        if stmt.else_stmt is None:
+            self._patch(to_else)
+            return
+
+        to_end = self._jump(JUMP)
+        self._patch(to_else)
+        self.compile(stmt.else_stmt)
+        self._patch(to_end)
+
+    def visit_while_stmt(self, stmt: Stmt.While) -> None:
+        start = len(self._chunk.code)
+        self.compile(stmt.condition)
+        to_end = self._jump(JUMP_IF_FALSE)
+
+        breaks: list[int] = []
+        self._loops.append((start, breaks))
+        self.compile(stmt.body)
+        self._loops.pop()
+
+        self._emit(JUMP, start)
+        self._patch(to_end)
+        for operand in breaks:
+            self._patch(operand)
+
+    def visit_flow_stmt(self, stmt: Stmt.Flow) -> None:
+        if not self._loops:
+            self._emit(FLOW_ERROR, token=stmt.token)
+            return
+
+        start, breaks = self._loops[-1]
+        if stmt.token.type_ == TokenType.BREAK:
+            breaks.append(self._jump(JUMP))
+        else:
+            self._emit(JUMP, start)
+
+    def visit_function_stmt(self, stmt: Stmt.Function) -> None:
+        proto = self._constant(self._proto(stmt, False))
+
+        # A function that calls itself captures its own cell, so the cell has
+        # to exist before the function does.
+        if stmt.storage is Storage.CELL:
+            self._emit(NEW_CELL, stmt.slot)
+            self._emit(CLOSURE, proto, token=stmt.name)
+            self._emit(SET_CELL, stmt.slot)
+            self._emit(POP)
+            return
+
+        self._emit(CLOSURE, proto, token=stmt.name)
+        self._define(stmt)
+
+    def visit_return_stmt(self, stmt: Stmt.Return) -> None:
+        if stmt.value is not None:
+            self.compile(stmt.value)
+        else:
+            self._emit(NIL)
+
+        self._emit(RETURN)
+
+    def visit_class_stmt(self, stmt: Stmt.Class) -> None:
+        methods = tuple(
+            (
+                method.name.lexeme,
+                self._proto(method, method.name.lexeme == CONSTRUCTOR_METHOD_NAME),
+            )
+            for method in stmt.methods
+        )
+        superclass = stmt.superclass.name if stmt.superclass is not None else None
+        proto = ClassProto(stmt.name.lexeme, superclass, stmt.super_slot, methods)
+
+        # As for functions, methods that use the class capture its cell.
+        if stmt.storage is Storage.CELL:
+            self._emit(NEW_CELL, stmt.slot)
+
+        if stmt.superclass is not None:
+            self.compile(stmt.superclass)
+        self._emit(CLASS, self._constant(proto), token=stmt.name)
+
+        if stmt.storage is Storage.CELL:
+            self._emit(SET_CELL, stmt.slot)
+            self._emit(POP)
+        else:
+            self._define(stmt)
+
+
+def instructions(chunk: Chunk) -> Iterator[tuple[int, int, tuple[int, ...]]]:
+    code = chunk.code
+    offset = 0
+
+    while offset < len(code):
+        opcode = code[offset]
+        count = OPERAND_COUNTS[opcode]
+        yield offset, opcode, tuple(code[offset + 1 : offset + 1 + count])
+        offset += 1 + count
+
+
+def _describe(chunk: Chunk, opcode: int, operands: Sequence[int]) -> str:
+    if not operands:
+        return ""
+
+    (operand,) = operands
+    if opcode in (CONSTANT, CLOSURE, CLASS):
+        constant = chunk.constants[operand]
+        if isinstance(constant, (FunctionProto, ClassProto)):
+            return f"{operand} {constant}"
+        return f"{operand} {util.stringify(cast(LoxObject, constant))!r}"
+    if opcode in (GET_PROPERTY, CHECK_INSTANCE, SET_PROPERTY, GET_SUPER):
+        return f"{operand} '{cast(Token, chunk.constants[operand]).lexeme}'"
+    if opcode in (JUMP, JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP):
+        return f"-> {operand:04d}"
+
+    return str(operand)
+
+
+def disassemble(chunk: Chunk) -> str:
+    lines = [f"== {chunk.name} =="]
+    line = None
+
+    for offset, opcode, operands in instructions(chunk):
+        token = chunk.tokens[offset]
+        if token is not None and token.line != line:
+            line = token.line
+            where = f"{line:4d}"
+        else:
+            where = "   |"
+
+        text = f"{offset:04d} {where} {OPCODES[opcode]:<20} "
+        lines.append((text + _describe(chunk, opcode, operands)).rstrip())
+
+    return "\n".join(lines)
+
+
+def nested_protos(chunk: Chunk) -> Iterator[FunctionProto]:
+    for constant in chunk.constants:
+        if isinstance(constant, FunctionProto):
+            yield constant
+        elif isinstance(constant, ClassProto):
+            for _, method in constant.methods:
+                yield method
+
+
+def disassemble_program(
+    interpreter: Interpreter, statements: Sequence[Stmt.Stmt]
+) -> str:
+    """
+    Compiles a resolved program, which must have no lazy bodies left, and
+    disassembles it and every function in it.
+    """
+
+    chunks = [BytecodeCompiler.script(interpreter, statements)]
+    for chunk in chunks:
+        chunks.extend(
+            BytecodeCompiler.function(interpreter, proto)
+            for proto in nested_protos(chunk)
+        )
+
+    return "\n\n".join(disassemble(chunk) for chunk in chunks)
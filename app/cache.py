@@ -0,0 +1,306 @@
+from array import array
+from collections.abc import Iterable, Sequence
+from dataclasses import fields, is_dataclass
+import hashlib
+from importlib.util import MAGIC_NUMBER
+import marshal
+import os
+import tempfile
+from typing import Any, cast
+
+from app import (
+    bytecode,
+    compiler,
+    environment,
+    inference,
+    interpreter,
+    parser,
+    quicken,
+    resolver,
+    runtime,
+    scanner,
+    schema,
+    tiered,
+    token_buffer,
+    transpiler,
+    vm,
+)
+from app import expression as Expr
+from app import statement as Stmt
+from app.interpreter import Interpreter
+from app.scanner import KEYWORDS, OPERATORS
+from app.schema import AstNode, Storage, Token, TokenType
+from app.token_buffer import NUMBER_CODE, STRING_CODE, TOKEN_TYPES, TYPE_CODES
+
+# Compiled programs are stored as MAGIC, the version tag, and then the marshalled
+# program. Bump FORMAT_VERSION when the encoding changes; changes to the AST
+# node classes, the token types or the SOURCE_FILES change the version tag by
+# themselves.
+MAGIC = b"LOXC"
+FORMAT_VERSION = 6
+SUFFIX = ".loxc"
+
+NODE_CLASSES: tuple[type[AstNode], ...] = tuple(
+    cls
+    for module in (Expr, Stmt)
+    for cls in vars(module).values()
+    if isinstance(cls, type) and issubclass(cls, AstNode) and is_dataclass(cls)
+)
+_CLASS_CODES = {cls: code for code, cls in enumerate(NODE_CLASSES)}
+_VARIABLE_CODES = (_CLASS_CODES[Expr.Variable], _CLASS_CODES[Expr.Assign])
+_FIELD_NAMES = tuple(tuple(field.name for field in fields(cls)) for cls in NODE_CLASSES)
+
+# The modules that build the resolved AST or give its fields their meaning. A
+# change to any of them can change what a cached program means (slot numbering,
+# rewrites the resolver makes) without changing the node classes, so their
+# source is part of the version tag too.
+SOURCE_FILES: tuple[str, ...] = (__file__,) + tuple(
+    cast(str, module.__file__)
+    for module in (
+        bytecode,
+        compiler,
+        environment,
+        Expr,
+        inference,
+        interpreter,
+        parser,
+        quicken,
+        resolver,
+        runtime,
+        scanner,
+        schema,
+        Stmt,
+        tiered,
+        token_buffer,
+        transpiler,
+        vm,
+    )
+)
+
+
+def _version_tag(source_files: Iterable[str] = SOURCE_FILES) -> bytes:
+    schema = [str(FORMAT_VERSION), *map(str, TOKEN_TYPES)]
+    for cls, field_names in zip(NODE_CLASSES, _FIELD_NAMES):
+        schema.append(f"{cls.__module__}.{cls.__qualname__}{field_names}")
+
+    digest = hashlib.sha256(MAGIC_NUMBER)
+    digest.update("\n".join(schema).encode())
+    for path in source_files:
+        with open(path, "rb") as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+
+    return digest.digest()[:16]
+
+
+VERSION_TAG = _version_tag()
+
+# The program is flattened into one opcode per node, tuple, token and literal
+# value, with nodes after their fields, so it is rebuilt with a stack rather
+# than by recursion. Integer operands (tuple lengths, storages and token lines)
+# and the remaining values (lexemes, literals and slots) are kept separately.
+_TUPLE = 128  # class codes are below this
+_VALUE = 129
+_STORAGE = 130
+_TOKEN = 131  # + token type code
+_STORAGES = tuple(Storage)
+_STORAGE_CODES = {storage: code for code, storage in enumerate(_STORAGES)}
+assert len(NODE_CLASSES) <= _TUPLE and _TOKEN + len(TOKEN_TYPES) <= 256
+
+# Keywords and operators always have the same lexeme, so only their type and
+# line are stored.
+_FIXED_LEXEMES: dict[int, str] = {
+    TYPE_CODES[type_]: text for text, type_ in (KEYWORDS | OPERATORS).items()
+}
+_FIXED_LEXEMES[TYPE_CODES[TokenType.EOF]] = ""
+
+
+def dump(statements: Sequence[Stmt.Stmt], interpreter: Interpreter) -> bytes:
+    """
+    Serializes a parsed program, resolved against the interpreter.
+    """
+
+    ops = bytearray()
+    operands = array("i")
+    values: list[Any] = []
+
+    # Entries are (op, value), where op is None for a value still to be
+    # flattened. A node or tuple is pushed again with its op under its fields,
+    # so its op is written after theirs.
+    stack: list[tuple[int | None, Any]] = [(_TUPLE, len(statements))]
+    stack.extend((None, statement) for statement in reversed(statements))
+
+    while stack:
+        op, value = stack.pop()
+
+        if op is not None:
+            ops.append(op)
+            if op == _TUPLE:
+                operands.append(value)
+        elif isinstance(value, AstNode):
+            code = _CLASS_CODES[type(value)]
+            stack.append((code, None))
+
+            for name in reversed(_FIELD_NAMES[code]):
+                stack.append((None, getattr(value, name)))
+        elif isinstance(value, tuple):
+            stack.append((_TUPLE, len(value)))
+            stack.extend((None, item) for item in reversed(value))
+        elif isinstance(value, Token):
+            type_code = TYPE_CODES[value.type_]
+            ops.append(_TOKEN + type_code)
+            operands.append(value.line)
+            if type_code not in _FIXED_LEXEMES:
+                values.append(value.lexeme)
+        elif isinstance(value, Storage):
+            ops.append(_STORAGE)
+            operands.append(_STORAGE_CODES[value])
+        else:
+            ops.append(_VALUE)
+            values.append(value)
+
+    slots = interpreter.top_level_slots
+    # The top-level statements nested deep enough to need a higher recursion
+    # limit, by index, and how deep.
+    depths = [
+        (index, interpreter.depths[statement])
+        for index, statement in enumerate(statements)
+        if statement in interpreter.depths
+    ]
+    program = (depths, slots, bytes(ops), operands.tobytes(), values)
+    return MAGIC + VERSION_TAG + marshal.dumps(program)
+
+
+def load(data: bytes, interpreter: Interpreter) -> list[Stmt.Stmt] | None:
+    """
+    Rebuilds a program serialized by dump, and makes room for its globals and
+    top level locals in the interpreter. Returns None if the data is from
+    another version or isn't a compiled program.
+    """
+
+    header = MAGIC + VERSION_TAG
+    if not data.startswith(header):
+        return None
+
+    try:
+        program = marshal.loads(data[len(header) :])
+        depths, slots, ops, operand_bytes, values = program
+    except (EOFError, ValueError, TypeError):
+        return None
+
+    operands = array("i")
+    operands.frombytes(operand_bytes)
+    next_operand = iter(operands).__next__
+    next_value = iter(values).__next__
+
+    stack: list[Any] = []
+
+    for op in ops:
+        if op >= _TOKEN:
+            type_code = op - _TOKEN
+            lexeme = _FIXED_LEXEMES.get(type_code)
+            literal = None
+            if lexeme is None:
+                lexeme = next_value()
+                if type_code == NUMBER_CODE:
+                    literal = float(lexeme)
+                elif type_code == STRING_CODE:
+                    literal = lexeme[1:-1]
+
+            token = Token(TOKEN_TYPES[type_code], lexeme, literal, next_operand())
+            stack.append(token)
+        elif op == _VALUE:
+            stack.append(next_value())
+        elif op == _STORAGE:
+            stack.append(_STORAGES[next_operand()])
+        elif op == _TUPLE:
+            length = next_operand()
+            items = tuple(stack[len(stack) - length :])
+            del stack[len(stack) - length :]
+            stack.append(items)
+        else:
+            field_count = len(_FIELD_NAMES[op])
+            node = NODE_CLASSES[op](*stack[-field_count:])
+            del stack[-field_count:]
+
+            # Global slots are numbered by the interpreter the program is
+            # resolved against, so they're only meaningful in that one.
+            if op in _VARIABLE_CODES and node.storage is Storage.GLOBAL:
+                node.slot = interpreter.globals.slot(node.name.lexeme)
+
+            stack.append(node)
+
+    statements = list(stack[0])
+    for index, depth in depths:
+        interpreter.reserve_depth(statements[index], depth)
+    interpreter.reserve_slots(slots)
+
+    return statements
+
+
+class ProgramCache:
+    """
+    Compiled programs on disk, keyed by a hash of the source and the version
+    tag. Programs are looked up in the writable directory and then in the
+    shared ones, which are only ever read from, so several processes can use
+    them at once. New programs are written to the writable directory, if any.
+    """
+
+    _directory: str | None
+    _shared_directories: tuple[str, ...]
+
+    def __init__(
+        self, directory: str | None, shared_directories: Iterable[str] = ()
+    ) -> None:
+        self._directory = directory
+        self._shared_directories = tuple(shared_directories)
+
+    @staticmethod
+    def key(source: str) -> str:
+        digest = hashlib.sha256(VERSION_TAG)
+        digest.update(source.encode())
+        return digest.hexdigest()
+
+    def load(self, source: str, interpreter: Interpreter) -> list[Stmt.Stmt] | None:
+        filename = self.key(source) + SUFFIX
+        directories = [self._directory] if self._directory is not None else []
+        directories.extend(self._shared_directories)
+
+        for directory in directories:
+            try:
+                with open(os.path.join(directory, filename), "rb") as file:
+                    data = file.read()
+            except OSError:
+                continue
+
+            statements = load(data, interpreter)
+            if statements is not None:
+                return statements
+
+        return None
+
+    def store(
+        self, source: str, statements: Sequence[Stmt.Stmt], interpreter: Interpreter
+    ) -> None:
+        if self._directory is None:
+            return
+
+        data = dump(statements, interpreter)
+        path = os.path.join(self._directory, self.key(source) + SUFFIX)
+
+        # Write to a temporary file and rename it into place, so readers never
+        # see a partly written file. The cache is best effort, so failing to
+        # write it isn't an error.
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            file = tempfile.NamedTemporaryFile(
+                "wb", dir=self._directory, suffix=".tmp", delete=False
+            )
+        except OSError:
+            return
+
+        try:
+            with file:
+                file.write(data)
+            os.replace(file.name, path)
+        except OSError:
+            os.unlink(file.name)
@@ -0,0 +1,736 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Sequence
+import operator
+import sys
+from typing import cast
+
+from app import util
+from app.constants import CONSTRUCTOR_METHOD_NAME
+from app.environment import UNDEFINED, Cell, Frame
+from app.errors import LoxLoopException, LoxReturnException, LoxRuntimeError
+from app import expression as Expr
+from app.interpreter import COMPARISONS, Interpreter
+from app.logger import Logger
+from app.runtime import LoxCallable, LoxClass, LoxFunction, LoxInstance, LoxObject
+from app.schema import OpMode, Storage, Token, TokenType
+from app import statement as Stmt
+from app import validate
+
+# A compiled node: runs it in a call's frame and returns its value. Statements
+# return something too, which is ignored, so an expression statement is just
+# its expression's code.
+Code = Callable[[Frame], LoxObject]
+
+# Frames of compiled functions hold the cells the function captured after its
+# locals, so free variables are read like captured locals, at an offset.
+
+_LOCAL = Storage.LOCAL
+_CELL = Storage.CELL
+_FREE = Storage.FREE
+_BREAK = TokenType.BREAK
+_CONTINUE = TokenType.CONTINUE
+
+_ARITHMETIC: dict[TokenType, Callable[[float, float], LoxObject]] = {
+    TokenType.MINUS: operator.sub,
+    TokenType.STAR: operator.mul,
+    TokenType.SLASH: operator.truediv,
+    **COMPARISONS,
+}
+
+
+def _nothing(frame: Frame) -> LoxObject:
+    return None
+
+
+class FunctionCode:
+    """
+    A function declaration's compiled body, shared by every function value made
+    from it. The body is compiled on the first call, once it's loaded if it was
+    lazy.
+    """
+
+    __slots__ = ("declaration", "body")
+
+    declaration: Stmt.Function
+    body: Code | None
+
+    def __init__(self, declaration: Stmt.Function) -> None:
+        self.declaration = declaration
+        self.body = None
+
+    def compile(self, interpreter: ClosureInterpreter) -> Code:
+        declaration = self.declaration
+        if declaration.body_tokens is not None:
+            interpreter.load_body(declaration)
+
+        compiler = Compiler(interpreter, declaration.frame_size)
+        with interpreter.nested(declaration.depth):
+            self.body = compiler.sequence(declaration.body)
+        return self.body
+
+
+class CompiledFunction(LoxFunction):
+    _code: FunctionCode
+
+    def __init__(
+        self,
+        code: FunctionCode,
+        cells: tuple[Cell, ...],
+        is_initializer: bool,
+        this: LoxInstance | None = None,
+    ) -> None:
+        super().__init__(code.declaration, cells, is_initializer, this)
+        self._code = code
+
+    def bind(self, instance: LoxInstance) -> CompiledFunction:
+        return CompiledFunction(self._code, self._cells, self._is_initializer, instance)
+
+    def call(
+        self, interpreter: Interpreter, arguments: Sequence[LoxObject], token: Token
+    ) -> LoxObject:
+        body = self._code.body
+        if body is None:
+            body = self._code.compile(cast(ClosureInterpreter, interpreter))
+
+        frame = self._new_frame(arguments)
+        frame.extend(self._cells)
+
+        try:
+            if self._declaration.depth:
+                with interpreter.nested(self._declaration.depth):
+                    body(frame)
+            else:
+                body(frame)
+        except LoxReturnException as ret:
+            if self._is_initializer:
+                return self._this
+
+            return ret.value
+        except LoxLoopException as exc:
+            raise LoxRuntimeError(exc.token, "Flow statement used outside loop.")
+
+        if self._is_initializer:
+            return self._this
+
+        return None
+
+
+class Compiler(Expr.Visitor[Code], Stmt.Visitor[Code]):
+    """
+    Turns resolved nodes into nested closures, with each node's operator,
+    variable slot and constant operands bound when it's compiled, so running
+    them skips the accept/visit dispatch and the matching on token types.
+    """
+
+    _interpreter: ClosureInterpreter
+    # Where the cells the function captured start in its frame.
+    _free_base: int
+
+    def __init__(self, interpreter: ClosureInterpreter, free_base: int) -> None:
+        self._interpreter = interpreter
+        self._free_base = free_base
+
+    def compile(self, node: Expr.Expr | Stmt.Stmt) -> Code:
+        return node.accept(self)
+
+    def sequence(self, statements: Sequence[Stmt.Stmt]) -> Code:
+        actions = tuple([self.compile(statement) for statement in statements])
+
+        if len(actions) == 0:
+            return _nothing
+        if len(actions) == 1:
+            return actions[0]
+
+        def sequence(frame: Frame) -> None:
+            for action in actions:
+                action(frame)
+
+        return sequence
+
+    def _load(self, node: Expr.Variable | Expr.This | Expr.Super, name: Token) -> Code:
+        storage = node.storage
+        slot = node.slot
+
+        if storage is _LOCAL:
+
+            def load_local(frame: Frame) -> LoxObject:
+                return frame[slot]
+
+            return load_local
+
+        if storage is _CELL or storage is _FREE:
+            if storage is _FREE:
+                slot += self._free_base
+
+            def load_cell(frame: Frame) -> LoxObject:
+                return frame[slot].value  # type: ignore[union-attr]
+
+            return load_cell
+
+        values = self._interpreter.globals.values
+
+        def load_global(frame: Frame) -> LoxObject:
+            value = values[slot]
+            if value is UNDEFINED:
+                raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+            return value  # type: ignore[return-value]
+
+        return load_global
+
+    def _define(
+        self, stmt: Stmt.Var | Stmt.Function | Stmt.Class
+    ) -> Callable[[Frame, LoxObject], None]:
+        storage = stmt.storage
+        slot = stmt.slot
+
+        if storage is _LOCAL:
+
+            def define_local(frame: Frame, value: LoxObject) -> None:
+                frame[slot] = value
+
+            return define_local
+
+        if storage is _CELL:
+
+            def define_cell(frame: Frame, value: LoxObject) -> None:
+                frame[slot] = Cell(value)
+
+            return define_cell
+
+        values = self._interpreter.globals.values
+        slot = self._interpreter.globals.slot(stmt.name.lexeme)
+
+        def define_global(frame: Frame, value: LoxObject) -> None:
+            values[slot] = value
+
+        return define_global
+
+    def _capture(self, function: Stmt.Function) -> Callable[[Frame], tuple[Cell, ...]]:
+        free_base = self._free_base
+        indices = [
+            capture if capture >= 0 else free_base + ~capture
+            for capture in function.captures
+        ]
+
+        if len(indices) == 0:
+            return lambda frame: ()
+        if len(indices) == 1:
+            (index,) = indices
+            return lambda frame: (frame[index],)  # type: ignore[return-value]
+
+        return cast(Callable[[Frame], tuple[Cell, ...]], operator.itemgetter(*indices))
+
+    def visit_binary_expr(self, expr: Expr.Binary) -> Code:
+        token = expr.operator
+        type_ = token.type_
+        left = self.compile(expr.left)
+
+        if type_ in _ARITHMETIC:
+            op = _ARITHMETIC[type_]
+
+            if type(expr.right) is Expr.Literal and type(expr.right.value) is float:
+                constant = expr.right.value
+
+                def numeric_constant(frame: Frame) -> LoxObject:
+                    a = left(frame)
+                    if type(a) is float:
+                        return op(a, constant)
+                    return op(*validate.number_operands(token, a, constant))
+
+                return numeric_constant
+
+            right = self.compile(expr.right)
+
+            def numeric(frame: Frame) -> LoxObject:
+                a = left(frame)
+                b = right(frame)
+                if type(a) is float and type(b) is float:
+                    return op(a, b)
+                return op(*validate.number_operands(token, a, b))
+
+            return numeric
+
+        right = self.compile(expr.right)
+
+        if type_ == TokenType.PLUS:
+
+            def add(frame: Frame) -> LoxObject:
+                a = left(frame)
+                b = right(frame)
+                if type(a) is type(b) and (type(a) is float or type(a) is str):
+                    return a + b  # type: ignore[operator]
+                return util.add(*validate.number_or_string_operands(token, a, b))
+
+            return add
+
+        if type_ == TokenType.EQUAL_EQUAL:
+            return lambda frame: util.is_equal(left(frame), right(frame))
+        if type_ == TokenType.BANG_EQUAL:
+            return lambda frame: not util.is_equal(left(frame), right(frame))
+
+        def unknown(frame: Frame) -> LoxObject:
+            left(frame)
+            right(frame)
+            return None
+
+        return unknown
+
+    def visit_grouping_expr(self, expr: Expr.Grouping) -> Code:
+        return self.compile(expr.expr)
+
+    def visit_literal_expr(self, expr: Expr.Literal) -> Code:
+        value = expr.value
+        return lambda frame: value
+
+    def visit_unary_expr(self, expr: Expr.Unary) -> Code:
+        token = expr.operator
+        operand = self.compile(expr.expr)
+
+        if token.type_ == TokenType.MINUS:
+
+            def negate(frame: Frame) -> LoxObject:
+                value = operand(frame)
+                if type(value) is float:
+                    return -value
+                return -validate.number_operand(token, value)
+
+            return negate
+
+        if token.type_ == TokenType.BANG:
+
+            def not_(frame: Frame) -> LoxObject:
+                value = operand(frame)
+                return value is None or value is False
+
+            return not_
+
+        def unknown(frame: Frame) -> LoxObject:
+            operand(frame)
+            return None
+
+        return unknown
+
+    def visit_ternary_expr(self, expr: Expr.Ternary) -> Code:
+        condition = self.compile(expr.condition)
+        true_code = self.compile(expr.true_expr)
+        false_code = self.compile(expr.false_expr)
+
+        def ternary(frame: Frame) -> LoxObject:
+            value = condition(frame)
+            if value is not None and value is not False:
+                return true_code(frame)
+            return false_code(frame)
+
+        return ternary
+
+    def visit_variable_expr(self, expr: Expr.Variable) -> Code:
+        return self._load(expr, expr.name)
+
+    def visit_assign_expr(self, expr: Expr.Assign) -> Code:
+        value_code = self.compile(expr.value_expr)
+        storage = expr.storage
+        slot = expr.slot
+        name = expr.name
+
+        if storage is _LOCAL:
+
+            def assign_local(frame: Frame) -> LoxObject:
+                frame[slot] = value = value_code(frame)
+                return value
+
+            return assign_local
+
+        if storage is _CELL or storage is _FREE:
+            if storage is _FREE:
+                slot += self._free_base
+
+            def assign_cell(frame: Frame) -> LoxObject:
+                value = value_code(frame)
+                frame[slot].value = value  # type: ignore[union-attr]
+                return value
+
+            return assign_cell
+
+        globals_ = self._interpreter.globals
+
+        def assign_global(frame: Frame) -> LoxObject:
+            value = value_code(frame)
+            globals_.assign(slot, name, value)
+            return value
+
+        return assign_global
+
+    def visit_logical_expr(self, expr: Expr.Logical) -> Code:
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+
+        if expr.operator.type_ == TokenType.OR:
+
+            def or_(frame: Frame) -> LoxObject:
+                value = left(frame)
+                if value is not None and value is not False:
+                    return value
+                return right(frame)
+
+            return or_
+
+        def and_(frame: Frame) -> LoxObject:
+            value = left(frame)
+            if value is None or value is False:
+                return value
+            return right(frame)
+
+        return and_
+
+    def visit_call_expr(self, expr: Expr.Call) -> Code:
+        callee = self.compile(expr.callee)
+        arguments = [self.compile(argument) for argument in expr.arguments]
+        count = len(arguments)
+        paren = expr.paren
+        interpreter = self._interpreter
+
+        def check(func: LoxObject) -> LoxCallable:
+            if not isinstance(func, LoxCallable):
+                raise LoxRuntimeError(paren, "Can only call functions and classes.")
+            if func.arity() != count:
+                raise LoxRuntimeError(
+                    paren, f"Expected {func.arity()} arguments but got {count}."
+                )
+            return func
+
+        # The common argument counts are unrolled, to skip building the list in
+        # a loop.
+        if count == 0:
+            return lambda frame: check(callee(frame)).call(interpreter, [], paren)
+
+        if count == 1:
+            (first,) = arguments
+
+            def call_1(frame: Frame) -> LoxObject:
+                func = callee(frame)
+                arguments = [first(frame)]
+                return check(func).call(interpreter, arguments, paren)
+
+            return call_1
+
+        if count == 2:
+            first, second = arguments
+
+            def call_2(frame: Frame) -> LoxObject:
+                func = callee(frame)
+                arguments = [first(frame), second(frame)]
+                return check(func).call(interpreter, arguments, paren)
+
+            return call_2
+
+        def call(frame: Frame) -> LoxObject:
+            func = callee(frame)
+            values = [argument(frame) for argument in arguments]
+            return check(func).call(interpreter, values, paren)
+
+        return call
+
+    def visit_get_expr(self, expr: Expr.Get) -> Code:
+        object_code = self.compile(expr.object)
+        name = expr.name
+
+        def get(frame: Frame) -> LoxObject:
+            object_ = object_code(frame)
+            if not isinstance(object_, LoxInstance):
+                raise LoxRuntimeError(name, "Only instances have properties.")
+
+            return object_.get(name)
+
+        return get
+
+    def visit_set_expr(self, expr: Expr.Set) -> Code:
+        object_code = self.compile(expr.object)
+        value_code = self.compile(expr.value)
+        name = expr.name
+
+        def set_(frame: Frame) -> LoxObject:
+            object_ = object_code(frame)
+            if not isinstance(object_, LoxInstance):
+                raise LoxRuntimeError(name, "Only instances have fields.")
+
+            value = value_code(frame)
+            object_.set(name, value)
+            return value
+
+        return set_
+
+    def visit_this_expr(self, expr: Expr.This) -> Code:
+        return self._load(expr, expr.keyword)
+
+    def visit_super_expr(self, expr: Expr.Super) -> Code:
+        load_superclass = self._load(expr, expr.keyword)
+        load_this = self._load(expr.this, expr.keyword)
+        method_name = expr.method
+
+        def super_(frame: Frame) -> LoxObject:
+            superclass = load_superclass(frame)
+            object_ = load_this(frame)
+
+            assert isinstance(superclass, LoxClass)
+            assert isinstance(object_, LoxInstance)
+
+            method = superclass.find_method(method_name.lexeme)
+            if method is None:
+                raise LoxRuntimeError(
+                    method_name, f"Undefined property '{method_name.lexeme}'."
+                )
+
+            return method.bind(object_)
+
+        return super_
+
+    def visit_expression_stmt(self, stmt: Stmt.Expression) -> Code:
+        return self.compile(stmt.expr)
+
+    def visit_print_stmt(self, stmt: Stmt.Print) -> Code:
+        value_code = self.compile(stmt.expr)
+
+        def print_(frame: Frame) -> None:
+            print(util.stringify(value_code(frame)), file=sys.stdout)
+
+        return print_
+
+    def visit_var_stmt(self, stmt: Stmt.Var) -> Code:
+        initializer = (
+            self.compile(stmt.initializer)
+            if stmt.initializer is not None
+            else _nothing
+        )
+
+        if stmt.storage is _LOCAL:
+            slot = stmt.slot
+
+            def var_local(frame: Frame) -> None:
+                frame[slot] = initializer(frame)
+
+            return var_local
+
+        define = self._define(stmt)
+
+        def var(frame: Frame) -> None:
+            define(frame, initializer(frame))
+
+        return var
+
+    def visit_block_stmt(self, stmt: Stmt.Block) -> Code:
+        return self.sequence(stmt.statements)
+
+    def visit_if_stmt(self, stmt: Stmt.If) -> Code:
+        condition = self.compile(stmt.condition)
+        then_code = self.compile(stmt.then_stmt)
+
+        if stmt.else_stmt is None:
+
+            def if_(frame: Frame) -> None:
+                value = condition(frame)
+                if value is not None and value is not False:
+                    then_code(frame)
+
+            return if_
+
+        else_code = self.compile(stmt.else_stmt)
+
+        def if_else(frame: Frame) -> None:
+            value = condition(frame)
+            if value is not None and value is not False:
+                then_code(frame)
+            else:
+                else_code(frame)
+
+        return if_else
+
+    def visit_while_stmt(self, stmt: Stmt.While) -> Code:
+        if stmt.counter is not None:
+            return self._counted_loop(stmt, stmt.counter)
+
+        condition = self.compile(stmt.condition)
+        body = self.compile(stmt.body)
+
+        def while_(frame: Frame) -> None:
+            while True:
+                value = condition(frame)
+                if value is None or value is False:
+                    break
+
+                try:
+                    body(frame)
+                except LoxLoopException as exc:
+                    if exc.token.type_ is _BREAK:
+                        break
+                    elif exc.token.type_ is _CONTINUE:
+                        continue
+
+                    raise exc
+
+        return while_
+
+    def _counted_loop(self, stmt: Stmt.While, slot: int) -> Code:
+        # As Interpreter._execute_counted_loop.
+        condition = cast(Expr.Binary, stmt.condition)
+        token = condition.operator
+        compare = COMPARISONS[token.type_]
+        limit_expr = condition.right
+        constant_limit = (
+            limit_expr.value if type(limit_expr) is Expr.Literal else None
+        )
+        limit_code = self.compile(limit_expr)
+
+        statements = (
+            stmt.body.statements if type(stmt.body) is Stmt.Block else (stmt.body,)
+        )
+        *body_statements, increment_stmt = statements
+        body = self.sequence(body_statements)
+        increment_expr = cast(Stmt.Expression, increment_stmt).expr
+        increment = self.compile(increment_expr)
+        step_expr = cast(Expr.Binary, cast(Expr.Assign, increment_expr).value_expr)
+        step = cast(float, cast(Expr.Literal, step_expr.right).value)
+        if step_expr.operator.type_ == TokenType.MINUS:
+            step = -step
+
+        def counted_loop(frame: Frame) -> None:
+            while True:
+                counter = frame[slot]
+                limit = (
+                    constant_limit if constant_limit is not None else limit_code(frame)
+                )
+                if type(counter) is not float or type(limit) is not float:
+                    counter, limit = validate.number_operands(token, counter, limit)
+                if not compare(counter, limit):
+                    break
+
+                try:
+                    body(frame)
+                except LoxLoopException as exc:
+                    if exc.token.type_ is _BREAK:
+                        break
+                    elif exc.token.type_ is _CONTINUE:
+                        continue
+
+                    raise exc
+
+                counter = frame[slot]
+                if type(counter) is float:
+                    frame[slot] = counter + step
+                else:
+                    increment(frame)
+
+        return counted_loop
+
+    def visit_flow_stmt(self, stmt: Stmt.Flow) -> Code:
+        token = stmt.token
+
+        def flow(frame: Frame) -> None:
+            raise LoxLoopException(token)
+
+        return flow
+
+    def visit_function_stmt(self, stmt: Stmt.Function) -> Code:
+        code = FunctionCode(stmt)
+        capture = self._capture(stmt)
+
+        # As in the tree walker, a function that calls itself captures its own
+        # cell, so the cell has to exist before the function does.
+        if stmt.storage is _CELL:
+            slot = stmt.slot
+
+            def function_in_cell(frame: Frame) -> None:
+                cell = Cell(None)
+                frame[slot] = cell
+                cell.value = CompiledFunction(code, capture(frame), False)
+
+            return function_in_cell
+
+        define = self._define(stmt)
+
+        def function(frame: Frame) -> None:
+            define(frame, CompiledFunction(code, capture(frame), False))
+
+        return function
+
+    def visit_return_stmt(self, stmt: Stmt.Return) -> Code:
+        keyword = stmt.keyword
+        value_code = self.compile(stmt.value) if stmt.value is not None else _nothing
+
+        def return_(frame: Frame) -> None:
+            raise LoxReturnException(keyword, value_code(frame))
+
+        return return_
+
+    def visit_class_stmt(self, stmt: Stmt.Class) -> Code:
+        superclass_expr = stmt.superclass
+        superclass_code = (
+            self.compile(superclass_expr) if superclass_expr is not None else None
+        )
+        methods = [
+            (
+                method.name.lexeme,
+                FunctionCode(method),
+                self._capture(method),
+                method.name.lexeme == CONSTRUCTOR_METHOD_NAME,
+            )
+            for method in stmt.methods
+        ]
+        name = stmt.name.lexeme
+        in_cell = stmt.storage is _CELL
+        slot = stmt.slot
+        super_slot = stmt.super_slot
+        define = self._define(stmt)
+
+        def class_(frame: Frame) -> None:
+            superclass = None
+            if superclass_code is not None:
+                superclass = superclass_code(frame)
+
+                if not isinstance(superclass, LoxClass):
+                    raise LoxRuntimeError(
+                        superclass_expr.name,  # type: ignore[union-attr]
+                        "Superclass must be a class.",
+                    )
+
+            cell = None
+            if in_cell:
+                cell = frame[slot] = Cell(None)
+
+            if superclass is not None:
+                frame[super_slot] = Cell(superclass)
+
+            functions: dict[str, LoxFunction] = {
+                method_name: CompiledFunction(code, capture(frame), is_initializer)
+                for method_name, code, capture, is_initializer in methods
+            }
+
+            class_ = LoxClass(name, superclass, functions)
+
+            if cell is not None:
+                cell.value = class_
+            else:
+                define(frame, class_)
+
+        return class_
+
+
+class ClosureInterpreter(Interpreter):
+    """
+    Runs programs by compiling each top-level statement, and each function
+    body on its first call, with a Compiler, instead of walking the AST.
+    """
+
+    _compiler: Compiler
+
+    def __init__(self, logger: Logger, op_mode: OpMode):
+        super().__init__(logger, op_mode)
+        self._compiler = Compiler(self, 0)
+
+    def _execute_mode(self, statement: Stmt.Stmt) -> None:
+        if self._op_mode == OpMode.REPL and isinstance(statement, Stmt.Expression):
+            value = self._compiler.compile(statement.expr)(self._frame)
+            print(util.stringify(value), file=sys.stdout)
+            return
+
+        self._compiler.compile(statement)(self._frame)
@@ -9,65 +9,82 @@ if TYPE_CHECKING:
     from app.runtime import LoxObject
 
 
-class Environment:
-    _values: dict[str, LoxObject]
-    _enclosing: Environment | None
+class Cell:
+    """
+    A local that a function declared in its scope captures. The frame slot
+    holds the cell, and the function keeps the cell rather than the frame, so
+    it only keeps alive the variables it uses.
+    """
 
-    def __init__(self, enclosing: Environment | None = None) -> None:
-        self._values = {}
-        self._enclosing = enclosing
+    __slots__ = ("value",)
 
-    def define(self, name: str, value: LoxObject) -> None:
-        self._values[name] = value
+    value: LoxObject
+
+    def __init__(self, value: LoxObject) -> None:
+        self.value = value
+
+
+# A call's locals, by slot. Captured locals hold a Cell.
+Frame = list["LoxObject | Cell"]
+
+
+class Undefined:
+    """
+    The value of a global that has been referred to but not defined (yet).
+    """
 
-    def get(self, name: Token) -> LoxObject:
-        lexeme = name.lexeme
+    __slots__ = ()
 
-        if lexeme in self._values:
-            return self._values[lexeme]
+    def __repr__(self) -> str:
+        return "UNDEFINED"
 
-        if self._enclosing is not None:
-            return self._enclosing.get(name)
 
-        raise LoxRuntimeError(name, "Undefined variable '" + lexeme + "'.")
+UNDEFINED = Undefined()
 
-    def get_level_and_assert(self, name: str) -> LoxObject:
-        assert name in self._values, "Variable not found on get -- resolver mismatch."
-        return self._values[name]
 
-    def get_at(self, distance: int, name: str) -> LoxObject:
-        environment = self._ancestor(distance)
-        return environment.get_level_and_assert(name)
+class GlobalEnvironment:
+    """
+    The outermost scope. Globals can be defined after the code that uses them
+    is resolved, or never, so each name gets a slot the first time it's seen,
+    which holds UNDEFINED until the global is defined.
+    """
 
-    def assign(self, name: Token, value: LoxObject) -> None:
-        lexeme = name.lexeme
+    values: list[LoxObject | Undefined]
+    _slots: dict[str, int]
 
-        if lexeme in self._values:
-            self._values[lexeme] = value
-            return
+    def __init__(self) -> None:
+        self.values = []
+        self._slots = {}
 
-        if self._enclosing is not None:
-            self._enclosing.assign(name, value)
-            return
+    def slot(self, name: str) -> int:
+        slot = self._slots.get(name)
+
+        if slot is None:
+            slot = self._slots[name] = len(self.values)
+            self.values.append(UNDEFINED)
+
+        return slot
+
+    def names(self) -> list[str]:
+        """
+        The name of each global, by slot.
+        """
+
+        return list(self._slots)
+
+    def define(self, name: str, value: LoxObject) -> None:
+        self.values[self.slot(name)] = value
 
-        raise LoxRuntimeError(name, "Undefined variable '" + lexeme + "'.")
+    def get(self, slot: int, name: Token) -> LoxObject:
+        value = self.values[slot]
 
-    def assign_level_and_assert(self, name: Token, value: LoxObject) -> None:
-        assert (
-            name.lexeme in self._values
-        ), "Variable not found on assign -- resolver mismatch."
-        self._values[name.lexeme] = value
+        if value is UNDEFINED:
+            raise LoxRuntimeError(name, "Undefined variable '" + name.lexeme + "'.")
 
-    def assign_at(self, distance: int, name: Token, value: LoxObject) -> None:
-        environment = self._ancestor(distance)
-        environment.assign_level_and_assert(name, value)
+        return value  # type: ignore[return-value]
 
-    def _ancestor(self, distance: int) -> Environment:
-        environment = self
-        for _ in range(distance):
-            assert (
-                environment._enclosing is not None
-            ), "Environment not found -- resolver mismatch."
-            environment = environment._enclosing
+    def assign(self, slot: int, name: Token, value: LoxObject) -> None:
+        if self.values[slot] is UNDEFINED:
+            raise LoxRuntimeError(name, "Undefined variable '" + name.lexeme + "'.")
 
-        return environment
+        self.values[slot] = value
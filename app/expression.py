@@ -5,10 +5,13 @@ from dataclasses import dataclass
 from typing import Generic, TypeVar
 
 from app.runtime import LoxObject
-from app.schema import AstNode, Token
+from app.schema import AstNode, Storage, Token
 
-# All AstNode dataclasses are @dataclass(frozen=True, eq=False)
-# Because we want to inherit __hash__ from AstNode
+# All AstNode dataclasses are @dataclass(slots=True, eq=False)
+# Because we want to inherit __hash__ from AstNode, and slotted nodes are much
+# smaller and quicker to build than frozen ones. Child lists are tuples.
+# Nodes that refer to variables also carry what the resolver found out about
+# them, so it's freed along with the program.
 
 R = TypeVar("R", covariant=True)
 
@@ -55,21 +58,27 @@ class Visitor(Generic[R], ABC):
 
 
 class Expr(AstNode):
+    __slots__ = ()
+
     @abstractmethod
     def accept(self, visitor: Visitor[R]) -> R: ...
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Binary(Expr):
     left: Expr
     operator: Token
     right: Expr
 
+    # How many times the tree walker has run the node, and then the variant it
+    # specialized into, see app.quicken.
+    quick: int = 0
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_binary_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Ternary(Expr):
     condition: Expr
     true_expr: Expr
@@ -79,7 +88,7 @@ class Ternary(Expr):
         return visitor.visit_ternary_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Grouping(Expr):
     expr: Expr
 
@@ -87,7 +96,7 @@ class Grouping(Expr):
         return visitor.visit_grouping_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Literal(Expr):
     value: LoxObject
 
@@ -95,53 +104,73 @@ class Literal(Expr):
         return visitor.visit_literal_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Unary(Expr):
     operator: Token
     expr: Expr
 
+    # How many times the tree walker has run the node, and then the variant it
+    # specialized into, see app.quicken.
+    quick: int = 0
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_unary_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Variable(Expr):
     name: Token
 
+    # Where the resolver found the variable, and its slot or index there.
+    storage: Storage = Storage.GLOBAL
+    slot: int = 0
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_variable_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Assign(Expr):
     name: Token
     value_expr: Expr
 
+    # Where the resolver found the variable, and its slot or index there.
+    storage: Storage = Storage.GLOBAL
+    slot: int = 0
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_assign_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Logical(Expr):
     left: Expr
     operator: Token
     right: Expr
 
+    # How many times the tree walker has run the node, and then the variant it
+    # specialized into, see app.quicken.
+    quick: int = 0
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_logical_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Call(Expr):
     callee: Expr
     paren: Token
-    arguments: list[Expr]
+    arguments: tuple[Expr, ...]
+
+    # How many times the tree walker has run the node, and then the variant it
+    # specialized into, see app.quicken.
+    quick: int = 0
 
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_call_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Get(Expr):
     object: Expr
     name: Token
@@ -150,7 +179,7 @@ class Get(Expr):
         return visitor.visit_get_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Set(Expr):
     object: Expr
     name: Token
@@ -160,18 +189,28 @@ class Set(Expr):
         return visitor.visit_set_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class This(Expr):
     keyword: Token
 
+    # Where the resolver found the variable, and its slot or index there.
+    storage: Storage = Storage.GLOBAL
+    slot: int = 0
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_this_expr(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Super(Expr):
     keyword: Token
     method: Token
+    # The instance the method is bound to.
+    this: This
+
+    # Where the resolver found the variable, and its slot or index there.
+    storage: Storage = Storage.GLOBAL
+    slot: int = 0
 
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_super_expr(self)
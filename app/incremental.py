@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+from app.logger import Logger
+from app.scanner import LOOKAHEAD, Scanner
+from app.schema import Token
+from app.token_buffer import EOF_CODE, TokenBuffer, build_token
+
+# Tokens are kept in pages of at most this many. An edit rebuilds the pages it
+# touches and shifts the base offset and line of the pages after them, so its
+# cost depends on the size of the edit and the number of pages, not on the
+# number of tokens.
+PAGE_SIZE = 1024
+
+
+class _Page:
+    """
+    A run of tokens in the same columns as a TokenBuffer. The stored offsets
+    and lines are relative: the absolute values are the stored ones plus the
+    page's offset and line.
+    """
+
+    __slots__ = ("offset", "line", "types", "starts", "ends", "lines")
+
+    offset: int
+    line: int
+    types: array[int]
+    starts: array[int]
+    ends: array[int]
+    lines: array[int]
+
+    def __init__(
+        self, types: array[int], starts: array[int], ends: array[int], lines: array[int]
+    ) -> None:
+        self.offset = 0
+        self.line = 0
+        self.types = types
+        self.starts = starts
+        self.ends = ends
+        self.lines = lines
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def start(self, index: int) -> int:
+        return self.starts[index] + self.offset
+
+    def end(self, index: int) -> int:
+        return self.ends[index] + self.offset
+
+    def absolute_columns(
+        self, first: int, last: int, offset_delta: int = 0, line_delta: int = 0
+    ) -> tuple[list[int], list[int], list[int], list[int]]:
+        offset = self.offset + offset_delta
+        line = self.line + line_delta
+
+        return (
+            list(self.types[first:last]),
+            [start + offset for start in self.starts[first:last]],
+            [end + offset for end in self.ends[first:last]],
+            [token_line + line for token_line in self.lines[first:last]],
+        )
+
+
+def _paginate(
+    types: list[int], starts: list[int], ends: list[int], lines: list[int]
+) -> list[_Page]:
+    pages = []
+
+    for first in range(0, len(types), PAGE_SIZE):
+        last = first + PAGE_SIZE
+        page = _Page(
+            array("B", types[first:last]),
+            array("I", starts[first:last]),
+            array("I", ends[first:last]),
+            array("I", lines[first:last]),
+        )
+        pages.append(page)
+
+    return pages
+
+
+@dataclass(frozen=True)
+class Relex:
+    """
+    Describes how an edit changed the token stream: the removed tokens at
+    [start, start + removed) in the old stream were replaced by the inserted
+    tokens at [start, start + inserted) in the new one. Tokens after them are
+    unchanged apart from their offsets and lines.
+    """
+
+    start: int
+    removed: int
+    inserted: int
+
+
+class IncrementalLexer:
+    """
+    Holds a source text and its tokens, and updates both for each edit by
+    rescanning from just before the edit until the new tokens line up with
+    the old ones again.
+
+    Diagnostics are only reported for the text that gets rescanned.
+    """
+
+    _logger: Logger
+    _source: str
+    _pages: list[_Page]
+
+    def __init__(self, logger: Logger, source: str) -> None:
+        self._logger = logger
+        self._source = source
+
+        buffer = Scanner(logger, source).scan_buffer()
+        columns = (buffer.types, buffer.starts, buffer.ends, buffer.lines)
+        self._pages = _paginate(*map(list, columns))
+
+    @property
+    def source(self) -> str:
+        return self._source
+
+    def __len__(self) -> int:
+        return sum(len(page) for page in self._pages)
+
+    def __iter__(self) -> Iterator[Token]:
+        source = self._source
+
+        for page in self._pages:
+            columns = zip(page.types, page.starts, page.ends, page.lines)
+            for code, start, end, line in columns:
+                start += page.offset
+                end += page.offset
+                yield build_token(source, code, start, end, line + page.line)
+
+    def to_buffer(self) -> TokenBuffer:
+        buffer = TokenBuffer(self._source)
+
+        for page in self._pages:
+            types, starts, ends, lines = page.absolute_columns(0, len(page))
+            buffer.types.extend(types)
+            buffer.starts.extend(starts)
+            buffer.ends.extend(ends)
+            buffer.lines.extend(lines)
+
+        return buffer
+
+    def edit(self, offset: int, deleted: int, inserted: str) -> Relex:
+        """
+        Replaces the deleted characters at offset with inserted and rescans
+        the affected tokens.
+        """
+
+        old_source = self._source
+        edit_end = offset + deleted
+        if offset < 0 or deleted < 0 or edit_end > len(old_source):
+            raise ValueError(f"Edit {offset}:{edit_end} is outside the source.")
+
+        offset_delta = len(inserted) - deleted
+        line_delta = inserted.count("\n") - old_source.count("\n", offset, edit_end)
+
+        source = old_source[:offset] + inserted + old_source[edit_end:]
+        self._source = source
+
+        # The first token that might change is the first one whose lexeme
+        # could have been decided by a character at or after the edit. Every
+        # token ends with a page, since the last page ends with the EOF.
+        first_page = 0
+        first_index = 0
+        removed_start = 0
+        for first_page, page in enumerate(self._pages):
+            if page.end(len(page) - 1) + LOOKAHEAD > offset:
+                safe_end = offset - LOOKAHEAD - page.offset
+                first_index = bisect_right(page.ends, safe_end)
+                break
+
+            removed_start += len(page)
+        removed_start += first_index
+
+        # Rescan from the end of the token before it.
+        rescan_start = 0
+        rescan_line = 1
+        if first_index > 0:
+            page = self._pages[first_page]
+            rescan_start = page.end(first_index - 1)
+            rescan_line = page.lines[first_index - 1] + page.line
+        elif first_page > 0:
+            page = self._pages[first_page - 1]
+            rescan_start = page.end(len(page) - 1)
+            rescan_line = page.lines[-1] + page.line
+
+        # Old tokens that start after the edit are candidates to resync with.
+        # Once a new token starts where one of them now starts, the text and
+        # the scanner state from there on are the same as before.
+        removed = -first_index
+        old_page = first_page
+        while True:
+            page = self._pages[old_page]
+            old_index = bisect_left(page.starts, edit_end - page.offset)
+            if old_index < len(page):
+                break
+
+            removed += len(page)
+            old_page += 1
+
+        new_types: list[int] = []
+        new_starts: list[int] = []
+        new_ends: list[int] = []
+        new_lines: list[int] = []
+        is_synced = False
+
+        scanner = Scanner(self._logger, source)
+        spans = scanner.iter_spans(start=rescan_start, first_line=rescan_line)
+        for code, start, end, line in spans:
+            while True:
+                page = self._pages[old_page]
+                if old_index == len(page):
+                    removed += len(page)
+                    old_page += 1
+                    old_index = 0
+                    continue
+
+                if page.start(old_index) + offset_delta >= start:
+                    break
+                old_index += 1
+
+            if page.start(old_index) + offset_delta == start:
+                is_synced = True
+                break
+
+            new_types.append(code)
+            new_starts.append(start)
+            new_ends.append(end)
+            new_lines.append(line)
+
+        if not is_synced:
+            # Nothing lined up, so everything up to the EOF was replaced.
+            removed += sum(map(len, self._pages[old_page:-1]))
+            old_page = len(self._pages) - 1
+            old_index = len(self._pages[-1])
+
+            eof_line = rescan_line + source.count("\n", rescan_start)
+            new_types.append(EOF_CODE)
+            new_starts.append(len(source))
+            new_ends.append(len(source))
+            new_lines.append(eof_line)
+
+        removed += old_index
+
+        # Rebuild the touched pages from the untouched prefix of the first,
+        # the new tokens and the untouched suffix of the last.
+        first = self._pages[first_page]
+        last = self._pages[old_page]
+
+        prefix = first.absolute_columns(0, first_index)
+        suffix = last.absolute_columns(old_index, len(last), offset_delta, line_delta)
+        new_columns = (new_types, new_starts, new_ends, new_lines)
+        columns = (
+            prefix_column + new_column + suffix_column
+            for prefix_column, new_column, suffix_column in zip(
+                prefix, new_columns, suffix
+            )
+        )
+        pages = _paginate(*columns)
+
+        for page in self._pages[old_page + 1 :]:
+            page.offset += offset_delta
+            page.line += line_delta
+
+        self._pages[first_page : old_page + 1] = pages
+
+        return Relex(removed_start, removed, len(new_types))
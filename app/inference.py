@@ -0,0 +1,279 @@
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from dataclasses import dataclass, field, fields
+from enum import IntFlag
+from typing import cast
+
+from app import expression as Expr
+from app import statement as Stmt
+from app.schema import AstNode, Storage, TokenType
+
+# Static types are the kinds of value an expression or local can hold, worked
+# out from literals, operators and what's assigned to the locals no function
+# captures. They're conservative: an expression's value is always of a kind in
+# its type, unless evaluating it raises first. Parameters, globals, captured
+# variables, calls and properties can hold anything.
+
+
+class StaticType(IntFlag):
+    NIL = 1
+    BOOL = 2
+    NUMBER = 4
+    STRING = 8
+    # Functions, classes and instances.
+    OBJECT = 16
+
+    ANY = NIL | BOOL | NUMBER | STRING | OBJECT
+
+
+Types = Mapping[int, StaticType]
+
+_NEVER = StaticType(0)
+_NIL = StaticType.NIL
+_BOOL = StaticType.BOOL
+_NUMBER = StaticType.NUMBER
+_STRING = StaticType.STRING
+_OBJECT = StaticType.OBJECT
+_ANY = StaticType.ANY
+
+_LOCAL = Storage.LOCAL
+
+# The operators that evaluate to a number or raise.
+_NUMERIC_OPERATORS = {TokenType.MINUS, TokenType.STAR, TokenType.SLASH}
+# The operators that evaluate to a bool or raise.
+_BOOLEAN_OPERATORS = {
+    TokenType.LESS,
+    TokenType.LESS_EQUAL,
+    TokenType.GREATER,
+    TokenType.GREATER_EQUAL,
+    TokenType.EQUAL_EQUAL,
+    TokenType.BANG_EQUAL,
+}
+
+
+def walk(nodes: Iterable[AstNode]) -> Iterator[AstNode]:
+    """
+    Every node in the statements, but not in the bodies of the functions they
+    declare, which run in frames of their own.
+    """
+
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        yield node
+        if type(node) is Stmt.Function:
+            continue
+
+        for field_ in fields(node):  # type: ignore[arg-type]
+            value = getattr(node, field_.name)
+            if isinstance(value, AstNode):
+                stack.append(value)
+            elif type(value) is tuple:
+                stack.extend(child for child in value if isinstance(child, AstNode))
+
+
+def _literal_type(value: object) -> StaticType:
+    if value is None:
+        return _NIL
+    if type(value) is bool:
+        return _BOOL
+    if type(value) is float:
+        return _NUMBER
+    if type(value) is str:
+        return _STRING
+
+    return _ANY
+
+
+def type_of(
+    expr: Expr.Expr,
+    locals_: Types,
+    cache: dict[Expr.Expr, StaticType] | None = None,
+) -> StaticType:
+    """
+    The static type of the expression, given the static types of the locals
+    in some of the slots. The others can hold anything. The types of the
+    expression and those in it are kept in the cache, if given, which is only
+    good for the same locals.
+    """
+
+    if cache is not None:
+        type_ = cache.get(expr)
+        if type_ is None:
+            type_ = cache[expr] = _type_of(expr, locals_, cache)
+        return type_
+
+    return _type_of(expr, locals_, None)
+
+
+def _type_of(
+    expr: Expr.Expr, locals_: Types, cache: dict[Expr.Expr, StaticType] | None
+) -> StaticType:
+    kind = type(expr)
+
+    if kind is Expr.Grouping:
+        return type_of(cast(Expr.Grouping, expr).expr, locals_, cache)
+    if kind is Expr.Literal:
+        return _literal_type(cast(Expr.Literal, expr).value)
+    if kind is Expr.Variable:
+        variable = cast(Expr.Variable, expr)
+        if variable.storage is _LOCAL:
+            return locals_.get(variable.slot, _ANY)
+        return _ANY
+    if kind is Expr.Assign:
+        return type_of(cast(Expr.Assign, expr).value_expr, locals_, cache)
+    if kind is Expr.Set:
+        return type_of(cast(Expr.Set, expr).value, locals_, cache)
+    if kind is Expr.Unary:
+        operator_ = cast(Expr.Unary, expr).operator.type_
+        if operator_ == TokenType.MINUS:
+            return _NUMBER
+        if operator_ == TokenType.BANG:
+            return _BOOL
+        # As in the tree walker, anything else evaluates to nil.
+        return _NIL
+    if kind is Expr.Binary:
+        binary = cast(Expr.Binary, expr)
+        operator_ = binary.operator.type_
+        if operator_ in _NUMERIC_OPERATORS:
+            return _NUMBER
+        if operator_ in _BOOLEAN_OPERATORS:
+            return _BOOL
+        if operator_ == TokenType.PLUS:
+            # Two numbers or two strings, or it raises.
+            left = type_of(binary.left, locals_, cache)
+            right = type_of(binary.right, locals_, cache)
+            return left & right & (_NUMBER | _STRING)
+        return _NIL
+    if kind is Expr.Logical:
+        logical = cast(Expr.Logical, expr)
+        left = type_of(logical.left, locals_, cache)
+        return left | type_of(logical.right, locals_, cache)
+    if kind is Expr.Ternary:
+        ternary = cast(Expr.Ternary, expr)
+        true_type = type_of(ternary.true_expr, locals_, cache)
+        return true_type | type_of(ternary.false_expr, locals_, cache)
+
+    return _ANY
+
+
+def local_types(
+    statements: Sequence[Stmt.Stmt], assumed: Types | None = None
+) -> dict[int, StaticType]:
+    """
+    The static types of the locals the statements declare, and of those
+    assumed to have a type to begin with: everything assigned to each of them
+    in the statements, given the others' types.
+    """
+
+    types = dict(assumed or {})
+    # What's assigned to each slot, as an expression or, for nil and the
+    # functions and classes declared, a type.
+    writes: list[tuple[int, Expr.Expr | StaticType]] = []
+
+    for node in walk(statements):
+        if type(node) is Stmt.Var and node.storage is _LOCAL:
+            types.setdefault(node.slot, _NEVER)
+            initializer = node.initializer
+            writes.append((node.slot, _NIL if initializer is None else initializer))
+        elif type(node) is Expr.Assign and node.storage is _LOCAL:
+            writes.append((node.slot, node.value_expr))
+        elif type(node) in (Stmt.Function, Stmt.Class):
+            declaration = cast(Stmt.Function | Stmt.Class, node)
+            if declaration.storage is _LOCAL:
+                types.setdefault(declaration.slot, _NEVER)
+                writes.append((declaration.slot, _OBJECT))
+
+    changed = True
+    while changed:
+        changed = False
+        for slot, value in writes:
+            type_ = types.get(slot)
+            if type_ is None:
+                # A parameter, or a local from outside, which can be anything.
+                continue
+
+            if not isinstance(value, StaticType):
+                value = type_of(value, types)
+            if type_ | value != type_:
+                types[slot] = type_ | value
+                changed = True
+
+    return types
+
+
+def _is_known(type_: StaticType) -> bool:
+    # Whether values of the type are all of one kind.
+    return type_ in (_NIL, _BOOL, _NUMBER, _STRING, _OBJECT)
+
+
+@dataclass
+class TypeCoverage:
+    """
+    How many of the locals and expressions in each function, and at the top
+    level, have a static type of one kind of value.
+    """
+
+    # (name, line, typed locals, locals, typed expressions, expressions)
+    rows: list[tuple[str, int, int, int, int, int]] = field(default_factory=list)
+
+    def report(self) -> str:
+        lines = [
+            f"{'function':<16} {'line':>5} {'locals':>9} {'expressions':>12}"
+            f" {'typed':>7}"
+        ]
+        for name, line, *counts in self.rows:
+            lines.append(_coverage_row(name, str(line), *counts))
+
+        totals = [sum(row[column] for row in self.rows) for column in range(2, 6)]
+        lines.append(_coverage_row("total", "", *totals))
+
+        return "\n".join(lines)
+
+
+def _coverage_row(
+    name: str, line: str, typed_locals: int, locals_: int, typed: int, expressions: int
+) -> str:
+    rate = f"{typed / expressions:.1%}" if expressions else "-"
+    return (
+        f"{name:<16} {line:>5} {f'{typed_locals}/{locals_}':>9}"
+        f" {f'{typed}/{expressions}':>12} {rate:>7}"
+    )
+
+
+def coverage(statements: Sequence[Stmt.Stmt]) -> TypeCoverage:
+    """
+    The static type coverage of a program, with the top level as <script>.
+    Bodies that haven't been loaded yet count as empty.
+    """
+
+    result = TypeCoverage()
+    scopes: list[tuple[str, int, Sequence[Stmt.Stmt], int]] = [
+        ("<script>", 0, statements, 0)
+    ]
+
+    while scopes:
+        name, line, body, params = scopes.pop()
+        types = local_types(body)
+        cache: dict[Expr.Expr, StaticType] = {}
+
+        locals_ = typed_locals = expressions = typed = 0
+        for node in walk(body):
+            if isinstance(node, Expr.Expr):
+                expressions += 1
+                typed += _is_known(type_of(node, types, cache))
+            elif isinstance(node, (Stmt.Var, Stmt.Function, Stmt.Class)):
+                if node.storage is _LOCAL:
+                    locals_ += 1
+                    typed_locals += _is_known(types[node.slot])
+
+            if type(node) is Stmt.Function:
+                scopes.append(
+                    (node.name.lexeme, node.name.line, node.body, len(node.params))
+                )
+
+        result.rows.append(
+            (name, line, typed_locals, locals_ + params, typed, expressions)
+        )
+
+    result.rows.sort(key=lambda row: row[1])
+    return result
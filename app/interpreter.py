@@ -1,92 +1,306 @@
-from collections.abc import Sequence
+from __future__ import annotations
+
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+import operator
 import sys
-from typing import cast
+from typing import TYPE_CHECKING, cast
 from app import builtins, util
-from app.constants import CONSTRUCTOR_METHOD_NAME, SUPER_KEYWORD, THIS_KEYWORD
-from app.environment import Environment
-from app.errors import LoxLoopException, LoxReturnException, LoxRuntimeError
+from app.constants import CONSTRUCTOR_METHOD_NAME
+from app.environment import UNDEFINED, Cell, Frame, GlobalEnvironment
+from app.errors import LoxParserError, LoxResolverError, LoxRuntimeError
 from app import expression as Expr
 from app.logger import Logger
-from app.schema import OpMode, Token, TokenType
+from app import quicken
+from app.quicken import (
+    BOOL_AND,
+    BOOL_NOT,
+    BOOL_OR,
+    CALL_CLASS,
+    CALL_FUNCTION,
+    GENERIC,
+    NUMBER_NEGATE,
+    NUMBER_OPERATIONS,
+    STRING_CONCAT,
+    WARMUP,
+    QuickenStats,
+)
+from app.schema import OpMode, Storage, Token, TokenType
 from app.runtime import LoxCallable, LoxClass, LoxFunction, LoxInstance, LoxObject
 from app import statement as Stmt
 from app import validate
 
-
-class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[None]):
-    globals: Environment
+if TYPE_CHECKING:
+    from app.profiling import Recorder
+
+# The tree walker recurses once per level of AST nesting, using this many Python
+# frames per level at most (_execute, accept, visit_if_stmt, and so on).
+FRAMES_PER_LEVEL = 4
+# Code nested up to this deep is walked within Python's default recursion limit,
+# with room to spare for calls. The resolver records how deep anything deeper
+# is, see Interpreter.nested.
+SHALLOW_DEPTH = 100
+
+_BASE_RECURSION_LIMIT = sys.getrecursionlimit()
+
+# Looking members up on an Enum class is slow, so the hot paths use these.
+_LOCAL = Storage.LOCAL
+_CELL = Storage.CELL
+_FREE = Storage.FREE
+_BREAK = TokenType.BREAK
+_CONTINUE = TokenType.CONTINUE
+_RETURN = TokenType.RETURN
+
+# Statements return None when they complete normally, or the break, continue or
+# return token of the statement that ended them early, with a return's value in
+# Interpreter._returned. Blocks and ifs pass it on, loops handle break and
+# continue, and calls return the value, so none of them is an exception.
+Completion = Token | None
+
+# The conditions a counted loop can compare its counter with.
+COMPARISONS: dict[TokenType, Callable[[float, float], bool]] = {
+    TokenType.LESS: operator.lt,
+    TokenType.LESS_EQUAL: operator.le,
+    TokenType.GREATER: operator.gt,
+    TokenType.GREATER_EQUAL: operator.ge,
+}
+
+
+class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[Completion]):
+    # The functions _new_function makes, which call sites specialize on.
+    _function_type: type[LoxFunction] = LoxFunction
+
+    globals: GlobalEnvironment
+    quicken_stats: QuickenStats
+    # Set while a profile of the run is being recorded, see app.profiling.
+    recorder: Recorder | None
+    # A call a return statement left for LoxFunction.call to make once the
+    # function it returns from is done, with its arguments.
+    tail_call: tuple[LoxFunction, list[LoxObject]] | None
+    # The top-level statements nested deeper than SHALLOW_DEPTH, and how deep,
+    # until they've run. Function bodies keep theirs in Stmt.Function.depth.
+    depths: dict[Stmt.Stmt, int]
 
     _logger: Logger
-    _environment: Environment
     _op_mode: OpMode
-    _locals: dict[Expr.Expr, int]
+    # The locals of the running call, or of the top level, and the cells the
+    # running function captured.
+    _frame: Frame
+    _cells: tuple[Cell, ...]
+    # The value of the last return statement run.
+    _returned: LoxObject
+    _pending_bodies: dict[Stmt.Function, Callable[[], None]]
+    _quick_hits: list[int]
 
     def __init__(self, logger: Logger, op_mode: OpMode):
         self._logger = logger
         self._op_mode = op_mode
+        self.quicken_stats = QuickenStats()
+        self._quick_hits = self.quicken_stats.hits
+        self.recorder = None
+        self.tail_call = None
+        self.depths = {}
 
-        self.globals = Environment()
-        self._environment = self.globals
+        self.globals = GlobalEnvironment()
+        self._frame = []
+        self._cells = ()
+        self._returned = None
 
-        self._locals = {}
+        self._pending_bodies = {}
 
         for name, cls in builtins.BUILTINS.items():
             self.globals.define(name, cls())
 
     def interpret(self, statements: Sequence[Stmt.Stmt]) -> None:
         try:
-            try:
-                for statement in statements:
-                    self._execute_mode(statement)
-            except LoxLoopException as exc:
-                raise LoxRuntimeError(exc.token, "Flow statement used outside loop.")
+            for statement in statements:
+                depth = self.depths.pop(statement, 0)
+                if depth:
+                    with self.nested(depth):
+                        completion = self._execute_mode(statement)
+                else:
+                    completion = self._execute_mode(statement)
+                if completion is not None:
+                    raise LoxRuntimeError(
+                        completion, "Flow statement used outside loop."
+                    )
         except LoxRuntimeError as err:
             self._logger.report_runtime(err)
+        except (LoxParserError, LoxResolverError):
+            # A lazily parsed function body had errors, which are already
+            # reported.
+            pass
 
-    def _execute_mode(self, statement: Stmt.Stmt) -> None:
+    def _execute_mode(self, statement: Stmt.Stmt) -> Completion:
         if self._op_mode == OpMode.REPL and isinstance(statement, Stmt.Expression):
             value = self._evaluate(statement.expr)
             print(util.stringify(value), file=sys.stdout)
-            return
+            return None
 
-        self._execute(statement)
+        return self._execute(statement)
 
-    def _execute(self, statement: Stmt.Stmt) -> None:
-        statement.accept(self)
+    def _execute(self, statement: Stmt.Stmt) -> Completion:
+        return statement.accept(self)
 
-    def execute_block(
-        self, statements: Sequence[Stmt.Stmt], environment: Environment
-    ) -> None:
-        previous = self._environment
+    def execute_call(
+        self, statements: Sequence[Stmt.Stmt], frame: Frame, cells: tuple[Cell, ...]
+    ) -> LoxObject:
+        """
+        Runs a function body in the given frame, and returns what it returned.
+        """
+
+        previous_frame = self._frame
+        previous_cells = self._cells
 
         try:
-            self._environment = environment
+            self._frame = frame
+            self._cells = cells
 
             for statement in statements:
-                self._execute(statement)
+                completion = statement.accept(self)
+                if completion is not None:
+                    if completion.type_ is not _RETURN:
+                        raise LoxRuntimeError(
+                            completion, "Flow statement used outside loop."
+                        )
+                    return self._returned
+
+            return None
         finally:
-            self._environment = previous
+            self._frame = previous_frame
+            self._cells = previous_cells
 
     def _evaluate(self, expression: Expr.Expr) -> LoxObject:
         return expression.accept(self)
 
-    def resolve(self, expr: Expr.Expr, depth: int) -> None:
-        self._locals[expr] = depth
+    def reserve_depth(self, statement: Stmt.Stmt, depth: int) -> None:
+        """
+        Has a top-level statement nested this deep run with Python's recursion
+        limit raised to match.
+        """
+
+        self.depths[statement] = depth
+
+    @contextmanager
+    def nested(self, depth: int) -> Iterator[None]:
+        """
+        Raises Python's recursion limit while walking or compiling an AST
+        nested this deep, and puts it back after. Calls between Python
+        functions don't use the C stack, but calls through C do, and the
+        limit is what stops those from overflowing it, so it's only raised
+        for as long as it has to be.
+        """
+
+        previous = sys.getrecursionlimit()
+        limit = _BASE_RECURSION_LIMIT + FRAMES_PER_LEVEL * depth
+        if limit <= previous:
+            yield
+            return
+
+        sys.setrecursionlimit(limit)
+        try:
+            yield
+        finally:
+            sys.setrecursionlimit(previous)
+
+    @property
+    def top_level_slots(self) -> int:
+        return len(self._frame)
+
+    def reserve_slots(self, count: int) -> None:
+        """
+        Makes room in the top level's frame for locals of its blocks.
+        """
+
+        if count > len(self._frame):
+            self._frame.extend([None] * (count - len(self._frame)))
+
+    def defer(self, function: Stmt.Function, load: Callable[[], None]) -> None:
+        self._pending_bodies[function] = load
+
+    def load_body(self, function: Stmt.Function) -> None:
+        load = self._pending_bodies.pop(function)
+        load()
 
     def _look_up_variable(
-        self, name: Token, expr: Expr.Variable | Expr.This
+        self, name: Token, expr: Expr.Variable | Expr.This | Expr.Super
     ) -> LoxObject:
-        distance = self._locals.get(expr)
+        storage = expr.storage
+
+        if storage is _LOCAL:
+            return self._frame[expr.slot]
+        if storage is _CELL:
+            return self._frame[expr.slot].value  # type: ignore[union-attr]
+        if storage is _FREE:
+            return self._cells[expr.slot].value
+
+        # GlobalEnvironment.get, inlined as this is the hottest path there is.
+        value = self.globals.values[expr.slot]
+        if value is UNDEFINED:
+            raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+        return value
 
-        if distance is None:
-            return self.globals.get(name)
+    def _define(
+        self, stmt: Stmt.Var | Stmt.Function | Stmt.Class, value: LoxObject
+    ) -> None:
+        storage = stmt.storage
 
-        return self._environment.get_at(distance, name.lexeme)
+        if storage is _LOCAL:
+            self._frame[stmt.slot] = value
+        elif storage is _CELL:
+            self._frame[stmt.slot] = Cell(value)
+        else:
+            self.globals.define(stmt.name.lexeme, value)
+
+    def _capture(self, function: Stmt.Function) -> tuple[Cell, ...]:
+        frame = self._frame
+        cells = self._cells
+        return tuple(
+            frame[capture] if capture >= 0 else cells[~capture]  # type: ignore[misc]
+            for capture in function.captures
+        )
+
+    def _new_function(
+        self, declaration: Stmt.Function, is_method: bool
+    ) -> LoxFunction:
+        is_initializer = (
+            is_method and declaration.name.lexeme == CONSTRUCTOR_METHOD_NAME
+        )
+        return LoxFunction(declaration, self._capture(declaration), is_initializer)
+
+    def _specialize(self, variant: int) -> int:
+        self.quicken_stats.nodes[variant] += 1
+        return variant
+
+    def _despecialize(
+        self, expr: Expr.Binary | Expr.Unary | Expr.Logical | Expr.Call
+    ) -> None:
+        self.quicken_stats.misses[expr.quick] += 1
+        self.quicken_stats.nodes[GENERIC] += 1
+        expr.quick = GENERIC
 
     def visit_binary_expr(self, expr: Expr.Binary) -> LoxObject:
         left = self._evaluate(expr.left)
         right = self._evaluate(expr.right)
 
+        quick = expr.quick
+        if quick > GENERIC:
+            if quick < STRING_CONCAT:
+                if type(left) is float and type(right) is float:
+                    self._quick_hits[quick] += 1
+                    return NUMBER_OPERATIONS[quick](left, right)
+            elif type(left) is str and type(right) is str:
+                self._quick_hits[quick] += 1
+                return left + right
+            self._despecialize(expr)
+        elif quick == GENERIC:
+            self._quick_hits[GENERIC] += 1
+        elif quick + 1 < WARMUP:
+            expr.quick = quick + 1
+        else:
+            variant = quicken.binary_variant(expr.operator.type_, left, right)
+            expr.quick = self._specialize(variant)
+
         match (expr.operator.type_):
             case TokenType.MINUS:
                 left, right = validate.number_operands(expr.operator, left, right)
@@ -116,7 +330,7 @@ class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[None]):
                 return left >= right
             case TokenType.BANG_EQUAL:
                 return not util.is_equal(left, right)
-            case TokenType.EQUAL:
+            case TokenType.EQUAL_EQUAL:
                 return util.is_equal(left, right)
 
         return None
@@ -130,6 +344,25 @@ class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[None]):
     def visit_unary_expr(self, expr: Expr.Unary) -> LoxObject:
         value = self._evaluate(expr.expr)
 
+        quick = expr.quick
+        if quick == NUMBER_NEGATE:
+            if type(value) is float:
+                self._quick_hits[quick] += 1
+                return -value
+            self._despecialize(expr)
+        elif quick == BOOL_NOT:
+            if type(value) is bool:
+                self._quick_hits[quick] += 1
+                return not value
+            self._despecialize(expr)
+        elif quick == GENERIC:
+            self._quick_hits[GENERIC] += 1
+        elif quick + 1 < WARMUP:
+            expr.quick = quick + 1
+        else:
+            variant = quicken.unary_variant(expr.operator.type_, value)
+            expr.quick = self._specialize(variant)
+
         match (expr.operator.type_):
             case TokenType.MINUS:
                 value = validate.number_operand(expr.operator, value)
@@ -153,17 +386,40 @@ class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[None]):
     def visit_assign_expr(self, expr: Expr.Assign) -> LoxObject:
         value = self._evaluate(expr.value_expr)
 
-        distance = self._locals.get(expr)
-        if distance is None:
-            self.globals.assign(expr.name, value)
+        storage = expr.storage
+        if storage is _LOCAL:
+            self._frame[expr.slot] = value
+        elif storage is _CELL:
+            self._frame[expr.slot].value = value  # type: ignore[union-attr]
+        elif storage is _FREE:
+            self._cells[expr.slot].value = value
         else:
-            self._environment.assign_at(distance, expr.name, value)
+            self.globals.assign(expr.slot, expr.name, value)
 
         return value
 
     def visit_logical_expr(self, expr: Expr.Logical) -> LoxObject:
         left = self._evaluate(expr.left)
 
+        quick = expr.quick
+        if quick == BOOL_OR:
+            if type(left) is bool:
+                self._quick_hits[quick] += 1
+                return left if left else self._evaluate(expr.right)
+            self._despecialize(expr)
+        elif quick == BOOL_AND:
+            if type(left) is bool:
+                self._quick_hits[quick] += 1
+                return self._evaluate(expr.right) if left else left
+            self._despecialize(expr)
+        elif quick == GENERIC:
+            self._quick_hits[GENERIC] += 1
+        elif quick + 1 < WARMUP:
+            expr.quick = quick + 1
+        else:
+            variant = quicken.logical_variant(expr.operator.type_, left)
+            expr.quick = self._specialize(variant)
+
         if expr.operator.type_ == TokenType.OR and util.is_truthy(left):
             return left
         if expr.operator.type_ == TokenType.AND and not util.is_truthy(left):
@@ -174,6 +430,33 @@ class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[None]):
     def visit_call_expr(self, expr: Expr.Call) -> LoxObject:
         func = self._evaluate(expr.callee)
         arguments = [self._evaluate(arg) for arg in expr.arguments]
+        return self._call(expr, func, arguments)
+
+    def _call(
+        self, expr: Expr.Call, func: LoxObject, arguments: list[LoxObject]
+    ) -> LoxObject:
+        if self.recorder is not None:
+            self.recorder.call(expr, func, arguments)
+
+        # The variants skip the isinstance check, which is slow for an ABC.
+        quick = expr.quick
+        if quick == CALL_FUNCTION or quick == CALL_CLASS:
+            if type(func) is (
+                self._function_type if quick == CALL_FUNCTION else LoxClass
+            ):
+                self._quick_hits[quick] += 1
+                function = cast(LoxCallable, func)
+                if function.arity() == len(arguments):
+                    return function.call(self, arguments, expr.paren)
+            else:
+                self._despecialize(expr)
+        elif quick == GENERIC:
+            self._quick_hits[GENERIC] += 1
+        elif quick + 1 < WARMUP:
+            expr.quick = quick + 1
+        else:
+            variant = quicken.call_variant(self._function_type, func)
+            expr.quick = self._specialize(variant)
 
         if not isinstance(func, LoxCallable):
             raise LoxRuntimeError(expr.paren, "Can only call functions and classes.")
@@ -207,9 +490,8 @@ class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[None]):
         return self._look_up_variable(expr.keyword, expr)
 
     def visit_super_expr(self, expr: Expr.Super) -> LoxObject:
-        distance = self._locals[expr]
-        superclass = self._environment.get_at(distance, SUPER_KEYWORD)
-        object_ = self._environment.get_at(distance - 1, THIS_KEYWORD)
+        superclass = self._look_up_variable(expr.keyword, expr)
+        object_ = self._look_up_variable(expr.keyword, expr.this)
 
         assert isinstance(superclass, LoxClass)
         assert isinstance(object_, LoxInstance)
@@ -222,59 +504,187 @@ class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[None]):
 
         return method.bind(object_)
 
-    def visit_expression_stmt(self, stmt: Stmt.Expression) -> None:
+    def visit_expression_stmt(self, stmt: Stmt.Expression) -> Completion:
         self._evaluate(stmt.expr)
+        return None
 
-    def visit_print_stmt(self, stmt: Stmt.Print) -> None:
+    def visit_print_stmt(self, stmt: Stmt.Print) -> Completion:
         value = self._evaluate(stmt.expr)
         print(util.stringify(value), file=sys.stdout)
+        return None
 
-    def visit_var_stmt(self, stmt: Stmt.Var) -> None:
+    def visit_var_stmt(self, stmt: Stmt.Var) -> Completion:
         value = None
         if stmt.initializer is not None:
             value = self._evaluate(stmt.initializer)
 
-        self._environment.define(stmt.name.lexeme, value)
+        self._define(stmt, value)
+        return None
 
-    def visit_block_stmt(self, stmt: Stmt.Block) -> None:
-        environment = Environment(enclosing=self._environment)
-        self.execute_block(stmt.statements, environment)
+    def visit_block_stmt(self, stmt: Stmt.Block) -> Completion:
+        # The block's locals have their own slots in the current frame.
+        for statement in stmt.statements:
+            completion = statement.accept(self)
+            if completion is not None:
+                return completion
 
-    def visit_if_stmt(self, stmt: Stmt.If) -> None:
-        condition = self._evaluate(stmt.condition)
+        return None
 
-        if util.is_truthy(condition):
-            self._execute(stmt.then_stmt)
+    def visit_if_stmt(self, stmt: Stmt.If) -> Completion:
+        taken = util.is_truthy(self._evaluate(stmt.condition))
+
+        if self.recorder is not None:
+            self.recorder.branch(stmt, taken)
+
+        if taken:
+            return self._execute(stmt.then_stmt)
         elif stmt.else_stmt is not None:
-            self._execute(stmt.else_stmt)
-
-    def visit_while_stmt(self, stmt: Stmt.While) -> None:
-        while util.is_truthy(self._evaluate(stmt.condition)):
-            try:
-                self._execute(stmt.body)
-            except LoxLoopException as exc:
-                if exc.token.type_ == TokenType.BREAK:
+            return self._execute(stmt.else_stmt)
+
+        return None
+
+    def visit_while_stmt(self, stmt: Stmt.While) -> Completion:
+        if self.recorder is not None:
+            return self._execute_recorded_loop(stmt, self.recorder)
+
+        if stmt.counter is not None:
+            return self._execute_counted_loop(stmt, stmt.counter)
+
+        condition = stmt.condition
+        body = stmt.body
+        while util.is_truthy(self._evaluate(condition)):
+            completion = body.accept(self)
+            if completion is not None:
+                if completion.type_ is _BREAK:
                     break
-                elif exc.token.type_ == TokenType.CONTINUE:
-                    continue
+                if completion.type_ is not _CONTINUE:
+                    return completion
 
-                raise exc
+        return None
 
-    def visit_flow_stmt(self, stmt: Stmt.Flow) -> None:
-        raise LoxLoopException(stmt.token)
+    def _execute_recorded_loop(
+        self, stmt: Stmt.While, recorder: Recorder
+    ) -> Completion:
+        trips = 0
 
-    def visit_function_stmt(self, stmt: Stmt.Function) -> None:
-        func = LoxFunction(stmt, self._environment, False)
-        self._environment.define(stmt.name.lexeme, func)
+        try:
+            while util.is_truthy(self._evaluate(stmt.condition)):
+                trips += 1
+                completion = self._execute(stmt.body)
+                if completion is not None:
+                    if completion.type_ is _BREAK:
+                        break
+                    if completion.type_ is not _CONTINUE:
+                        return completion
+        finally:
+            recorder.loop(stmt, trips)
 
-    def visit_return_stmt(self, stmt: Stmt.Return) -> None:
+        return None
+
+    def _execute_counted_loop(self, stmt: Stmt.While, slot: int) -> Completion:
+        """
+        Runs `for (var i = ...; i < limit; i = i + step)` without evaluating
+        the condition and increment as expressions while the counter and limit
+        are numbers. The counter is read back from its slot every time, so the
+        body can still reassign it, and anything other than a number takes
+        the same path as the expressions would, errors included.
+        """
+        condition = cast(Expr.Binary, stmt.condition)
+        operator_ = condition.operator
+        compare = COMPARISONS[operator_.type_]
+        limit_expr = condition.right
+        constant_limit = None
+        limit_slot = None
+        if type(limit_expr) is Expr.Literal:
+            constant_limit = limit_expr.value
+        elif type(limit_expr) is Expr.Variable and limit_expr.storage is _LOCAL:
+            limit_slot = limit_expr.slot
+
+        statements = (
+            stmt.body.statements if type(stmt.body) is Stmt.Block else (stmt.body,)
+        )
+        *body, increment_stmt = statements
+        increment = cast(Expr.Assign, cast(Stmt.Expression, increment_stmt).expr)
+        step_expr = cast(Expr.Binary, increment.value_expr)
+        step = cast(float, cast(Expr.Literal, step_expr.right).value)
+        if step_expr.operator.type_ == TokenType.MINUS:
+            step = -step
+
+        frame = self._frame
+        execute = self._execute
+        evaluate = self._evaluate
+
+        while True:
+            counter = frame[slot]
+            if constant_limit is not None:
+                limit = constant_limit
+            elif limit_slot is not None:
+                limit = frame[limit_slot]
+            else:
+                limit = evaluate(limit_expr)
+            if type(counter) is not float or type(limit) is not float:
+                counter, limit = validate.number_operands(operator_, counter, limit)
+            if not compare(counter, limit):
+                break
+
+            completion = None
+            for statement in body:
+                completion = execute(statement)
+                if completion is not None:
+                    break
+            if completion is not None:
+                if completion.type_ is _BREAK:
+                    break
+                if completion.type_ is not _CONTINUE:
+                    return completion
+                continue
+
+            counter = frame[slot]
+            if type(counter) is float:
+                frame[slot] = counter + step
+            else:
+                evaluate(increment)
+
+        return None
+
+    def visit_flow_stmt(self, stmt: Stmt.Flow) -> Completion:
+        return stmt.token
+
+    def visit_function_stmt(self, stmt: Stmt.Function) -> Completion:
+        # A function that calls itself captures its own cell, so the cell has
+        # to exist before the function does.
+        if stmt.storage is _CELL:
+            cell = Cell(None)
+            self._frame[stmt.slot] = cell
+            cell.value = self._new_function(stmt, False)
+        else:
+            self._define(stmt, self._new_function(stmt, False))
+
+        return None
+
+    def visit_return_stmt(self, stmt: Stmt.Return) -> Completion:
         value: LoxObject = None
-        if stmt.value is not None:
+        if stmt.tail:
+            # A call to a Lox function is made by the caller's LoxFunction.call
+            # once this one's Python frames are gone, so tail recursion takes
+            # no more stack however deep it goes.
+            call = cast(Expr.Call, stmt.value)
+            func = self._evaluate(call.callee)
+            arguments = [self._evaluate(arg) for arg in call.arguments]
+            if type(func) is self._function_type and func.arity() == len(arguments):
+                if self.recorder is not None:
+                    self.recorder.call(call, func, arguments)
+                self.tail_call = (func, arguments)
+                return stmt.keyword
+
+            value = self._call(call, func, arguments)
+        elif stmt.value is not None:
             value = self._evaluate(stmt.value)
 
-        raise LoxReturnException(stmt.keyword, value)
+        self._returned = value
+        return stmt.keyword
 
-    def visit_class_stmt(self, stmt: Stmt.Class) -> None:
+    def visit_class_stmt(self, stmt: Stmt.Class) -> Completion:
         superclass = None
         if stmt.superclass is not None:
             superclass = self._evaluate(stmt.superclass)
@@ -286,22 +696,24 @@ class Interpreter(Expr.Visitor[LoxObject], Stmt.Visitor[None]):
 
         superclass = cast(LoxClass | None, superclass)
 
-        self._environment.define(stmt.name.lexeme, None)
+        # As for functions, methods that use the class capture its cell.
+        cell = None
+        if stmt.storage is _CELL:
+            cell = Cell(None)
+            self._frame[stmt.slot] = cell
 
         if stmt.superclass is not None:
-            enclosing_environment = self._environment
-            self._environment = Environment(enclosing=enclosing_environment)
-            self._environment.define(SUPER_KEYWORD, superclass)
+            self._frame[stmt.super_slot] = Cell(superclass)
 
         methods = {}
         for method in stmt.methods:
-            is_initializer = method.name.lexeme == CONSTRUCTOR_METHOD_NAME
-            func = LoxFunction(method, self._environment, is_initializer)
-            methods[method.name.lexeme] = func
+            methods[method.name.lexeme] = self._new_function(method, True)
 
         class_ = LoxClass(stmt.name.lexeme, superclass, methods)
 
-        if superclass is not None:
-            self._environment = enclosing_environment
+        if cell is not None:
+            cell.value = class_
+        else:
+            self._define(stmt, class_)
 
-        self._environment.assign(stmt.name, class_)
+        return None
@@ -1,87 +1,286 @@
+import argparse
+from collections.abc import Iterable
+import os
 from pprint import pp
 import sys
 from typing import Never
 
+from app import inference, parallel, profiling, util
 from app.ast_printer import AstPrinter
+from app.bytecode import disassemble_program
+from app.cache import ProgramCache
+from app.compiler import ClosureInterpreter
 from app.interpreter import Interpreter
 from app.logger import Logger
+from app.mem_stats import ast_mem_stats
 from app.parser import Parser
+from app.profiling import Recorder
 from app.resolver import Resolver
 from app.scanner import Scanner
-from app.schema import Command, OpMode
-
-COMMANDS = {Command.TOKENIZE, Command.PARSE, Command.INTERPRET}
+from app.tiered import TieredInterpreter
+from app.transpiler import PythonInterpreter, build_module, write_module
+from app.vm import VirtualMachine
+from app.schema import Command, Engine, OpMode, Token
+from app.token_buffer import TokenBuffer
+from app import statement as Stmt
+
+COMMANDS = {
+    Command.TOKENIZE,
+    Command.PARSE,
+    Command.INTERPRET,
+    Command.DISASSEMBLE,
+    Command.BUILD,
+}
+
+ENGINES: dict[Engine, type[Interpreter]] = {
+    Engine.TREE: Interpreter,
+    Engine.CLOSURE: ClosureInterpreter,
+    Engine.BYTECODE: VirtualMachine,
+    Engine.PYTHON: PythonInterpreter,
+    Engine.TIERED: TieredInterpreter,
+}
+
+# Files are read and scanned in chunks of this many characters, so only the
+# current chunk and the parser's lookahead are in memory at once.
+FILE_CHUNK_SIZE = 1 << 20
 
 
 def _exit_with_message(message: str) -> Never:
     print(message, file=sys.stderr)
-    exit(1)
-
-
-def _get_input() -> tuple[str, str | None]:
-    if len(sys.argv) not in (2, 3):
-        usage_parts = (
-            "Usage:",
-            "./your_program.sh <command> <filename>",
-            "./your_program.sh <command>",
-        )
-        _exit_with_message("\n".join(usage_parts))
-
-    command = sys.argv[1] if len(sys.argv) >= 2 else None
-    filename = sys.argv[2] if len(sys.argv) >= 3 else None
-
-    if command is None:
-        _exit_with_message("Command is required")
-    if command not in COMMANDS:
-        _exit_with_message(f"Unknown command: {command}")
-
-    return command, filename
+    sys.exit(1)
+
+
+def _get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="./run.sh")
+    parser.add_argument("command", type=Command, choices=sorted(COMMANDS))
+    parser.add_argument("filename", nargs="?")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="scan the file in parallel with this many processes",
+    )
+    parser.add_argument(
+        "--mem-stats",
+        action="store_true",
+        help="report the memory used by the parsed program's AST",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="parse and resolve every function body up front, so errors in"
+        " bodies that are never called are reported too",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="keep compiled programs in this directory and reuse them while the"
+        " source is unchanged; cached programs are compiled as with --strict",
+    )
+    parser.add_argument(
+        "--shared-cache",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help="also look for compiled programs in this directory, which is only"
+        " read from (may be given more than once)",
+    )
+    parser.add_argument(
+        "--engine",
+        type=Engine,
+        choices=list(Engine),
+        default=Engine.TREE,
+        help="run programs by walking the AST (tree), or by compiling it into"
+        " Python closures (closure), bytecode for a stack machine (bytecode) or"
+        " Python source (python) first, or by walking the AST and compiling"
+        " hot functions and loops to Python source as they run (tiered)",
+    )
+    parser.add_argument(
+        "--jit-stats",
+        action="store_true",
+        help="with --engine tiered, report how often each function and loop was"
+        " walked, and when it was compiled",
+    )
+    parser.add_argument(
+        "--quicken-stats",
+        action="store_true",
+        help="with --engine tree or tiered, report what the AST's nodes"
+        " specialized into as they ran, and how often that paid off",
+    )
+    parser.add_argument(
+        "--type-stats",
+        action="store_true",
+        help="report how many of each function's locals and expressions have a"
+        " static type, which compiled code needs no checks for; the program is"
+        " compiled as with --strict",
+    )
+    parser.add_argument(
+        "--profile-out",
+        metavar="FILE",
+        help="with --engine tree or tiered, record what the program's nodes saw"
+        " as it ran to this file",
+    )
+    parser.add_argument(
+        "--profile-in",
+        metavar="FILE",
+        help="with --engine tree or tiered, specialize the program's nodes as a"
+        " profile recorded with --profile-out says they will be before running"
+        " it; parts of the program edited since are run as usual",
+    )
+    parser.add_argument(
+        "--output",
+        help="where build writes the Python module (default: the file's name"
+        " with a .py suffix)",
+    )
+
+    return parser.parse_args()
+
+
+def _scan(logger: Logger, source: str | Iterable[str], jobs: int) -> TokenBuffer:
+    # The whole source is scanned before anything is parsed, so that a scan
+    # error stops the run first, into a TokenBuffer rather than Token objects.
+    if jobs > 1:
+        text = source if isinstance(source, str) else "".join(source)
+        return parallel.scan_buffer(logger, text, jobs)
+
+    return Scanner(logger, source).scan_buffer()
 
 
 def _run(
     logger: Logger,
     interpreter: Interpreter,
     command: Command,
-    text: str,
-) -> None:
-    scanner = Scanner(logger, text)
-    tokens = scanner.scan_tokens()
+    source: str | Iterable[str],
+    jobs: int = 1,
+    mem_stats: bool = False,
+    strict: bool = True,
+    cache: ProgramCache | None = None,
+    profile: profiling.Entries | None = None,
+) -> list[Stmt.Stmt] | None:
+    """
+    Runs the command on the source, returning the program it ran, if any.
+    """
+
+    if command == Command.INTERPRET and cache is not None:
+        assert isinstance(source, str)
+
+        cached_statements = cache.load(source, interpreter)
+        if cached_statements is not None:
+            if mem_stats:
+                print(ast_mem_stats(cached_statements).report(), file=sys.stderr)
+
+            if profile is not None:
+                profiling.apply(cached_statements, interpreter, profile)
+            interpreter.interpret(cached_statements)
+            return cached_statements
+
+        # Lazy bodies can't be cached, so compile the whole program.
+        strict = True
+
+    # The profile is for the whole program, so it has to be loaded up front.
+    if profile is not None:
+        strict = True
 
     if command == Command.TOKENIZE:
+        # Tokens are printed as they're scanned, unless scanning in parallel.
+        if jobs > 1:
+            tokens: Iterable[Token] = _scan(logger, source, jobs)
+        else:
+            tokens = Scanner(logger, source).iter_tokens()
         for token in tokens:
             print(token)
-        return
+        return None
 
+    tokens = _scan(logger, source, jobs)
     if logger.had_error:
-        return
+        return None
+
+    # The disassembly covers every function, so they all have to be loaded.
+    if command == Command.DISASSEMBLE:
+        strict = True
 
-    parser = Parser(logger, tokens)
+    # Unless strict, function bodies are only parsed and resolved when first
+    # called, so startup doesn't pay for functions a run never uses.
+    parser = Parser(logger, tokens, lazy=not strict)
 
     if command == Command.PARSE:
         expression = parser.parse_expression()
         ast_printer = AstPrinter()
         if expression is not None:
             ast_printer.print(expression)
-        return
+        return None
 
     statements = parser.parse()
 
+    if mem_stats:
+        print(ast_mem_stats(statements).report(), file=sys.stderr)
+
     if logger.had_error:
-        return
+        return None
 
     resolver = Resolver(logger, interpreter)
     resolver.resolve(statements)
 
     if logger.had_error:
-        return
+        return None
+
+    if command == Command.DISASSEMBLE:
+        print(disassemble_program(interpreter, statements))
+        return None
 
+    if cache is not None:
+        cache.store(source, statements, interpreter)
+
+    if profile is not None:
+        profiling.apply(statements, interpreter, profile)
     interpreter.interpret(statements)
+    return statements
 
 
-def run_text(command: Command, text: str) -> int:
+def run_text(
+    command: Command,
+    text: str | Iterable[str],
+    *,
+    jobs: int = 1,
+    mem_stats: bool = False,
+    strict: bool = True,
+    cache: ProgramCache | None = None,
+    engine: Engine = Engine.TREE,
+    jit_stats: bool = False,
+    quicken_stats: bool = False,
+    profile_in: str | None = None,
+    profile_out: str | None = None,
+    type_stats: bool = False,
+) -> int:
     logger = Logger()
-    interpreter = Interpreter(logger, OpMode.PROGRAM)
-    _run(logger, interpreter, command, text)
+    interpreter = ENGINES[engine](logger, OpMode.PROGRAM)
+
+    profile = None
+    if profile_in is not None:
+        profile = _read_profile(profile_in)
+    if profile_out is not None:
+        interpreter.recorder = Recorder()
+
+    # The report covers every function, so they all have to be loaded.
+    if type_stats:
+        strict = True
+
+    statements = _run(
+        logger, interpreter, command, text, jobs, mem_stats, strict, cache, profile
+    )
+
+    if profile_out is not None and statements is not None:
+        assert interpreter.recorder is not None
+        entries = profiling.collect(statements, interpreter, interpreter.recorder)
+        with open(profile_out, "wb") as file:
+            file.write(profiling.dump(entries))
+
+    if jit_stats:
+        assert isinstance(interpreter, TieredInterpreter)
+        print(interpreter.stats_report(), file=sys.stderr)
+    if quicken_stats:
+        print(interpreter.quicken_stats.report(), file=sys.stderr)
+    if type_stats and statements is not None:
+        print(inference.coverage(statements).report(), file=sys.stderr)
 
     if logger.had_error:
         return 65
@@ -91,17 +290,80 @@ def run_text(command: Command, text: str) -> int:
     return 0
 
 
-def _run_file(command: Command, filename: str) -> Never:
+def _read_profile(path: str) -> profiling.Entries | None:
+    with open(path, "rb") as file:
+        profile = profiling.load(file.read())
+
+    if profile is None:
+        print(
+            f"Ignoring {path}, which isn't a profile from this version.",
+            file=sys.stderr,
+        )
+    return profile
+
+
+def _run_file(
+    command: Command,
+    filename: str,
+    *,
+    jobs: int,
+    mem_stats: bool,
+    strict: bool,
+    cache: ProgramCache | None,
+    engine: Engine,
+    jit_stats: bool,
+    quicken_stats: bool,
+    profile_in: str | None,
+    profile_out: str | None,
+    type_stats: bool,
+) -> Never:
     with open(filename) as file:
-        text = file.read()
+        # The cache is keyed by the whole source, so it can't be streamed.
+        source = file.read() if cache is not None else None
+        chunks = util.read_chunks(file, FILE_CHUNK_SIZE)
+        exit_code = run_text(
+            command,
+            source if source is not None else chunks,
+            jobs=jobs,
+            mem_stats=mem_stats,
+            strict=strict,
+            cache=cache,
+            engine=engine,
+            jit_stats=jit_stats,
+            quicken_stats=quicken_stats,
+            profile_in=profile_in,
+            profile_out=profile_out,
+            type_stats=type_stats,
+        )
 
-    exit_code = run_text(command, text)
-    exit(exit_code)
+    sys.exit(exit_code)
 
 
-def _run_prompt(command: Command) -> None:
+def _build_file(filename: str, output: str | None) -> Never:
     logger = Logger()
-    interpreter = Interpreter(logger, OpMode.REPL)
+    interpreter = PythonInterpreter(logger, OpMode.PROGRAM)
+
+    with open(filename) as file:
+        tokens = _scan(logger, util.read_chunks(file, FILE_CHUNK_SIZE), 1)
+        statements = Parser(logger, tokens).parse()
+
+    if not logger.had_error:
+        Resolver(logger, interpreter).resolve(statements)
+
+    if logger.had_error:
+        sys.exit(65)
+
+    if output is None:
+        output = os.path.splitext(filename)[0] + ".py"
+
+    module_source = build_module(interpreter, statements, os.path.basename(filename))
+    write_module(module_source, output)
+    sys.exit(0)
+
+
+def _run_prompt(command: Command, engine: Engine) -> None:
+    logger = Logger()
+    interpreter = ENGINES[engine](logger, OpMode.REPL)
 
     while True:
         text = input("> ")
@@ -114,12 +376,43 @@ def _run_prompt(command: Command) -> None:
 
 
 def main():
-    command, filename = _get_input()
-
-    if filename is None:
-        _run_prompt(command)
+    args = _get_args()
+
+    cache = None
+    if args.cache_dir is not None or args.shared_cache:
+        cache = ProgramCache(args.cache_dir, args.shared_cache)
+
+    if args.jit_stats and args.engine != Engine.TIERED:
+        _exit_with_message("--jit-stats needs --engine tiered.")
+    if args.quicken_stats and args.engine not in (Engine.TREE, Engine.TIERED):
+        _exit_with_message("--quicken-stats needs --engine tree or tiered.")
+    profiles = (("--profile-in", args.profile_in), ("--profile-out", args.profile_out))
+    for flag, path in profiles:
+        if path is not None and args.engine not in (Engine.TREE, Engine.TIERED):
+            _exit_with_message(f"{flag} needs --engine tree or tiered.")
+
+    if args.command == Command.BUILD:
+        if args.filename is None:
+            _exit_with_message("build needs a file to build.")
+        _build_file(args.filename, args.output)
+
+    if args.filename is None:
+        _run_prompt(args.command, args.engine)
     else:
-        _run_file(command, filename)
+        _run_file(
+            args.command,
+            args.filename,
+            jobs=args.jobs,
+            mem_stats=args.mem_stats,
+            strict=args.strict,
+            cache=cache,
+            engine=args.engine,
+            jit_stats=args.jit_stats,
+            quicken_stats=args.quicken_stats,
+            profile_in=args.profile_in,
+            profile_out=args.profile_out,
+            type_stats=args.type_stats,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+from collections.abc import Sequence
+from dataclasses import dataclass, fields
+import sys
+
+from app.schema import AstNode, Token
+
+
+@dataclass
+class AstMemStats:
+    nodes: int
+    node_bytes: int
+    token_bytes: int
+    lines: int
+
+    @property
+    def total_bytes(self) -> int:
+        return self.node_bytes + self.token_bytes
+
+    def report(self) -> str:
+        lines = max(self.lines, 1)
+        parts = (
+            f"AST nodes: {self.nodes}",
+            f"AST bytes: {self.node_bytes} nodes + {self.token_bytes} tokens"
+            f" = {self.total_bytes}",
+            f"AST bytes per source line: {self.total_bytes / lines:.1f}"
+            f" ({lines} lines)",
+        )
+        return "\n".join(parts)
+
+
+def _sizeof(value: object) -> int:
+    size = sys.getsizeof(value)
+
+    # nodes without __slots__ keep their fields in a separate dict
+    instance_dict = getattr(value, "__dict__", None)
+    if instance_dict is not None:
+        size += sys.getsizeof(instance_dict)
+
+    return size
+
+
+def ast_mem_stats(statements: Sequence[AstNode]) -> AstMemStats:
+    """
+    Adds up the memory held by an AST: the nodes and the tuples or lists of
+    child nodes count as node bytes, and the tokens and their lexemes and
+    literals as token bytes. Shared objects are only counted once.
+    """
+
+    stats = AstMemStats(0, _sizeof(statements), 0, 0)
+    seen: set[int] = set()
+    stack: list[object] = list(statements)
+
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+
+        if isinstance(value, Token):
+            stats.token_bytes += _sizeof(value)
+            for part in (value.lexeme, value.literal):
+                if part is not None and id(part) not in seen:
+                    seen.add(id(part))
+                    stats.token_bytes += sys.getsizeof(part)
+            stats.lines = max(stats.lines, value.line)
+        elif isinstance(value, AstNode):
+            stats.nodes += 1
+            stats.node_bytes += _sizeof(value)
+            stack.extend(getattr(value, field.name) for field in fields(value))
+        elif isinstance(value, (list, tuple)):
+            stats.node_bytes += sys.getsizeof(value)
+            stack.extend(value)
+        elif value is not None:
+            # literal values
+            stats.node_bytes += sys.getsizeof(value)
+
+    return stats
@@ -0,0 +1,121 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import re
+
+from app.logger import Logger
+from app.scanner import Scanner
+from app.token_buffer import EOF_CODE, TokenBuffer
+
+# Below this many characters, starting worker processes costs more than
+# scanning the whole source serially.
+MIN_PARALLEL_CHARS = 1 << 20
+
+# Each job gets several chunks, so one slow chunk doesn't hold up the rest.
+CHUNKS_PER_JOB = 4
+
+# Finds the string literals and comments in a source. A newline is a safe
+# place to split as long as it isn't inside a string literal; newlines end
+# comments, so they are never inside one.
+_QUOTED_PATTERN = re.compile(r'"[^"]*"?|//[^\n]*')
+
+_Report = tuple[int, str, str]
+_ChunkResult = tuple[array, array, array, array, list[_Report]]
+
+
+class _RecordingLogger(Logger):
+    """
+    Keeps reports instead of printing them, so the parent process can replay
+    them in source order once every chunk is scanned.
+    """
+
+    reports: list[_Report]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.reports = []
+
+    def report(self, line: int, where: str, message: str) -> None:
+        self.had_error = True
+        self.reports.append((line, where, message))
+
+
+def _split_points(source: str, parts: int) -> list[int]:
+    points = [0]
+    spans = _QUOTED_PATTERN.finditer(source)
+    span = next(spans, None)
+
+    for part in range(1, parts):
+        target = max(len(source) * part // parts, points[-1])
+        newline = source.find("\n", target)
+
+        while newline != -1:
+            while span is not None and span.end() <= newline:
+                span = next(spans, None)
+
+            if span is None or span.start() > newline:
+                break
+
+            # inside a string literal, so try the first newline after it
+            newline = source.find("\n", span.end())
+
+        if newline == -1:
+            break
+
+        points.append(newline + 1)
+
+    points.append(len(source))
+
+    return points
+
+
+def _scan_chunk(chunk: str, first_line: int, offset: int) -> _ChunkResult:
+    logger = _RecordingLogger()
+    buffer = Scanner(logger, chunk).scan_buffer(first_line=first_line, offset=offset)
+
+    columns = (buffer.types, buffer.starts, buffer.ends, buffer.lines)
+    for column in columns:
+        # drop the chunk's EOF
+        column.pop()
+
+    return *columns, logger.reports
+
+
+def scan_buffer(logger: Logger, source: str, jobs: int) -> TokenBuffer:
+    """
+    Scans source into the same TokenBuffer as Scanner.scan_buffer, splitting
+    it into chunks at newlines outside string literals and scanning the chunks
+    in a pool of jobs processes.
+    """
+
+    if jobs <= 1 or len(source) < MIN_PARALLEL_CHARS:
+        return Scanner(logger, source).scan_buffer()
+
+    points = _split_points(source, jobs * CHUNKS_PER_JOB)
+
+    chunks = []
+    first_lines = []
+    offsets = []
+
+    line = 1
+    for start, end in zip(points, points[1:]):
+        chunks.append(source[start:end])
+        first_lines.append(line)
+        offsets.append(start)
+        line += source.count("\n", start, end)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(_scan_chunk, chunks, first_lines, offsets))
+
+    buffer = TokenBuffer(source)
+    for types, starts, ends, lines, reports in results:
+        buffer.types.extend(types)
+        buffer.starts.extend(starts)
+        buffer.ends.extend(ends)
+        buffer.lines.extend(lines)
+
+        for report in reports:
+            logger.report(*report)
+
+    buffer.append(EOF_CODE, len(source), len(source), line)
+
+    return buffer
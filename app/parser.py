@@ -1,4 +1,9 @@
-from collections.abc import Sequence
+from __future__ import annotations
+
+from collections.abc import Callable, Generator, Iterable, Iterator
+from enum import IntEnum, auto
+from types import GeneratorType
+from typing import Any, TypeVar
 from app.constants import MAX_ARG_COUNT
 from app.errors import LoxParserError
 from app import expression as Expr
@@ -6,28 +11,59 @@ from app.logger import Logger
 from app.schema import FunctionType, Token, TokenType
 from app import statement as Stmt
 
+T = TypeVar("T")
+
 
 class Parser:
     _logger: Logger
-    _tokens: list[Token]
-    _current: int
 
-    def __init__(self, logger: Logger, tokens: Sequence[Token]) -> None:
+    # Tokens are pulled from the iterator one at a time, and only the current
+    # and previous token are kept, so the parser works on a streaming scanner
+    # without the full token list ever existing.
+    _tokens: Iterator[Token]
+    _current: Token
+    _previous: Token
+
+    # When lazy, function and method bodies are only brace-matched, and their
+    # tokens are kept on the Function node to be parsed on first call.
+    _lazy: bool
+
+    def __init__(
+        self, logger: Logger, tokens: Iterable[Token], *, lazy: bool = False
+    ) -> None:
         self._logger = logger
-        self._tokens = list(tokens)
-        self._current = 0
+        self._tokens = iter(tokens)
+        self._current = next(self._tokens)
+        self._previous = self._current
+        self._lazy = lazy
 
     def parse(self) -> list[Stmt.Stmt]:
         statements = []
 
         while not self._is_at_end():
             statement = self._declaration()
+            if type(statement) is GeneratorType:
+                statement = self._run(statement)
 
             if statement is not None:
                 statements.append(statement)
 
         return statements
 
+    def parse_body(self) -> tuple[Stmt.Stmt, ...]:
+        """
+        Parses a function body, braces included, from the tokens a lazy parse
+        kept for it.
+        """
+
+        try:
+            self._consume(TokenType.LEFT_BRACE, "Expect '{' before body.")
+            return self._run(self._block())
+        except LoxParserError:
+            pass
+
+        return ()
+
     def parse_expression(self) -> Expr.Expr | None:
         try:
             return self._expression()
@@ -36,25 +72,54 @@ class Parser:
 
         return None
 
-    def _peek(self, *, offset: int = 0) -> Token:
-        index = self._current + offset
-        return self._tokens[index]
+    def _run(self, task: _Task[T]) -> T:
+        # Statements are parsed by generators that yield a task for each
+        # nested statement and are sent back its result. Running them from an
+        # explicit stack instead of recursing bounds nesting only by memory.
+        stack: list[_Task[Any]] = [task]
+        value: Any = None
+        error: LoxParserError | None = None
+
+        while True:
+            try:
+                if error is not None:
+                    thrown, error = error, None
+                    subtask = stack[-1].throw(thrown)
+                else:
+                    subtask = stack[-1].send(value)
+            except StopIteration as stop:
+                stack.pop()
+                if not stack:
+                    return stop.value
+                value = stop.value
+                continue
+            except LoxParserError as exc:
+                stack.pop()
+                if not stack:
+                    raise
+                error = exc
+                continue
+
+            stack.append(subtask)
+            value = None
+
+    def _peek(self) -> Token:
+        return self._current
 
     def _is_at_end(self) -> bool:
-        return self._peek().type_ == TokenType.EOF
+        return self._current.type_ is TokenType.EOF
 
     def _advance(self) -> Token:
-        value = self._peek()
-        if not self._is_at_end():
-            self._current += 1
+        value = self._current
+        if value.type_ is not TokenType.EOF:
+            self._previous = value
+            self._current = next(self._tokens)
 
         return value
 
     def _check(self, type_: TokenType) -> bool:
-        if self._is_at_end():
-            return False
-
-        return self._peek().type_ == type_
+        # Never true at the end, since nothing checks for the EOF itself.
+        return self._current.type_ is type_
 
     def _match(self, *types: TokenType) -> bool:
         for type_ in types:
@@ -83,7 +148,7 @@ class Parser:
         self._advance()
 
         while not self._is_at_end():
-            if self._peek(offset=-1).type_ == TokenType.SEMICOLON:
+            if self._previous.type_ == TokenType.SEMICOLON:
                 return
 
             if self._peek().type_ in (
@@ -100,40 +165,55 @@ class Parser:
 
             self._advance()
 
-    def _declaration(self) -> Stmt.Stmt | None:
+    def _declaration(self) -> Stmt.Stmt | None | _Task[Stmt.Stmt | None]:
+        # Only statements that contain others need a task; the rest, which are
+        # most of them, are parsed directly.
+        if self._current.type_ in _NESTING_STATEMENTS:
+            return self._nested_declaration()
+
         try:
             if self._match(TokenType.VAR):
                 return self._var_declaration()
+
+            return self._simple_statement()
+        except LoxParserError:
+            self._synchronize()
+            return None
+
+    def _nested_declaration(self) -> _Task[Stmt.Stmt | None]:
+        try:
             if self._match(TokenType.FUN):
-                return self._function(FunctionType.FUNCTION)
+                return (yield from self._function(FunctionType.FUNCTION))
             if self._match(TokenType.CLASS):
-                return self._class_declaration()
+                return (yield from self._class_declaration())
 
-            return self._statement()
+            return (yield from self._statement())
         except LoxParserError:
             self._synchronize()
             return None
 
-    def _class_declaration(self) -> Stmt.Class:
+    def _class_declaration(self) -> _Task[Stmt.Class]:
         name = self._consume(TokenType.IDENTIFIER, "Expect class name.")
 
         superclass = None
         if self._match(TokenType.LESS):
-            self._consume(TokenType.IDENTIFIER, "Expect superclass name.")
-            superclass = Expr.Variable(self._peek(offset=-1))
+            superclass_name = self._consume(
+                TokenType.IDENTIFIER, "Expect superclass name."
+            )
+            superclass = Expr.Variable(superclass_name)
 
         self._consume(TokenType.LEFT_BRACE, "Expect '{' before class body.")
 
         methods = []
         while not self._check(TokenType.RIGHT_BRACE) and not self._is_at_end():
-            method = self._function(FunctionType.METHOD)
+            method = yield self._function(FunctionType.METHOD)
             methods.append(method)
 
         self._consume(TokenType.RIGHT_BRACE, "Expect '}' after class body.")
 
-        return Stmt.Class(name, superclass, methods)
+        return Stmt.Class(name, superclass, tuple(methods))
 
-    def _function(self, type_: FunctionType) -> Stmt.Function:
+    def _function(self, type_: FunctionType) -> _Task[Stmt.Function]:
         name = self._consume(TokenType.IDENTIFIER, f"Expect {type_} name.")
         self._consume(TokenType.LEFT_PAREN, f"Expect '(' after {type_} name.")
 
@@ -155,30 +235,39 @@ class Parser:
 
         self._consume(TokenType.RIGHT_PAREN, "Expect ')' after parameters.")
         self._consume(TokenType.LEFT_BRACE, f"Expect '{'{'}' before {type_} body.")
-        body = self._block()
 
-        return Stmt.Function(name, parameters, body)
+        if self._lazy:
+            body_tokens = self._skip_block()
+            return Stmt.Function(name, tuple(parameters), (), body_tokens)
+
+        body = yield self._block()
 
-    def _statement(self) -> Stmt.Stmt:
+        return Stmt.Function(name, tuple(parameters), body)
+
+    def _statement(self) -> _Task[Stmt.Stmt]:
         if self._match(TokenType.IF):
-            return self._if_statement()
+            return (yield from self._if_statement())
+        if self._match(TokenType.FOR):
+            return (yield from self._for_statement())
+        if self._match(TokenType.WHILE):
+            return (yield from self._while_statement())
+        if self._match(TokenType.LEFT_BRACE):
+            return (yield from self._block_statement())
+
+        return self._simple_statement()
+
+    def _simple_statement(self) -> Stmt.Stmt:
         if self._match(TokenType.PRINT):
             return self._print_statement()
         if self._match(TokenType.RETURN):
             return self._return_statement()
-        if self._match(TokenType.FOR):
-            return self._for_statement()
-        if self._match(TokenType.WHILE):
-            return self._while_statement()
-        if self._match(TokenType.LEFT_BRACE):
-            return self._block_statement()
         if self._match(TokenType.BREAK, TokenType.CONTINUE):
             return self._flow_statement()
 
         return self._expression_statement()
 
     def _return_statement(self) -> Stmt.Return:
-        token = self._peek(offset=-1)
+        token = self._previous
 
         value = None
         if not self._check(TokenType.SEMICOLON):
@@ -189,11 +278,11 @@ class Parser:
         return Stmt.Return(token, value)
 
     def _flow_statement(self) -> Stmt.Flow:
-        token = self._peek(offset=-1)
+        token = self._previous
         self._consume(TokenType.SEMICOLON, f"Expect ';' after {token.lexeme}")
         return Stmt.Flow(token)
 
-    def _for_statement(self) -> Stmt.Stmt:
+    def _for_statement(self) -> _Task[Stmt.Stmt]:
         def get_initializer() -> Stmt.Stmt | None:
             if self._match(TokenType.VAR):
                 return self._var_declaration()
@@ -223,47 +312,49 @@ class Parser:
         condition = get_condition()
         increment = get_increment()
         self._consume(TokenType.RIGHT_PAREN, "Expect ')' after for clauses")
-        body = self._statement()
+        body = yield self._statement()
 
         # put together desugared loop
         if increment is not None:
-            body = Stmt.Block([body, Stmt.Expression(increment)])
+            body = Stmt.Block((body, Stmt.Expression(increment)))
         loop: Stmt.Stmt = Stmt.While(condition, body)
         if initializer is not None:
-            loop = Stmt.Block([initializer, loop])
+            loop = Stmt.Block((initializer, loop))
 
         return loop
 
-    def _while_statement(self) -> Stmt.While:
+    def _while_statement(self) -> _Task[Stmt.While]:
         self._consume(TokenType.LEFT_PAREN, "Expect '(' after 'while'.")
         condition = self._expression()
         self._consume(TokenType.RIGHT_PAREN, "Expect ')' after condition.")
 
-        body = self._statement()
+        body = yield self._statement()
 
         return Stmt.While(condition, body)
 
-    def _if_statement(self) -> Stmt.If:
+    def _if_statement(self) -> _Task[Stmt.If]:
         self._consume(TokenType.LEFT_PAREN, "Expect '(' after 'if'.")
         condition = self._expression()
         self._consume(TokenType.RIGHT_PAREN, "Expect ')' after condition.")
 
-        then_stmt = self._statement()
+        then_stmt = yield self._statement()
 
         else_stmt = None
         if self._match(TokenType.ELSE):
-            else_stmt = self._statement()
+            else_stmt = yield self._statement()
 
         return Stmt.If(condition, then_stmt, else_stmt)
 
-    def _block_statement(self) -> Stmt.Block:
-        return Stmt.Block(self._block())
+    def _block_statement(self) -> _Task[Stmt.Block]:
+        return Stmt.Block((yield self._block()))
 
-    def _block(self) -> list[Stmt.Stmt]:
+    def _block(self) -> _Task[tuple[Stmt.Stmt, ...]]:
         statements = []
 
         while not self._is_at_end() and not self._check(TokenType.RIGHT_BRACE):
             statement = self._declaration()
+            if type(statement) is GeneratorType:
+                statement = yield statement
             if statement is None:
                 continue
 
@@ -271,7 +362,32 @@ class Parser:
 
         self._consume(TokenType.RIGHT_BRACE, "Expect '}' after block.")
 
-        return statements
+        return tuple(statements)
+
+    def _skip_block(self) -> tuple[Token, ...]:
+        # Called after the opening brace, returns the block's tokens including
+        # both braces. Pulls from the token iterator directly since this runs
+        # over most of a library's tokens.
+        tokens = [self._previous]
+        depth = 1
+        token = self._current
+
+        while token.type_ is not TokenType.EOF:
+            tokens.append(token)
+
+            if token.type_ is TokenType.LEFT_BRACE:
+                depth += 1
+            elif token.type_ is TokenType.RIGHT_BRACE:
+                depth -= 1
+                if depth == 0:
+                    self._previous = token
+                    self._current = next(self._tokens)
+                    return tuple(tokens)
+
+            token = next(self._tokens)
+
+        self._current = token
+        raise self._error(token, "Expect '}' after block.")
 
     def _var_declaration(self) -> Stmt.Var:
         name = self._consume(TokenType.IDENTIFIER, "Expect variable name.")
@@ -294,165 +410,239 @@ class Parser:
         return Stmt.Expression(expr)
 
     def _expression(self) -> Expr.Expr:
-        return self._assignment()
+        return self._parse_precedence(Precedence.ASSIGNMENT)
 
-    def _assignment(self) -> Expr.Expr:
-        expr = self._or()
-
-        if self._match(TokenType.EQUAL):
-            equals = self._peek(offset=-1)
-            value = self._assignment()
-
-            if isinstance(expr, Expr.Variable):
-                name = expr.name
-                return Expr.Assign(name, value)
-            elif isinstance(expr, Expr.Get):
-                return Expr.Set(expr.object, expr.name, value)
-
-            self._error(equals, "Invalid assignment target.")
-
-        return expr
-
-    def _or(self) -> Expr.Expr:
-        expr = self._and()
-
-        while self._match(TokenType.OR):
-            operator = self._peek(offset=-1)
-            right = self._and()
-            expr = Expr.Logical(expr, operator, right)
-
-        return expr
-
-    def _and(self) -> Expr.Expr:
-        expr = self._equality()
-
-        while self._match(TokenType.AND):
-            operator = self._peek(offset=-1)
-            right = self._equality()
-            expr = Expr.Logical(expr, operator, right)
-
-        return expr
-
-    def _equality(self) -> Expr.Expr:
-        expr = self._comparison()
-
-        while self._match(TokenType.BANG_EQUAL, TokenType.EQUAL_EQUAL):
-            operator = self._peek(offset=-1)
-            right = self._comparison()
-            expr = Expr.Binary(expr, operator, right)
-
-        return expr
-
-    def _comparison(self) -> Expr.Expr:
-        expr = self._term()
-
-        while self._match(
-            TokenType.GREATER,
-            TokenType.GREATER_EQUAL,
-            TokenType.LESS,
-            TokenType.LESS_EQUAL,
-        ):
-            operator = self._peek(offset=-1)
-            right = self._term()
-            expr = Expr.Binary(expr, operator, right)
-
-        return expr
-
-    def _term(self) -> Expr.Expr:
-        expr = self._factor()
-
-        while self._match(TokenType.PLUS, TokenType.MINUS):
-            operator = self._peek(offset=-1)
-            right = self._factor()
-            expr = Expr.Binary(expr, operator, right)
-
-        return expr
-
-    def _factor(self) -> Expr.Expr:
-        expr = self._unary()
-
-        while self._match(TokenType.STAR, TokenType.SLASH):
-            operator = self._peek(offset=-1)
-            right = self._unary()
-            expr = Expr.Binary(expr, operator, right)
-
-        return expr
-
-    def _unary(self) -> Expr.Expr:
-        if self._match(TokenType.BANG, TokenType.MINUS):
-            operator = self._peek(offset=-1)
-            expr = self._unary()
-            return Expr.Unary(operator, expr)
-
-        return self._call()
-
-    def _call(self) -> Expr.Expr:
-        expr: Expr.Expr = self._primary()
+    def _parse_precedence(self, precedence: Precedence) -> Expr.Expr:
+        # Operands are parsed on an explicit stack instead of by recursion, so
+        # nesting depth is only bounded by memory. A rule that needs an operand
+        # returns an _Operand request, and the rest of the rule is run as a
+        # continuation once the operand has been parsed.
+        pending: list[tuple[Precedence, Continuation, tuple[Any, ...]]] = []
+        tokens = self._tokens
 
         while True:
-            if self._match(TokenType.LEFT_PAREN):
-                expr = self._finish_call(expr)
-            elif self._match(TokenType.DOT):
-                name = self._consume(
-                    TokenType.IDENTIFIER, "Expect property name after '.'"
-                )
-                expr = Expr.Get(expr, name)
-            else:
-                break
-
-        return expr
-
-    def _finish_call(self, callee: Expr.Expr) -> Expr.Call:
-        arguments: list[Expr.Expr] = []
+            token = self._current
+            prefix_rule = _PREFIX_RULES.get(token.type_)
+            if prefix_rule is None:
+                raise self._error(token, "Expect expression.")
+
+            # Same as _advance, which the EOF never gets here to stop.
+            self._previous = token
+            self._current = next(tokens)
+            result = prefix_rule(self, token)
+
+            while type(result) is not tuple:
+                expr = result
+
+                # Keep extending expr with infix operators that bind at least
+                # as tightly as the enclosing rule allows.
+                token = self._current
+                infix_rule = _INFIX_RULES.get(token.type_)
+                if infix_rule is not None and infix_rule[0] >= precedence:
+                    self._previous = token
+                    self._current = next(tokens)
+                    result = infix_rule[1](self, expr, token, infix_rule[0])
+                    continue
+
+                if not pending:
+                    return expr
+
+                precedence, continuation, args = pending.pop()
+                result = continuation(*args, expr)
+
+            operand_precedence, continuation, args = result
+            pending.append((precedence, continuation, args))
+            precedence = operand_precedence
+
+    def _assignment(
+        self, target: Expr.Expr, equals: Token, precedence: Precedence
+    ) -> _Operand:
+        # right associative
+        return precedence, self._finish_assignment, (target, equals)
+
+    def _finish_assignment(
+        self, target: Expr.Expr, equals: Token, value: Expr.Expr
+    ) -> Expr.Expr:
+        if isinstance(target, Expr.Variable):
+            return Expr.Assign(target.name, value)
+        elif isinstance(target, Expr.Get):
+            return Expr.Set(target.object, target.name, value)
+
+        self._error(equals, "Invalid assignment target.")
+
+        return target
+
+    def _ternary(
+        self, condition: Expr.Expr, question: Token, precedence: Precedence
+    ) -> _Operand:
+        return Precedence.ASSIGNMENT, self._ternary_else, (condition, precedence)
+
+    def _ternary_else(
+        self, condition: Expr.Expr, precedence: Precedence, true_expr: Expr.Expr
+    ) -> _Operand:
+        self._consume(TokenType.COLON, "Expect ':' after then branch of ternary.")
+        # right associative
+        return precedence, self._finish_ternary, (condition, true_expr)
+
+    def _finish_ternary(
+        self, condition: Expr.Expr, true_expr: Expr.Expr, false_expr: Expr.Expr
+    ) -> Expr.Ternary:
+        return Expr.Ternary(condition, true_expr, false_expr)
+
+    def _logical(
+        self, left: Expr.Expr, operator: Token, precedence: Precedence
+    ) -> _Operand:
+        return precedence + 1, self._finish_logical, (left, operator)
+
+    def _finish_logical(
+        self, left: Expr.Expr, operator: Token, right: Expr.Expr
+    ) -> Expr.Logical:
+        return Expr.Logical(left, operator, right)
+
+    def _binary(
+        self, left: Expr.Expr, operator: Token, precedence: Precedence
+    ) -> _Operand:
+        return precedence + 1, self._finish_binary, (left, operator)
+
+    def _finish_binary(
+        self, left: Expr.Expr, operator: Token, right: Expr.Expr
+    ) -> Expr.Binary:
+        return Expr.Binary(left, operator, right)
+
+    def _call(
+        self, callee: Expr.Expr, paren: Token, precedence: Precedence
+    ) -> Expr.Call | _Operand:
+        if self._match(TokenType.RIGHT_PAREN):
+            return Expr.Call(callee, self._previous, ())
+
+        return Precedence.ASSIGNMENT, self._call_argument, (callee, [])
+
+    def _call_argument(
+        self, callee: Expr.Expr, arguments: list[Expr.Expr], argument: Expr.Expr
+    ) -> Expr.Call | _Operand:
+        arguments.append(argument)
+
+        if self._match(TokenType.COMMA):
+            if len(arguments) > MAX_ARG_COUNT:
+                _message = f"Can't have more than {MAX_ARG_COUNT} arguments."
+                self._error(self._peek(), _message)
+
+            return Precedence.ASSIGNMENT, self._call_argument, (callee, arguments)
 
-        if not self._check(TokenType.RIGHT_PAREN):
-            # quasi do-while loop
-            while True:
-                if len(arguments) > MAX_ARG_COUNT:
-                    _message = f"Can't have more than {MAX_ARG_COUNT} arguments."
-                    self._error(self._peek(), _message)
+        paren = self._consume(TokenType.RIGHT_PAREN, "Expect ')' after arguments.")
 
-                expr = self._expression()
-                arguments.append(expr)
+        return Expr.Call(callee, paren, tuple(arguments))
 
-                if not self._match(TokenType.COMMA):
-                    break
+    def _get(self, object_: Expr.Expr, dot: Token, precedence: Precedence) -> Expr.Get:
+        name = self._consume(TokenType.IDENTIFIER, "Expect property name after '.'")
+        return Expr.Get(object_, name)
 
-        paren = self._consume(TokenType.RIGHT_PAREN, "Expect ')' after arguments.")
+    def _unary(self, operator: Token) -> _Operand:
+        return Precedence.UNARY, self._finish_unary, (operator,)
 
-        return Expr.Call(callee, paren, arguments)
+    def _finish_unary(self, operator: Token, expr: Expr.Expr) -> Expr.Unary:
+        return Expr.Unary(operator, expr)
 
-    def _primary(
-        self,
-    ) -> Expr.Literal | Expr.Variable | Expr.Grouping | Expr.This | Expr.Super:
-        if self._match(TokenType.TRUE):
+    def _literal(self, token: Token) -> Expr.Literal:
+        if token.type_ is TokenType.TRUE:
             return Expr.Literal(True)
-        if self._match(TokenType.FALSE):
+        if token.type_ is TokenType.FALSE:
             return Expr.Literal(False)
-        if self._match(TokenType.NIL):
-            return Expr.Literal(None)
-
-        if self._match(TokenType.NUMBER, TokenType.STRING):
-            token = self._peek(offset=-1)
-            return Expr.Literal(token.literal)
-
-        if self._match(TokenType.THIS):
-            return Expr.This(self._peek(offset=-1))
-
-        if self._match(TokenType.IDENTIFIER):
-            return Expr.Variable(self._peek(offset=-1))
-
-        if self._match(TokenType.SUPER):
-            keyword = self._peek(offset=-1)
-            self._consume(TokenType.DOT, "Expect '.' after 'super'.")
-            method = self._consume(
-                TokenType.IDENTIFIER, "Expect superclass method name."
-            )
-            return Expr.Super(keyword, method)
-
-        if self._match(TokenType.LEFT_PAREN):
-            expr = self._expression()
-            self._consume(TokenType.RIGHT_PAREN, "Expect ')' after expression.")
-            return Expr.Grouping(expr)
 
-        raise self._error(self._peek(), "Expect expression.")
+        # nil, number or string
+        return Expr.Literal(token.literal)
+
+    def _variable(self, name: Token) -> Expr.Variable:
+        return Expr.Variable(name)
+
+    def _this(self, keyword: Token) -> Expr.This:
+        return Expr.This(keyword)
+
+    def _super(self, keyword: Token) -> Expr.Super:
+        self._consume(TokenType.DOT, "Expect '.' after 'super'.")
+        method = self._consume(TokenType.IDENTIFIER, "Expect superclass method name.")
+        return Expr.Super(keyword, method, Expr.This(keyword))
+
+    def _grouping(self, paren: Token) -> _Operand:
+        return Precedence.ASSIGNMENT, self._finish_grouping, ()
+
+    def _finish_grouping(self, expr: Expr.Expr) -> Expr.Grouping:
+        self._consume(TokenType.RIGHT_PAREN, "Expect ')' after expression.")
+        return Expr.Grouping(expr)
+
+
+class Precedence(IntEnum):
+    NONE = auto()
+    ASSIGNMENT = auto()  # =
+    TERNARY = auto()  # ?:
+    OR = auto()  # or
+    AND = auto()  # and
+    EQUALITY = auto()  # == !=
+    COMPARISON = auto()  # < > <= >=
+    TERM = auto()  # + -
+    FACTOR = auto()  # * /
+    UNARY = auto()  # ! -
+    CALL = auto()  # . ()
+    PRIMARY = auto()
+
+
+# Statements that contain other statements, and so are parsed by a _Task.
+_NESTING_STATEMENTS = frozenset(
+    {
+        TokenType.FUN,
+        TokenType.CLASS,
+        TokenType.IF,
+        TokenType.FOR,
+        TokenType.WHILE,
+        TokenType.LEFT_BRACE,
+    }
+)
+
+# A statement parser: yields the parsers of nested statements, is sent back
+# their results, and returns its own.
+_Task = Generator["_Task[Any]", Any, T]
+
+# Returned by a parse rule that needs an operand: the precedence to parse the
+# operand at, and the continuation to call with the args and the operand. The
+# continuation returns an expression or another request in the same way.
+_Operand = tuple[int, "Continuation", tuple[Any, ...]]
+Continuation = Callable[..., "Expr.Expr | _Operand"]
+
+PrefixRule = Callable[[Parser, Token], Expr.Expr | _Operand]
+InfixRule = Callable[[Parser, Expr.Expr, Token, Precedence], Expr.Expr | _Operand]
+
+# Parses an expression that starts with the token, which has been consumed.
+_PREFIX_RULES: dict[TokenType, PrefixRule] = {
+    TokenType.BANG: Parser._unary,
+    TokenType.MINUS: Parser._unary,
+    TokenType.TRUE: Parser._literal,
+    TokenType.FALSE: Parser._literal,
+    TokenType.NIL: Parser._literal,
+    TokenType.NUMBER: Parser._literal,
+    TokenType.STRING: Parser._literal,
+    TokenType.IDENTIFIER: Parser._variable,
+    TokenType.THIS: Parser._this,
+    TokenType.SUPER: Parser._super,
+    TokenType.LEFT_PAREN: Parser._grouping,
+}
+
+# How tightly the token binds as an infix or postfix operator, and how to parse
+# the rest of the expression once the token has been consumed.
+_INFIX_RULES: dict[TokenType, tuple[Precedence, InfixRule]] = {
+    TokenType.EQUAL: (Precedence.ASSIGNMENT, Parser._assignment),
+    TokenType.QUESTION: (Precedence.TERNARY, Parser._ternary),
+    TokenType.OR: (Precedence.OR, Parser._logical),
+    TokenType.AND: (Precedence.AND, Parser._logical),
+    TokenType.BANG_EQUAL: (Precedence.EQUALITY, Parser._binary),
+    TokenType.EQUAL_EQUAL: (Precedence.EQUALITY, Parser._binary),
+    TokenType.GREATER: (Precedence.COMPARISON, Parser._binary),
+    TokenType.GREATER_EQUAL: (Precedence.COMPARISON, Parser._binary),
+    TokenType.LESS: (Precedence.COMPARISON, Parser._binary),
+    TokenType.LESS_EQUAL: (Precedence.COMPARISON, Parser._binary),
+    TokenType.PLUS: (Precedence.TERM, Parser._binary),
+    TokenType.MINUS: (Precedence.TERM, Parser._binary),
+    TokenType.STAR: (Precedence.FACTOR, Parser._binary),
+    TokenType.SLASH: (Precedence.FACTOR, Parser._binary),
+    TokenType.LEFT_PAREN: (Precedence.CALL, Parser._call),
+    TokenType.DOT: (Precedence.CALL, Parser._get),
+}
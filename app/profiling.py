@@ -0,0 +1,309 @@
+from collections import Counter
+from collections.abc import Iterator, Sequence
+from dataclasses import fields
+import marshal
+from typing import Any, cast
+
+from app import expression as Expr
+from app import statement as Stmt
+from app import tiered
+from app.constants import CONSTRUCTOR_METHOD_NAME
+from app.interpreter import Interpreter
+from app.quicken import (
+    CALL_CLASS,
+    CALL_FUNCTION,
+    GENERIC,
+    VARIANTS,
+    WARMUP,
+    binary_variant,
+    logical_variant,
+    unary_variant,
+)
+from app.runtime import LoxClass, LoxFunction, LoxObject
+from app.schema import AstNode
+
+# A profile is what a run saw at the nodes that can make use of it: the variant
+# each Binary, Unary, Logical and Call node specialized into, which says what
+# its operands were, how many different things each call site called, how
+# often each function was called and which of its parameters were always
+# numbers, which way each if went, and how often each loop went round.
+#
+# Entries are keyed by the function or class the node is in, its line counted
+# from that function's, and its place among the nodes of its kind on that line,
+# so editing one function leaves the keys in the others as they were. Each entry
+# starts with something to check the node against (its operator, or how many
+# arguments or parameters it has), and entries that don't match their node, or
+# have none, are skipped, so a profile of an older version of the program is
+# still safe to use.
+#
+# Profiles are stored as MAGIC, FORMAT_VERSION and the marshalled entries.
+MAGIC = b"LOXP"
+FORMAT_VERSION = 1
+
+Entries = dict[str, tuple[Any, ...]]
+
+_KINDS: dict[type[AstNode], str] = {
+    Expr.Binary: "b",
+    Expr.Unary: "u",
+    Expr.Logical: "l",
+    Expr.Call: "c",
+    Stmt.If: "i",
+    Stmt.While: "w",
+    Stmt.Function: "f",
+}
+
+
+class Recorder:
+    """
+    Counts what the interpreter does at the nodes that don't keep track of it
+    themselves, while a profile of the run is being recorded.
+    """
+
+    # Up to two of the different functions, classes or builtins each call site
+    # called, which is enough to tell whether it's monomorphic.
+    targets: dict[Expr.Call, list[object]]
+    calls: dict[Stmt.Function, int]
+    # A bit for each of a function's parameters, set while every argument
+    # passed for it has been a number.
+    numbers: dict[Stmt.Function, int]
+    # How often each if took its then and its else branch.
+    branches: dict[Stmt.If, list[int]]
+    # How often each loop was entered, and how often it went round.
+    loops: dict[Stmt.While, list[int]]
+
+    def __init__(self) -> None:
+        self.targets = {}
+        self.calls = {}
+        self.numbers = {}
+        self.branches = {}
+        self.loops = {}
+
+    def call(
+        self, expr: Expr.Call, callee: LoxObject, arguments: Sequence[LoxObject]
+    ) -> None:
+        declaration = None
+        target: object = callee
+        if isinstance(callee, LoxFunction):
+            target = declaration = callee._declaration
+        elif isinstance(callee, LoxClass):
+            initializer = callee.find_method(CONSTRUCTOR_METHOD_NAME)
+            if initializer is not None:
+                declaration = initializer._declaration
+
+        targets = self.targets.setdefault(expr, [])
+        if len(targets) < 2 and all(seen is not target for seen in targets):
+            targets.append(target)
+
+        if declaration is not None:
+            self.calls[declaration] = self.calls.get(declaration, 0) + 1
+
+            numbers = 0
+            for index, argument in enumerate(arguments):
+                if type(argument) is float:
+                    numbers |= 1 << index
+            self.numbers[declaration] = self.numbers.get(declaration, numbers) & numbers
+
+    def branch(self, stmt: Stmt.If, taken: bool) -> None:
+        counts = self.branches.get(stmt)
+        if counts is None:
+            counts = self.branches[stmt] = [0, 0]
+        counts[0 if taken else 1] += 1
+
+    def loop(self, stmt: Stmt.While, trips: int) -> None:
+        counts = self.loops.get(stmt)
+        if counts is None:
+            counts = self.loops[stmt] = [0, 0]
+        counts[0] += 1
+        counts[1] += trips
+
+
+def _line(node: AstNode) -> int:
+    if isinstance(node, (Expr.Binary, Expr.Unary, Expr.Logical)):
+        return node.operator.line
+    if type(node) is Expr.Call:
+        return node.paren.line
+    if type(node) is Stmt.Function:
+        return node.name.line
+
+    return tiered.first_line(node)
+
+
+def keyed_nodes(statements: Sequence[Stmt.Stmt]) -> Iterator[tuple[str, AstNode]]:
+    """
+    The nodes in a program a profile can have entries for, with their keys, in
+    the order they appear in it.
+    """
+
+    scopes: Counter[str] = Counter()
+    places: Counter[tuple[str, int, str]] = Counter()
+
+    # Entries are (value, scope, line the scope starts on).
+    stack: list[tuple[object, str, int]] = [(tuple(statements), "", 0)]
+    while stack:
+        value, scope, start = stack.pop()
+        if type(value) is tuple:
+            stack.extend((item, scope, start) for item in reversed(value))
+            continue
+        if not isinstance(value, AstNode):
+            continue
+
+        if type(value) is Stmt.Function or type(value) is Stmt.Class:
+            name = f"{scope}.{value.name.lexeme}" if scope else value.name.lexeme
+            scopes[name] += 1
+            if scopes[name] > 1:
+                name = f"{name}#{scopes[name]}"
+            scope = name
+            if type(value) is Stmt.Function:
+                start = value.name.line
+
+        kind = _KINDS.get(type(value))
+        if kind is not None:
+            line = _line(value) - start
+            place = places[scope, line, kind]
+            places[scope, line, kind] += 1
+            yield f"{scope}:{line}:{kind}{place}", value
+
+        for field_ in reversed(fields(value)):  # type: ignore[arg-type]
+            child = getattr(value, field_.name)
+            if isinstance(child, (AstNode, tuple)):
+                stack.append((child, scope, start))
+
+
+def _variant_name(quick: int) -> str:
+    # Empty for a node that hasn't run enough times to specialize.
+    return VARIANTS[quick - WARMUP] if quick >= WARMUP else ""
+
+
+def collect(
+    statements: Sequence[Stmt.Stmt], interpreter: Interpreter, recorder: Recorder
+) -> Entries:
+    """
+    The profile of a run of the program, from its nodes, the recorder and, for
+    the tiered interpreter, the counters it keeps itself.
+    """
+
+    profiles: dict[AstNode, tiered.Profile] = {}
+    if isinstance(interpreter, tiered.TieredInterpreter):
+        profiles = interpreter.profiles
+
+    entries: Entries = {}
+    for key, node in keyed_nodes(statements):
+        if type(node) is Stmt.Function or type(node) is Stmt.While:
+            profile = profiles.get(node)
+            compiled = profile is not None and profile.tier != tiered.INTERPRETED
+
+            if type(node) is Stmt.Function:
+                calls = recorder.calls.get(node, 0)
+                if profile is not None:
+                    calls = max(calls, profile.count)
+                hot = compiled or calls >= tiered.HOT_CALLS
+                if calls or hot:
+                    numbers = recorder.numbers.get(node, 0)
+                    entries[key] = (len(node.params), calls, numbers, hot)
+            else:
+                entered, trips = recorder.loops.get(node, (0, 0))
+                if profile is not None:
+                    trips = max(trips, profile.count)
+                hot = compiled or trips >= tiered.HOT_LOOP
+                if trips or hot:
+                    entries[key] = (None, entered, trips, hot)
+        elif type(node) is Stmt.If:
+            counts = recorder.branches.get(node)
+            if counts is not None:
+                entries[key] = (None, *counts)
+        elif type(node) is Expr.Call:
+            targets = recorder.targets.get(node, ())
+            if node.quick >= WARMUP or targets:
+                variant = _variant_name(node.quick)
+                entries[key] = (len(node.arguments), variant, len(targets))
+        elif isinstance(node, (Expr.Binary, Expr.Unary, Expr.Logical)):
+            if node.quick >= WARMUP:
+                entries[key] = (node.operator.lexeme, _variant_name(node.quick))
+
+    return entries
+
+
+def _check(node: AstNode) -> object:
+    # What an entry for the node starts with.
+    if type(node) is Expr.Call:
+        return len(node.arguments)
+    if type(node) is Stmt.Function:
+        return len(node.params)
+    if isinstance(node, (Expr.Binary, Expr.Unary, Expr.Logical)):
+        return node.operator.lexeme
+
+    return None
+
+
+def _variants(node: AstNode) -> set[int]:
+    # The variants the node could specialize into.
+    if type(node) is Expr.Binary:
+        type_ = node.operator.type_
+        variants = {binary_variant(type_, 0.0, 0.0), binary_variant(type_, "", "")}
+    elif type(node) is Expr.Unary:
+        type_ = node.operator.type_
+        variants = {unary_variant(type_, 0.0), unary_variant(type_, False)}
+    elif type(node) is Expr.Logical:
+        variants = {logical_variant(node.operator.type_, False)}
+    else:
+        variants = {CALL_FUNCTION, CALL_CLASS}
+
+    return variants | {GENERIC}
+
+
+def apply(
+    statements: Sequence[Stmt.Stmt], interpreter: Interpreter, entries: Entries
+) -> int:
+    """
+    Specializes the program's nodes as the profile says they will be, and has
+    the tiered interpreter compile the functions and loops that got hot as soon
+    as they run. Returns how many of the profile's entries matched a node.
+    """
+
+    matched = 0
+    for key, node in keyed_nodes(statements):
+        entry = entries.get(key)
+        if entry is None or entry[0] != _check(node):
+            continue
+        matched += 1
+
+        if type(node) is Stmt.Function or type(node) is Stmt.While:
+            if entry[-1] and isinstance(interpreter, tiered.TieredInterpreter):
+                interpreter.prime(node)
+        elif type(node) is not Stmt.If and entry[1] in VARIANTS:
+            expr = cast(Expr.Binary | Expr.Unary | Expr.Logical | Expr.Call, node)
+            variant = WARMUP + VARIANTS.index(entry[1])
+            if variant in _variants(expr):
+                expr.quick = variant
+                interpreter.quicken_stats.nodes[variant] += 1
+
+    return matched
+
+
+def dump(entries: Entries) -> bytes:
+    return MAGIC + bytes([FORMAT_VERSION]) + marshal.dumps(entries)
+
+
+def load(data: bytes) -> Entries | None:
+    """
+    Reads a profile written by dump. Returns None if the data is from another
+    version or isn't a profile.
+    """
+
+    header = MAGIC + bytes([FORMAT_VERSION])
+    if not data.startswith(header):
+        return None
+
+    try:
+        entries = marshal.loads(data[len(header) :])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+    if type(entries) is not dict:
+        return None
+
+    return {
+        key: entry
+        for key, entry in entries.items()
+        if type(key) is str and type(entry) is tuple and len(entry) >= 2
+    }
@@ -0,0 +1,154 @@
+from dataclasses import dataclass, field
+import operator
+from typing import Any
+
+from app.runtime import LoxClass, LoxFunction
+from app.schema import TokenType
+
+# Binary, Unary, Logical and Call nodes specialize themselves as the tree walker
+# runs them. A node's quick field counts the times it has run until it has run
+# WARMUP times, and then holds the variant it specialized into for the operand
+# types it saw last, or GENERIC if there isn't one. A variant checks its
+# operands are still of those types each time it runs, and the node goes back
+# to GENERIC for good when they aren't.
+WARMUP = 2
+
+VARIANTS = (
+    "generic",
+    # Binary operators on two numbers, in this order.
+    "number-add",
+    "number-subtract",
+    "number-multiply",
+    "number-divide",
+    "number-less",
+    "number-less-equal",
+    "number-greater",
+    "number-greater-equal",
+    "number-equal",
+    "number-not-equal",
+    "string-concat",
+    "number-negate",
+    "bool-not",
+    "bool-and",
+    "bool-or",
+    # Calls to a function, or class, of the interpreter's own.
+    "call-function",
+    "call-class",
+)
+(
+    GENERIC,
+    NUMBER_ADD,
+    NUMBER_SUBTRACT,
+    NUMBER_MULTIPLY,
+    NUMBER_DIVIDE,
+    NUMBER_LESS,
+    NUMBER_LESS_EQUAL,
+    NUMBER_GREATER,
+    NUMBER_GREATER_EQUAL,
+    NUMBER_EQUAL,
+    NUMBER_NOT_EQUAL,
+    STRING_CONCAT,
+    NUMBER_NEGATE,
+    BOOL_NOT,
+    BOOL_AND,
+    BOOL_OR,
+    CALL_FUNCTION,
+    CALL_CLASS,
+) = range(WARMUP, WARMUP + len(VARIANTS))
+
+_SIZE = WARMUP + len(VARIANTS)
+
+_NUMBER_VARIANTS = {
+    TokenType.PLUS: NUMBER_ADD,
+    TokenType.MINUS: NUMBER_SUBTRACT,
+    TokenType.STAR: NUMBER_MULTIPLY,
+    TokenType.SLASH: NUMBER_DIVIDE,
+    TokenType.LESS: NUMBER_LESS,
+    TokenType.LESS_EQUAL: NUMBER_LESS_EQUAL,
+    TokenType.GREATER: NUMBER_GREATER,
+    TokenType.GREATER_EQUAL: NUMBER_GREATER_EQUAL,
+    TokenType.EQUAL_EQUAL: NUMBER_EQUAL,
+    TokenType.BANG_EQUAL: NUMBER_NOT_EQUAL,
+}
+
+# What each number variant computes, indexed by variant.
+NUMBER_OPERATIONS: tuple[Any, ...] = (None,) * NUMBER_ADD + (
+    operator.add,
+    operator.sub,
+    operator.mul,
+    operator.truediv,
+    operator.lt,
+    operator.le,
+    operator.gt,
+    operator.ge,
+    operator.eq,
+    operator.ne,
+)
+
+
+def binary_variant(operator_: TokenType, left: object, right: object) -> int:
+    if type(left) is float and type(right) is float:
+        return _NUMBER_VARIANTS.get(operator_, GENERIC)
+    if operator_ == TokenType.PLUS and type(left) is str and type(right) is str:
+        return STRING_CONCAT
+
+    return GENERIC
+
+
+def unary_variant(operator_: TokenType, value: object) -> int:
+    if operator_ == TokenType.MINUS and type(value) is float:
+        return NUMBER_NEGATE
+    if operator_ == TokenType.BANG and type(value) is bool:
+        return BOOL_NOT
+
+    return GENERIC
+
+
+def logical_variant(operator_: TokenType, left: object) -> int:
+    if type(left) is not bool:
+        return GENERIC
+
+    return BOOL_OR if operator_ == TokenType.OR else BOOL_AND
+
+
+def call_variant(function_type: type[LoxFunction], callee: object) -> int:
+    if type(callee) is function_type:
+        return CALL_FUNCTION
+    if type(callee) is LoxClass:
+        return CALL_CLASS
+
+    return GENERIC
+
+
+@dataclass
+class QuickenStats:
+    """
+    How many nodes specialized into each variant, and how often a variant's
+    check passed (hits) or failed (misses) once they had. Runs of generic nodes
+    count as hits of the generic variant, which has no rate, and nodes that
+    fell back to it count there too.
+    """
+
+    # Indexed by variant.
+    nodes: list[int] = field(default_factory=lambda: [0] * _SIZE)
+    hits: list[int] = field(default_factory=lambda: [0] * _SIZE)
+    misses: list[int] = field(default_factory=lambda: [0] * _SIZE)
+
+    def report(self) -> str:
+        lines = [
+            f"{'variant':<22} {'nodes':>6} {'hits':>10} {'misses':>7}"
+            f" {'hit rate':>8}"
+        ]
+        for variant, name in enumerate(VARIANTS, WARMUP):
+            nodes = self.nodes[variant]
+            hits = self.hits[variant]
+            misses = self.misses[variant]
+            if nodes == 0 and hits == 0:
+                continue
+
+            rate = "-"
+            if variant != GENERIC and hits + misses:
+                rate = f"{hits / (hits + misses):.1%}"
+            lines.append(f"{name:<22} {nodes:>6} {hits:>10} {misses:>7} {rate:>8}")
+
+        return "\n".join(lines)
@@ -1,57 +1,257 @@
-from collections.abc import Sequence
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator, Sequence
+from functools import partial
 from app.constants import CONSTRUCTOR_METHOD_NAME, SUPER_KEYWORD, THIS_KEYWORD
-from app.errors import LoxResolverError
+from app.errors import LoxParserError, LoxResolverError
 from app import expression as Expr
 from app import statement as Stmt
-from app.interpreter import Interpreter
+from app.interpreter import COMPARISONS, SHALLOW_DEPTH, Interpreter
 from app.logger import Logger
-from app.schema import ClassType, FunctionType, Token, TokenType
-
-
-class Resolver(Expr.Visitor[None], Stmt.Visitor[None]):
+from app.parser import Parser
+from app.schema import ClassType, FunctionType, Storage, Token, TokenType
+
+
+# The nodes a visit would recurse into, in order, or None for a leaf.
+Children = Iterator[Expr.Expr | Stmt.Stmt] | None
+
+# Nodes that are told where the variable they declare or use lives.
+Declaration = Stmt.Var | Stmt.Function | Stmt.Class
+Reference = Expr.Variable | Expr.Assign | Expr.This | Expr.Super
+
+
+def _flatten(statements: tuple[Stmt.Stmt, ...]) -> tuple[Stmt.Stmt, ...]:
+    # Once resolved, a block's only effect was the scope its names resolved
+    # in, so a block inside another runs the same spliced into it, without
+    # the dispatch.
+    if not any(type(statement) is Stmt.Block for statement in statements):
+        return statements
+
+    flat: list[Stmt.Stmt] = []
+    for statement in statements:
+        if type(statement) is Stmt.Block:
+            flat.extend(statement.statements)
+        else:
+            flat.append(statement)
+
+    return tuple(flat)
+
+
+def _unwrap(statement: Stmt.Stmt) -> Stmt.Stmt:
+    if type(statement) is Stmt.Block and len(statement.statements) == 1:
+        return statement.statements[0]
+
+    return statement
+
+
+def _is_counter(expr: Expr.Expr, slot: int) -> bool:
+    return (
+        type(expr) is Expr.Variable
+        and expr.storage is Storage.LOCAL
+        and expr.slot == slot
+    )
+
+
+def _is_counted_loop(loop: Stmt.While, counter: Stmt.Var) -> bool:
+    # The shape Parser._for_statement gives `for (var i = ...; i < limit; i = i
+    # + step)`, with i a local no function captures and step a number.
+    if counter.storage is not Storage.LOCAL:
+        return False
+
+    condition = loop.condition
+    if (
+        type(condition) is not Expr.Binary
+        or condition.operator.type_ not in COMPARISONS
+        or not _is_counter(condition.left, counter.slot)
+    ):
+        return False
+
+    body = loop.body
+    increment = (body.statements if type(body) is Stmt.Block else (body,))[-1]
+    if type(increment) is not Stmt.Expression:
+        return False
+
+    assign = increment.expr
+    if (
+        type(assign) is not Expr.Assign
+        or assign.storage is not Storage.LOCAL
+        or assign.slot != counter.slot
+    ):
+        return False
+
+    step = assign.value_expr
+    return (
+        type(step) is Expr.Binary
+        and step.operator.type_ in (TokenType.PLUS, TokenType.MINUS)
+        and _is_counter(step.left, counter.slot)
+        and type(step.right) is Expr.Literal
+        and type(step.right.value) is float
+    )
+
+
+class Local:
+    __slots__ = ("slot", "defined", "captured", "uses")
+
+    slot: int
+    defined: bool
+    # Whether a function declared in the local's scope uses it, so that it has
+    # to live in a Cell.
+    captured: bool
+    # The nodes in the local's own function that declare or use it. Whether
+    # it's captured is only known once its scope ends, so that's when they're
+    # told its storage.
+    uses: list[Declaration | Reference]
+
+    def __init__(self, slot: int) -> None:
+        self.slot = slot
+        self.defined = False
+        self.captured = False
+        self.uses = []
+
+
+class FunctionScope:
+    """
+    The scopes of a function being resolved, or of the top level. All the
+    locals of a call share one flat frame: every scope numbers its locals on
+    from the slots its enclosing scopes use, and sibling scopes reuse slots.
+    """
+
+    __slots__ = (
+        "enclosing",
+        "scopes",
+        "slot_count",
+        "frame_size",
+        "captures",
+        "free",
+        "base",
+        "depth",
+    )
+
+    enclosing: FunctionScope | None
+    scopes: list[dict[str, Local]]
+    slot_count: int
+    frame_size: int
+    # As in Stmt.Function.captures, and the index of each captured name.
+    captures: list[int]
+    free: dict[str, int]
+    # How deep the resolver's stack of visits was when the body started, and
+    # the deepest it's been since.
+    base: int
+    depth: int
+
+    def __init__(self, enclosing: FunctionScope | None) -> None:
+        self.enclosing = enclosing
+        self.scopes = []
+        self.slot_count = 0
+        self.frame_size = 0
+        self.captures = []
+        self.free = {}
+        self.base = 0
+        self.depth = 0
+
+    def find(self, name: str) -> Local | None:
+        for scope in reversed(self.scopes):
+            local = scope.get(name)
+            if local is not None:
+                return local
+
+        return None
+
+
+class Resolver(Expr.Visitor[Children], Stmt.Visitor[Children]):
     _logger: Logger
     _interpreter: Interpreter
-    _scopes: list[dict[str, bool]]
+    _function: FunctionScope
     _current_function: FunctionType | None
     _current_class: ClassType | None
+    # The visits _run is resolving nodes from.
+    _stack: list[Iterator[Expr.Expr | Stmt.Stmt]]
 
     def __init__(self, logger: Logger, interpreter: Interpreter):
         self._logger = logger
         self._interpreter = interpreter
-        self._scopes = []
+        self._function = FunctionScope(None)
         self._current_function = None
         self._current_class = None
+        self._stack = []
 
     def resolve(self, statements: Sequence[Stmt.Stmt]) -> None:
         for statement in statements:
-            self._resolve(statement)
-
-    def _resolve(self, thing: Expr.Expr | Stmt.Stmt) -> None:
-        thing.accept(self)
+            depth = self._run(iter((statement,)))
+            if depth > SHALLOW_DEPTH:
+                self._interpreter.reserve_depth(statement, depth)
+        self._interpreter.reserve_slots(self._function.frame_size)
+
+    def _run(self, nodes: Iterator[Expr.Expr | Stmt.Stmt]) -> int:
+        # Visits yield the nodes they would otherwise recurse into, which are
+        # resolved from an explicit stack of visits before the visit that
+        # yielded them resumes, so nesting depth is only bounded by memory.
+        # Returns the deepest the stack got.
+        enclosing_stack = self._stack
+        stack = self._stack = [nodes]
+        depth = 1
+
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                continue
+
+            children = node.accept(self)
+            if children is not None:
+                stack.append(children)
+                if len(stack) > depth:
+                    depth = len(stack)
+                function = self._function
+                if len(stack) > function.depth:
+                    function.depth = len(stack)
+
+        self._stack = enclosing_stack
+        return depth
 
     def _begin_scope(self) -> None:
-        self._scopes.append({})
+        self._function.scopes.append({})
 
     def _end_scope(self) -> None:
-        self._scopes.pop()
+        function = self._function
+        scope = function.scopes.pop()
+        function.slot_count -= len(scope)
 
-    def _declare(self, name: Token) -> None:
-        if len(self._scopes) == 0:
-            return
+        for local in scope.values():
+            storage = Storage.CELL if local.captured else Storage.LOCAL
+            for node in local.uses:
+                node.storage = storage
+
+    def _add_local(self, name: str) -> Local:
+        function = self._function
+        local = function.scopes[-1][name] = Local(function.slot_count)
 
-        scope = self._scopes[-1]
+        function.slot_count += 1
+        if function.slot_count > function.frame_size:
+            function.frame_size = function.slot_count
 
-        if name.lexeme in scope:
+        return local
+
+    def _declare(self, name: Token, node: Declaration | None = None) -> None:
+        scopes = self._function.scopes
+        if len(scopes) == 0:
+            return
+
+        if name.lexeme in scopes[-1]:
             self._error(name, "Already a variable with this name in this scope.")
+            return
 
-        scope[name.lexeme] = False
+        local = self._add_local(name.lexeme)
+        if node is not None:
+            node.slot = local.slot
+            local.uses.append(node)
 
     def _define(self, name: Token) -> None:
-        if len(self._scopes) == 0:
+        scopes = self._function.scopes
+        if len(scopes) == 0:
             return
 
-        scope = self._scopes[-1]
-        scope[name.lexeme] = True
+        scopes[-1][name.lexeme].defined = True
 
     def _error(self, token: Token, message: str) -> LoxResolverError:
         where = "end" if token.type_ == TokenType.EOF else f"'{token.lexeme}'"
@@ -59,68 +259,214 @@ class Resolver(Expr.Visitor[None], Stmt.Visitor[None]):
 
         return LoxResolverError()
 
-    def _resolve_local(self, expr: Expr.Expr, name: Token) -> None:
-        for i_from_end, scope in enumerate(reversed(self._scopes)):
-            if name.lexeme in scope:
-                self._interpreter.resolve(expr, i_from_end)
-                return
+    def _resolve_local(self, expr: Reference, name: str) -> None:
+        local = self._function.find(name)
+        if local is not None:
+            expr.slot = local.slot
+            local.uses.append(expr)
+            return
+
+        index = self._capture(self._function, name)
+        if index is not None:
+            expr.storage = Storage.FREE
+            expr.slot = index
+            return
+
+        expr.slot = self._interpreter.globals.slot(name)
+
+    def _capture(self, function: FunctionScope, name: str) -> int | None:
+        """
+        Finds a local of an enclosing function, and has every function from
+        there in capture it in turn. Returns the index of its cell among the
+        given function's captures, or None if it's a global.
+        """
+
+        inner: list[FunctionScope] = []
+
+        while (index := function.free.get(name)) is None:
+            enclosing = function.enclosing
+            if enclosing is None:
+                return None
+
+            local = enclosing.find(name)
+            if local is not None:
+                local.captured = True
+                index = self._add_capture(function, name, local.slot)
+                break
+
+            inner.append(function)
+            function = enclosing
+
+        for function in reversed(inner):
+            index = self._add_capture(function, name, ~index)
+
+        return index
 
-    def _resolve_function(self, function: Stmt.Function, type_: FunctionType) -> None:
+    def _add_capture(self, function: FunctionScope, name: str, capture: int) -> int:
+        index = function.free[name] = len(function.captures)
+        function.captures.append(capture)
+        return index
+
+    def _resolve_function(
+        self, function: Stmt.Function, type_: FunctionType
+    ) -> Iterator[Stmt.Stmt]:
+        scope = FunctionScope(self._function)
+
+        if function.body_tokens is not None:
+            # The body is resolved on first call, but the function captures
+            # its cells when declared, so take every local whose name appears
+            # in the body.
+            for name in self._names_used(function.body_tokens):
+                self._capture(scope, name)
+
+            function.captures = tuple(scope.captures)
+            scope.enclosing = None
+
+            load = partial(
+                self._load_function, function, type_, scope, self._current_class
+            )
+            self._interpreter.defer(function, load)
+            return
+
+        yield from self._resolve_body(function, type_, scope)
+
+    def _resolve_body(
+        self, function: Stmt.Function, type_: FunctionType, scope: FunctionScope
+    ) -> Iterator[Stmt.Stmt]:
         enclosing_function = self._current_function
+        enclosing_scope = self._function
         self._current_function = type_
+        self._function = scope
+        scope.base = scope.depth = len(self._stack)
 
         self._begin_scope()
+        if type_ != FunctionType.FUNCTION:
+            self._add_local(THIS_KEYWORD).defined = True
         for param in function.params:
             self._declare(param)
             self._define(param)
+        parameters = list(scope.scopes[-1].values())
 
-        self.resolve(function.body)
+        yield from function.body
         self._end_scope()
+        function.body = _flatten(function.body)
 
+        function.frame_size = scope.frame_size
+        function.captures = tuple(scope.captures)
+        function.cell_slots = tuple(
+            local.slot for local in parameters if local.captured
+        )
+        depth = scope.depth - scope.base
+        function.depth = depth if depth > SHALLOW_DEPTH else 0
+
+        self._function = enclosing_scope
         self._current_function = enclosing_function
 
-    def visit_block_stmt(self, stmt: Stmt.Block) -> None:
+    def _names_used(self, tokens: Iterable[Token]) -> Iterator[str]:
+        # A superset of the variables a body uses: every identifier that isn't
+        # a property name.
+        names: dict[str, None] = {}
+        previous_type = None
+
+        for token in tokens:
+            if token.type_ is TokenType.IDENTIFIER:
+                if previous_type is not TokenType.DOT:
+                    names[token.lexeme] = None
+            elif token.type_ is TokenType.THIS:
+                names[THIS_KEYWORD] = None
+            elif token.type_ is TokenType.SUPER:
+                # A super expression looks up 'this' as well, to bind to it.
+                names[SUPER_KEYWORD] = None
+                names[THIS_KEYWORD] = None
+
+            previous_type = token.type_
+
+        return iter(names)
+
+    def _load_function(
+        self,
+        function: Stmt.Function,
+        type_: FunctionType,
+        scope: FunctionScope,
+        current_class: ClassType | None,
+    ) -> None:
+        assert function.body_tokens is not None
+
+        eof = Token(TokenType.EOF, "", None, function.body_tokens[-1].line)
+        parser = Parser(self._logger, (*function.body_tokens, eof), lazy=True)
+        function.body = parser.parse_body()
+        function.body_tokens = None
+
+        if self._logger.had_error:
+            raise LoxParserError()
+
+        enclosing_class = self._current_class
+        self._current_class = current_class
+
+        try:
+            self._run(self._resolve_body(function, type_, scope))
+        finally:
+            self._current_class = enclosing_class
+
+        if self._logger.had_error:
+            raise LoxResolverError()
+
+    def visit_block_stmt(self, stmt: Stmt.Block) -> Children:
         self._begin_scope()
-        self.resolve(stmt.statements)
+        yield from stmt.statements
         self._end_scope()
 
-    def visit_var_stmt(self, stmt: Stmt.Var) -> None:
-        self._declare(stmt.name)
+        statements = stmt.statements
+        for counter, loop in zip(statements, statements[1:]):
+            if (
+                type(loop) is Stmt.While
+                and type(counter) is Stmt.Var
+                and _is_counted_loop(loop, counter)
+            ):
+                loop.counter = counter.slot
+
+        stmt.statements = _flatten(statements)
+
+    def visit_var_stmt(self, stmt: Stmt.Var) -> Children:
+        self._declare(stmt.name, stmt)
         if stmt.initializer is not None:
-            self._resolve(stmt.initializer)
+            yield stmt.initializer
         self._define(stmt.name)
 
     def visit_variable_expr(self, expr: Expr.Variable) -> None:
-        scope = self._scopes[-1] if self._scopes else None
+        scopes = self._function.scopes
+        local = scopes[-1].get(expr.name.lexeme) if scopes else None
 
-        if scope is not None and scope.get(expr.name.lexeme) is False:
+        if local is not None and not local.defined:
             self._error(expr.name, "Cannot read local variable in its own initializer.")
 
-        self._resolve_local(expr, expr.name)
+        self._resolve_local(expr, expr.name.lexeme)
 
-    def visit_assign_expr(self, expr: Expr.Assign) -> None:
-        self._resolve(expr.value_expr)
-        self._resolve_local(expr, expr.name)
+    def visit_assign_expr(self, expr: Expr.Assign) -> Children:
+        yield expr.value_expr
+        self._resolve_local(expr, expr.name.lexeme)
 
-    def visit_function_stmt(self, stmt: Stmt.Function) -> None:
-        self._declare(stmt.name)
+    def visit_function_stmt(self, stmt: Stmt.Function) -> Children:
+        self._declare(stmt.name, stmt)
         self._define(stmt.name)
 
-        self._resolve_function(stmt, FunctionType.FUNCTION)
+        yield from self._resolve_function(stmt, FunctionType.FUNCTION)
 
-    def visit_expression_stmt(self, stmt: Stmt.Expression) -> None:
-        self._resolve(stmt.expr)
+    def visit_expression_stmt(self, stmt: Stmt.Expression) -> Children:
+        yield stmt.expr
 
-    def visit_if_stmt(self, stmt: Stmt.If) -> None:
-        self._resolve(stmt.condition)
-        self._resolve(stmt.then_stmt)
+    def visit_if_stmt(self, stmt: Stmt.If) -> Children:
+        yield stmt.condition
+        yield stmt.then_stmt
+        stmt.then_stmt = _unwrap(stmt.then_stmt)
         if stmt.else_stmt is not None:
-            self._resolve(stmt.else_stmt)
+            yield stmt.else_stmt
+            stmt.else_stmt = _unwrap(stmt.else_stmt)
 
-    def visit_print_stmt(self, stmt: Stmt.Print) -> None:
-        self._resolve(stmt.expr)
+    def visit_print_stmt(self, stmt: Stmt.Print) -> Children:
+        yield stmt.expr
 
-    def visit_return_stmt(self, stmt: Stmt.Return) -> None:
+    def visit_return_stmt(self, stmt: Stmt.Return) -> Children:
         if self._current_function is None:
             self._error(stmt.keyword, "Can't return from top-level code.")
 
@@ -128,45 +474,49 @@ class Resolver(Expr.Visitor[None], Stmt.Visitor[None]):
             if self._current_function == FunctionType.INITIALIZER:
                 self._error(stmt.keyword, "Can't return a value from an initializer.")
 
-            self._resolve(stmt.value)
+            yield stmt.value
+            stmt.tail = type(stmt.value) is Expr.Call
 
-    def visit_while_stmt(self, stmt: Stmt.While) -> None:
-        self._resolve(stmt.condition)
-        self._resolve(stmt.body)
+    def visit_while_stmt(self, stmt: Stmt.While) -> Children:
+        yield stmt.condition
+        yield stmt.body
+        stmt.body = _unwrap(stmt.body)
 
-    def visit_binary_expr(self, expr: Expr.Binary) -> None:
-        self._resolve(expr.left)
-        self._resolve(expr.right)
+    def visit_binary_expr(self, expr: Expr.Binary) -> Children:
+        yield expr.left
+        yield expr.right
 
-    def visit_call_expr(self, expr: Expr.Call) -> None:
-        self._resolve(expr.callee)
+    def visit_call_expr(self, expr: Expr.Call) -> Children:
+        yield expr.callee
         for argument in expr.arguments:
-            self._resolve(argument)
+            yield argument
 
-    def visit_grouping_expr(self, expr: Expr.Grouping) -> None:
-        self._resolve(expr.expr)
+    def visit_grouping_expr(self, expr: Expr.Grouping) -> Children:
+        yield expr.expr
 
     def visit_literal_expr(self, expr: Expr.Literal) -> None:
         pass
 
-    def visit_logical_expr(self, expr: Expr.Logical) -> None:
-        self._resolve(expr.left)
-        self._resolve(expr.right)
+    def visit_logical_expr(self, expr: Expr.Logical) -> Children:
+        yield expr.left
+        yield expr.right
 
-    def visit_unary_expr(self, expr: Expr.Unary) -> None:
-        self._resolve(expr.expr)
+    def visit_unary_expr(self, expr: Expr.Unary) -> Children:
+        yield expr.expr
 
     def visit_flow_stmt(self, stmt: Stmt.Flow) -> None:
         pass
 
-    def visit_ternary_expr(self, expr: Expr.Ternary) -> None:
-        raise NotImplementedError("Resolver.visit_ternary_expr not implemented")
+    def visit_ternary_expr(self, expr: Expr.Ternary) -> Children:
+        yield expr.condition
+        yield expr.true_expr
+        yield expr.false_expr
 
-    def visit_class_stmt(self, stmt: Stmt.Class) -> None:
+    def visit_class_stmt(self, stmt: Stmt.Class) -> Children:
         enclosing_class = self._current_class
         self._current_class = ClassType.CLASS
 
-        self._declare(stmt.name)
+        self._declare(stmt.name, stmt)
         self._define(stmt.name)
 
         if (
@@ -177,42 +527,41 @@ class Resolver(Expr.Visitor[None], Stmt.Visitor[None]):
 
         if stmt.superclass is not None:
             self._current_class = ClassType.SUBCLASS
-            self._resolve(stmt.superclass)
+            yield stmt.superclass
 
+        # Methods capture the superclass from a scope around them, and have
+        # 'this' in their own frames.
         if stmt.superclass is not None:
             self._begin_scope()
-            self._scopes[-1][SUPER_KEYWORD] = True
-
-        self._begin_scope()
-        self._scopes[-1][THIS_KEYWORD] = True
+            local = self._add_local(SUPER_KEYWORD)
+            local.defined = local.captured = True
+            stmt.super_slot = local.slot
 
         for method in stmt.methods:
             declaration = FunctionType.METHOD
             if method.name.lexeme == CONSTRUCTOR_METHOD_NAME:
                 declaration = FunctionType.INITIALIZER
 
-            self._resolve_function(method, declaration)
-
-        self._end_scope()
+            yield from self._resolve_function(method, declaration)
 
         if stmt.superclass is not None:
             self._end_scope()
 
         self._current_class = enclosing_class
 
-    def visit_get_expr(self, expr: Expr.Get) -> None:
-        self._resolve(expr.object)
+    def visit_get_expr(self, expr: Expr.Get) -> Children:
+        yield expr.object
 
-    def visit_set_expr(self, expr: Expr.Set) -> None:
-        self._resolve(expr.value)
-        self._resolve(expr.object)
+    def visit_set_expr(self, expr: Expr.Set) -> Children:
+        yield expr.value
+        yield expr.object
 
     def visit_this_expr(self, expr: Expr.This) -> None:
         if self._current_class is None:
             self._error(expr.keyword, "Can't use 'this' outside of a class.")
             return
 
-        self._resolve_local(expr, expr.keyword)
+        self._resolve_local(expr, THIS_KEYWORD)
 
     def visit_super_expr(self, expr: Expr.Super) -> None:
         if self._current_class is None:
@@ -222,4 +571,5 @@ class Resolver(Expr.Visitor[None], Stmt.Visitor[None]):
                 expr.keyword, "Can't use 'super' in a class with no superclass."
             )
 
-        self._resolve_local(expr, expr.keyword)
+        self._resolve_local(expr, SUPER_KEYWORD)
+        self._resolve_local(expr.this, THIS_KEYWORD)
@@ -4,9 +4,9 @@ from abc import ABC, abstractmethod
 from collections.abc import Sequence
 from typing import TYPE_CHECKING
 
-from app.constants import CONSTRUCTOR_METHOD_NAME, THIS_KEYWORD
-from app.environment import Environment
-from app.errors import LoxReturnException, LoxRuntimeError
+from app.constants import CONSTRUCTOR_METHOD_NAME
+from app.environment import Cell, Frame
+from app.errors import LoxRuntimeError
 from app.schema import Token
 
 if TYPE_CHECKING:
@@ -57,43 +57,83 @@ LoxObject = LoxInstance | LoxCallable | float | str | bool | None
 
 class LoxFunction(LoxCallable):
     _declaration: Stmt.Function
-    _closure: Environment
+    _cells: tuple[Cell, ...]
     _is_initializer: bool
+    _this: LoxInstance | None
 
     def __init__(
-        self, declaration: Stmt.Function, closure: Environment, is_initializer: bool
+        self,
+        declaration: Stmt.Function,
+        cells: tuple[Cell, ...],
+        is_initializer: bool,
+        this: LoxInstance | None = None,
     ) -> None:
         self._declaration = declaration
-        self._closure = closure
+        self._cells = cells
         self._is_initializer = is_initializer
+        self._this = this
 
     def bind(self, instance: LoxInstance) -> LoxFunction:
-        environment = Environment(self._closure)
-        environment.define(THIS_KEYWORD, instance)
-        return LoxFunction(self._declaration, environment, self._is_initializer)
+        return LoxFunction(
+            self._declaration, self._cells, self._is_initializer, instance
+        )
 
     def call(
         self, interpreter: Interpreter, arguments: Sequence[LoxObject], token: Token
     ) -> LoxObject:
-        parameters = self._declaration.params
-        body = self._declaration.body
-
-        environment = Environment(self._closure)
-        for parameter, argument in zip(parameters, arguments):
-            environment.define(parameter.lexeme, argument)
-
-        try:
-            interpreter.execute_block(body, environment)
-        except LoxReturnException as ret:
-            if self._is_initializer:
-                return self._closure.get_at(0, THIS_KEYWORD)
-
-            return ret.value
-
-        if self._is_initializer:
-            return self._closure.get_at(0, THIS_KEYWORD)
-
-        return None
+        # Tail calls the body returns are left in interpreter.tail_call, and
+        # made here in turn, each in a new frame.
+        function = self
+        while True:
+            declaration = function._declaration
+            if declaration.body_tokens is not None:
+                interpreter.load_body(declaration)
+
+            frame = function._new_frame(arguments)
+            if declaration.depth:
+                with interpreter.nested(declaration.depth):
+                    value = interpreter.execute_call(
+                        declaration.body, frame, function._cells
+                    )
+            else:
+                value = interpreter.execute_call(
+                    declaration.body, frame, function._cells
+                )
+            if function._is_initializer:
+                return function._this
+
+            tail_call = interpreter.tail_call
+            if tail_call is None:
+                return value
+
+            interpreter.tail_call = None
+            function, arguments = tail_call
+            if not function.walks(arguments):
+                return function.call(interpreter, arguments, token)
+
+    def walks(self, arguments: Sequence[LoxObject]) -> bool:
+        """
+        Whether a call with these arguments walks the body, as call does, so
+        that a tail call to this function can be made in call's loop.
+        """
+
+        return True
+
+    def _new_frame(self, arguments: Sequence[LoxObject]) -> Frame:
+        declaration = self._declaration
+
+        # 'this' for methods, then the parameters, take the first slots.
+        frame: Frame = [None] * declaration.frame_size
+        if self._this is None:
+            frame[: len(arguments)] = arguments
+        else:
+            frame[0] = self._this
+            frame[1 : len(arguments) + 1] = arguments
+
+        for slot in declaration.cell_slots:
+            frame[slot] = Cell(frame[slot])  # type: ignore[arg-type]
+
+        return frame
 
     def arity(self) -> int:
         return len(self._declaration.params)
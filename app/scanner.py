@@ -1,7 +1,18 @@
+from collections.abc import Iterable, Iterator
+import re
+import sys
 from typing import Any
 from app.constants import THIS_KEYWORD
 from app.logger import Logger
-from app.schema import Token, TokenType
+from app.schema import ScannerEngine, Token, TokenType
+from app.token_buffer import (
+    EOF_CODE,
+    IDENTIFIER_CODE,
+    NUMBER_CODE,
+    STRING_CODE,
+    TYPE_CODES,
+    TokenBuffer,
+)
 from app import util
 
 KEYWORDS: dict[str, TokenType] = {
@@ -25,26 +36,260 @@ KEYWORDS: dict[str, TokenType] = {
     "continue": TokenType.CONTINUE,
 }
 
+OPERATORS: dict[str, TokenType] = {
+    "(": TokenType.LEFT_PAREN,
+    ")": TokenType.RIGHT_PAREN,
+    "{": TokenType.LEFT_BRACE,
+    "}": TokenType.RIGHT_BRACE,
+    ",": TokenType.COMMA,
+    ".": TokenType.DOT,
+    "-": TokenType.MINUS,
+    "+": TokenType.PLUS,
+    ";": TokenType.SEMICOLON,
+    "/": TokenType.SLASH,
+    "*": TokenType.STAR,
+    "?": TokenType.QUESTION,
+    ":": TokenType.COLON,
+    "!": TokenType.BANG,
+    "!=": TokenType.BANG_EQUAL,
+    "=": TokenType.EQUAL,
+    "==": TokenType.EQUAL_EQUAL,
+    ">": TokenType.GREATER,
+    ">=": TokenType.GREATER_EQUAL,
+    "<": TokenType.LESS,
+    "<=": TokenType.LESS_EQUAL,
+}
+
+KEYWORD_CODES = {text: TYPE_CODES[type_] for text, type_ in KEYWORDS.items()}
+OPERATOR_CODES = {text: TYPE_CODES[type_] for text, type_ in OPERATORS.items()}
+
+# Every alternative consumes a whole lexeme, so the regex engine takes one step
+# per token (or per run of whitespace) instead of one step per character. The
+# alternatives are tried in order, and the last one catches any character the
+# language doesn't know about, so finditer never skips over input.
+_TOKEN_PATTERN = re.compile(
+    r"""
+      ([ \t\r\n]+)                        # whitespace
+    | (//[^\n]*)                          # comment
+    | ("[^"]*")                           # string
+    | ("[^"]*)                            # unterminated string
+    | (\d+(?:\.\d+)?)                     # number
+    | ([^\W\d]\w*)                        # identifier or keyword
+    | ([!=<>]=|[(){},.\-+;/*?:!=<>])      # operator
+    | (.)                                 # unexpected character
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+(
+    _WHITESPACE,
+    _COMMENT,
+    _STRING,
+    _UNTERMINATED_STRING,
+    _NUMBER,
+    _IDENTIFIER,
+    _OPERATOR,
+    _UNEXPECTED,
+) = range(1, 9)
+
+# How far past the end of a lexeme the pattern may look to decide where it ends
+# ("1." needs two characters to know it isn't "1.5"). When streaming chunks, a
+# match ending closer than this to the end of the buffer is held back until
+# the next chunk arrives.
+LOOKAHEAD = 2
+
 
 class Scanner:
     _logger: Logger
 
+    _engine: ScannerEngine
+
+    _chunks: Iterable[str]
     _source: str
     _tokens: list[Token]
     _start: int
     _current: int
     _line: int
 
-    def __init__(self, logger: Logger, source: str) -> None:
+    def __init__(
+        self,
+        logger: Logger,
+        source: str | Iterable[str],
+        engine: ScannerEngine = ScannerEngine.REGEX,
+    ) -> None:
         self._logger = logger
+        self._engine = engine
+
+        # source is either the whole text or an iterable of consecutive chunks
+        if isinstance(source, str):
+            source = (source,)
 
-        self._source = source
+        self._chunks = source
+        self._source = ""
         self._tokens = []
         self._start = 0
         self._current = 0
         self._line = 1
 
     def scan_tokens(self) -> list[Token]:
+        if self._engine == ScannerEngine.REGEX:
+            return list(self._iter_tokens_regex())
+
+        return self._scan_tokens_char()
+
+    def iter_tokens(self) -> Iterator[Token]:
+        if self._engine == ScannerEngine.REGEX:
+            return self._iter_tokens_regex()
+
+        return iter(self._scan_tokens_char())
+
+    def _iter_tokens_regex(self) -> Iterator[Token]:
+        line = 1
+        carry = ""
+        # A string or comment running past the end of the buffer is kept in
+        # parts, and only new chunks are searched for its end, so a long one
+        # is scanned once rather than once per chunk it spans.
+        pending: list[str] = []
+        terminator = ""
+
+        chunks = iter(self._chunks)
+        chunk = next(chunks, None)
+
+        while chunk is not None:
+            next_chunk = next(chunks, None)
+            is_final = next_chunk is None
+
+            if pending:
+                if not is_final and terminator not in chunk:
+                    pending.append(chunk)
+                    chunk = next_chunk
+                    continue
+
+                buffer = "".join(pending) + chunk
+                pending.clear()
+            else:
+                buffer = carry + chunk
+                carry = ""
+
+            chunk = next_chunk
+            limit = len(buffer) - LOOKAHEAD
+
+            for match in _TOKEN_PATTERN.finditer(buffer):
+                kind = match.lastindex
+
+                # A closed string's end doesn't depend on what follows it.
+                if not is_final and match.end() > limit and kind != _STRING:
+                    if kind == _UNTERMINATED_STRING:
+                        pending.append(buffer[match.start() :])
+                        terminator = '"'
+                    elif kind == _COMMENT and match.end() == len(buffer):
+                        pending.append(buffer[match.start() :])
+                        terminator = "\n"
+                    else:
+                        carry = buffer[match.start() :]
+                    break
+
+                text = match.group(kind)
+
+                if kind == _IDENTIFIER:
+                    type_ = KEYWORDS.get(text) or TokenType.IDENTIFIER
+                    yield Token(type_, sys.intern(text), None, line)
+                elif kind == _WHITESPACE:
+                    line += text.count("\n")
+                elif kind == _OPERATOR:
+                    yield Token(OPERATORS[text], sys.intern(text), None, line)
+                elif kind == _NUMBER:
+                    yield Token(TokenType.NUMBER, text, float(text), line)
+                elif kind == _STRING:
+                    line += text.count("\n")
+                    yield Token(TokenType.STRING, text, text[1:-1], line)
+                elif kind == _COMMENT:
+                    pass
+                elif kind == _UNTERMINATED_STRING:
+                    line += text.count("\n")
+                    self._error(line, "Unterminated string.")
+                else:
+                    self._error(line, f"Unexpected character: {text}")
+
+        yield Token(TokenType.EOF, "", None, line)
+
+    def scan_buffer(self, *, first_line: int = 1, offset: int = 0) -> TokenBuffer:
+        """
+        Scans the whole source into a TokenBuffer instead of a list of Tokens.
+        Always uses the regex engine.
+
+        When the source is a slice of a larger text, first_line and offset
+        give its position so lines and offsets refer to the larger text.
+        """
+
+        source = self._join_source()
+        buffer = TokenBuffer(source)
+
+        types = buffer.types
+        starts = buffer.starts
+        ends = buffer.ends
+        lines = buffer.lines
+
+        for code, start, end, line in self.iter_spans(first_line=first_line):
+            types.append(code)
+            starts.append(start + offset)
+            ends.append(end + offset)
+            lines.append(line)
+
+        end_offset = len(source) + offset
+        buffer.append(EOF_CODE, end_offset, end_offset, self._line)
+
+        return buffer
+
+    def iter_spans(
+        self, *, start: int = 0, first_line: int = 1
+    ) -> Iterator[tuple[int, int, int, int]]:
+        """
+        Yields the type code, start offset, end offset and line of each token
+        from start on, where first_line is the line at start. Always uses the
+        regex engine, and doesn't yield an EOF; once exhausted, the line at
+        the end of the source is left in self._line.
+        """
+
+        source = self._join_source()
+        line = first_line
+
+        for match in _TOKEN_PATTERN.finditer(source, start):
+            kind = match.lastindex
+
+            if kind == _IDENTIFIER:
+                code = KEYWORD_CODES.get(match.group(kind), IDENTIFIER_CODE)
+            elif kind == _WHITESPACE:
+                line += match.group(kind).count("\n")
+                continue
+            elif kind == _OPERATOR:
+                code = OPERATOR_CODES[match.group(kind)]
+            elif kind == _NUMBER:
+                code = NUMBER_CODE
+            elif kind == _STRING:
+                line += match.group(kind).count("\n")
+                code = STRING_CODE
+            elif kind == _COMMENT:
+                continue
+            elif kind == _UNTERMINATED_STRING:
+                line += match.group(kind).count("\n")
+                self._error(line, "Unterminated string.")
+                continue
+            else:
+                self._error(line, f"Unexpected character: {match.group(kind)}")
+                continue
+
+            yield code, *match.span(), line
+
+        self._line = line
+
+    def _join_source(self) -> str:
+        self._source = "".join(self._chunks)
+        self._chunks = (self._source,)
+        return self._source
+
+    def _scan_tokens_char(self) -> list[Token]:
+        self._join_source()
         self._tokens = []
 
         while not self._is_at_end():
@@ -69,7 +69,7 @@ class TokenType(StrEnum):
     EOF = auto()
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Token:
     type_: TokenType
     lexeme: str
@@ -94,6 +94,8 @@ class Command(StrEnum):
     TOKENIZE = auto()
     PARSE = auto()
     INTERPRET = auto()
+    DISASSEMBLE = auto()
+    BUILD = auto()
 
 
 class OpMode(StrEnum):
@@ -101,6 +103,28 @@ class OpMode(StrEnum):
     PROGRAM = auto()
 
 
+class ScannerEngine(StrEnum):
+    # One character per step, dispatching with a match statement.
+    CHAR = auto()
+    # One lexeme per step, using a compiled master regex.
+    REGEX = auto()
+
+
+class Engine(StrEnum):
+    # Walks the AST, dispatching on each node through its accept method.
+    TREE = auto()
+    # Compiles the AST into nested Python closures first, see app.compiler.
+    CLOSURE = auto()
+    # Compiles the AST to bytecode for a stack machine, see app.vm.
+    BYTECODE = auto()
+    # Translates the AST to Python source for CPython to compile, see
+    # app.transpiler.
+    PYTHON = auto()
+    # Walks the AST, and translates hot functions and loops to Python as it
+    # goes, see app.tiered.
+    TIERED = auto()
+
+
 class FunctionType(StrEnum):
     FUNCTION = auto()
     METHOD = auto()
@@ -112,6 +136,21 @@ class ClassType(StrEnum):
     SUBCLASS = auto()
 
 
+class Storage(StrEnum):
+    # Where a variable lives, as worked out by the resolver.
+    # In the globals table, by slot.
+    GLOBAL = auto()
+    # In a slot of the current function's frame.
+    LOCAL = auto()
+    # In a Cell in a slot of the current function's frame, because a function
+    # declared inside it captures the variable.
+    CELL = auto()
+    # In a Cell the current function captured when it was declared, by index.
+    FREE = auto()
+
+
 class AstNode(ABC):
+    __slots__ = ()
+
     def __hash__(self) -> int:
         return id(self)
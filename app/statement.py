@@ -5,10 +5,12 @@ from dataclasses import dataclass
 from typing import Generic, TypeVar
 
 from app import expression as Expr
-from app.schema import AstNode, Token
+from app.schema import AstNode, Storage, Token
 
-# All AstNode dataclasses are @dataclass(frozen=True, eq=False)
-# Because we want to inherit __hash__ from AstNode
+# All AstNode dataclasses are @dataclass(slots=True, eq=False)
+# Because we want to inherit __hash__ from AstNode, and slotted nodes are much
+# smaller and quicker to build than frozen ones. Child lists are tuples.
+# Declarations carry where the resolver put the variable they declare.
 
 R = TypeVar("R", covariant=True)
 
@@ -46,11 +48,13 @@ class Visitor(Generic[R], ABC):
 
 
 class Stmt(AstNode):
+    __slots__ = ()
+
     @abstractmethod
     def accept(self, visitor: Visitor[R]) -> R: ...
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Expression(Stmt):
     expr: Expr.Expr
 
@@ -58,7 +62,7 @@ class Expression(Stmt):
         return visitor.visit_expression_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Print(Stmt):
     expr: Expr.Expr
 
@@ -66,24 +70,27 @@ class Print(Stmt):
         return visitor.visit_print_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Var(Stmt):
     name: Token
     initializer: Expr.Expr | None
 
+    storage: Storage = Storage.GLOBAL
+    slot: int = 0
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_var_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Block(Stmt):
-    statements: list[Stmt]
+    statements: tuple[Stmt, ...]
 
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_block_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class If(Stmt):
     condition: Expr.Expr
     then_stmt: Stmt
@@ -93,16 +100,20 @@ class If(Stmt):
         return visitor.visit_if_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class While(Stmt):
     condition: Expr.Expr
     body: Stmt
 
+    # The slot of the loop's counter, if the resolver found it's a for loop
+    # over a local that the condition compares and the increment steps.
+    counter: int | None = None
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_while_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Flow(Stmt):
     token: Token
 
@@ -110,30 +121,56 @@ class Flow(Stmt):
         return visitor.visit_flow_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Function(Stmt):
     name: Token
-    params: list[Token]
-    body: list[Stmt]
+    params: tuple[Token, ...]
+    body: tuple[Stmt, ...]
+    # Set when the body was only pre-parsed. The body is parsed from these
+    # tokens on first call, and this is reset to None.
+    body_tokens: tuple[Token, ...] | None = None
+    storage: Storage = Storage.GLOBAL
+    slot: int = 0
+    # Slots in the frame of a call, counting 'this' for methods, parameters
+    # and every local in the body.
+    frame_size: int = 0
+    # The cells the function captures when declared: a slot in the frame it's
+    # declared in, or ~index for one of the cells that function captured.
+    captures: tuple[int, ...] = ()
+    # The slots of 'this' and the parameters that are captured in turn, and so
+    # need a cell.
+    cell_slots: tuple[int, ...] = ()
+    # How deeply the body nests, once it's resolved, if that's deeper than
+    # SHALLOW_DEPTH in app.interpreter, and 0 otherwise.
+    depth: int = 0
 
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_function_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Return(Stmt):
     keyword: Token
     value: Expr.Expr | None
 
+    # Set by the resolver when the value is a call, which is then the last
+    # thing the function does.
+    tail: bool = False
+
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_return_stmt(self)
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(slots=True, eq=False)
 class Class(Stmt):
     name: Token
     superclass: Expr.Variable | None
-    methods: list[Function]
+    methods: tuple[Function, ...]
+
+    storage: Storage = Storage.GLOBAL
+    slot: int = 0
+    # The frame slot of the cell holding the superclass, for methods to use.
+    super_slot: int = 0
 
     def accept(self, visitor: Visitor[R]) -> R:
         return visitor.visit_class_stmt(self)
@@ -0,0 +1,526 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Sequence
+from dataclasses import fields
+from functools import partial
+from typing import Any, cast
+
+from app import util
+from app.constants import CONSTRUCTOR_METHOD_NAME
+from app.environment import Cell
+from app.interpreter import Completion, Interpreter
+from app.runtime import LoxFunction, LoxInstance, LoxObject
+from app.logger import Logger
+from app.schema import AstNode, OpMode, Storage, Token, TokenType
+from app import expression as Expr
+from app import statement as Stmt
+from app.inference import StaticType, local_types
+from app.transpiler import LoopVariables, PyFunction, Transpiler, fits
+
+# Functions are walked until they've been called HOT_CALLS times, and loops
+# until they've gone round HOT_LOOP times, and then translated to Python with a
+# Transpiler. The translation assumes the locals that hold numbers when it's
+# made keep holding them, checking the ones that could change on the way in,
+# and goes back to walking when they don't. After MAX_DEOPTS times it's made
+# again without assuming anything.
+HOT_CALLS = 500
+HOT_LOOP = 500
+MAX_DEOPTS = 8
+
+# The tiers code can be in.
+INTERPRETED = "interpreted"
+SPECIALIZED = "specialized"
+GENERIC = "generic"
+# Python couldn't compile the translation, so it's always walked.
+FAILED = "failed"
+
+_LOCAL = Storage.LOCAL
+_NUMBER = StaticType.NUMBER
+_BREAK = TokenType.BREAK
+_CONTINUE = TokenType.CONTINUE
+
+
+class Profile:
+    """
+    The counters for a function declaration or loop, and its translation once
+    it has one. Counts are of calls and back edges the tree walker ran, so they
+    stop going up once the code is compiled.
+    """
+
+    __slots__ = (
+        "kind",
+        "name",
+        "line",
+        "count",
+        "tier",
+        "deopts",
+        "guards",
+        "code",
+        "tail_calls",
+    )
+
+    kind: str
+    name: str
+    line: int
+    count: int
+    tier: str
+    deopts: int
+    # The slots the translation checks hold numbers before it runs.
+    guards: tuple[int, ...]
+    code: Callable[..., Any] | None
+    # Whether the translation returns a TailCall for its tail calls.
+    tail_calls: bool
+
+    def __init__(self, kind: str, name: str, line: int) -> None:
+        self.kind = kind
+        self.name = name
+        self.line = line
+        self.count = 0
+        self.tier = INTERPRETED
+        self.deopts = 0
+        self.guards = ()
+        self.code = None
+        self.tail_calls = False
+
+
+class TailCall:
+    """
+    A call to a TieredFunction a translation returns instead of making, so
+    that the Python frame making it is gone by the time it's made.
+    """
+
+    __slots__ = ("function", "arguments")
+
+    function: TieredFunction
+    arguments: tuple[LoxObject, ...]
+
+    def __init__(
+        self, function: TieredFunction, arguments: tuple[LoxObject, ...]
+    ) -> None:
+        self.function = function
+        self.arguments = arguments
+
+
+def _make_tail_calls(
+    step: Callable[..., LoxObject | TailCall], *arguments: LoxObject
+) -> LoxObject:
+    # Makes the tail calls a translation returns, and those returns, in turn.
+    result = step(*arguments)
+    while type(result) is TailCall:
+        result = result.function.step(*result.arguments)
+
+    return result
+
+
+class TieredTranspiler(Transpiler):
+    """
+    Translates code for the tiered interpreter, where calls go straight to the
+    Python function of walked functions too.
+    """
+
+    _DIRECT_CALL = "type({0} := {1}) in _DIRECT"
+
+    # Whether a return in the translation hands back a TailCall.
+    tail_calls: bool = False
+
+    def namespace(self) -> dict[str, Any]:
+        return {
+            **super().namespace(),
+            "_DIRECT": (PyFunction, TieredFunction),
+            "TailCall": TailCall,
+            "TieredFunction": TieredFunction,
+        }
+
+    def visit_return_stmt(self, stmt: Stmt.Return) -> None:
+        if not stmt.tail or self._in_loop_unit or self._this is not None:
+            super().visit_return_stmt(stmt)
+            return
+
+        # A call to a TieredFunction is returned for the caller to make, and
+        # anything else is called here, as in visit_call_expr.
+        self.tail_calls = True
+        call = cast(Expr.Call, stmt.value)
+        callee = self._temp()
+        arguments = self._temp()
+        count = len(call.arguments)
+        self._emit(f"{callee} = {self._expr(call.callee)}")
+        self._emit(
+            f"{arguments} = ("
+            + "".join(f"{self._expr(argument)}, " for argument in call.arguments)
+            + ")"
+        )
+        self._emit(f"if type({callee}) is TieredFunction and {callee}.n == {count}:")
+        self._emit(f"    return TailCall({callee}, {arguments})")
+        self._emit(
+            f"return ({callee}.impl if type({callee}) is PyFunction"
+            f" and {callee}.n == {count}"
+            f" else _callable({callee}, {self._token(call.paren)}, I))(*{arguments})"
+        )
+
+
+class TieredFunction(LoxFunction):
+    """
+    A function value that's walked until its declaration gets hot. impl takes
+    just the arguments, as for a PyFunction, and is the translated function
+    once there is one. step is the same, except that it returns the tail calls
+    of translations that make them, which impl makes.
+    """
+
+    n: int
+    impl: Callable[..., LoxObject]
+    step: Callable[..., LoxObject | TailCall]
+    profile: Profile
+    _interpreter: TieredInterpreter
+    _is_method: bool
+    # The translation's function for these cells, which takes 'this' first for
+    # methods, the translation it's from, and the method this was bound from,
+    # which keeps them.
+    _raw: Callable[..., LoxObject] | None
+    _raw_code: Callable[..., Any] | None
+    _unbound: TieredFunction | None
+
+    def __init__(
+        self,
+        declaration: Stmt.Function,
+        cells: tuple[Cell, ...],
+        is_initializer: bool,
+        this: LoxInstance | None = None,
+        *,
+        interpreter: TieredInterpreter,
+        profile: Profile,
+        is_method: bool,
+        unbound: TieredFunction | None = None,
+    ) -> None:
+        super().__init__(declaration, cells, is_initializer, this)
+        self.n = len(declaration.params)
+        self.impl = self.step = self._enter
+        self.profile = profile
+        self._interpreter = interpreter
+        self._is_method = is_method
+        self._raw = None
+        self._raw_code = None
+        self._unbound = unbound
+
+    def bind(self, instance: LoxInstance) -> TieredFunction:
+        bound = TieredFunction(
+            self._declaration,
+            self._cells,
+            self._is_initializer,
+            instance,
+            interpreter=self._interpreter,
+            profile=self.profile,
+            is_method=self._is_method,
+            unbound=self,
+        )
+        if self._raw is not None and self._raw_code is self.profile.code:
+            bound._use(self._raw)
+
+        return bound
+
+    def call(
+        self, interpreter: Interpreter, arguments: Sequence[LoxObject], token: Token
+    ) -> LoxObject:
+        return self.impl(*arguments)
+
+    def _walk(self, arguments: Sequence[LoxObject]) -> LoxObject:
+        return super().call(self._interpreter, arguments, self._declaration.name)
+
+    def walks(self, arguments: Sequence[LoxObject]) -> bool:
+        # Counts the call, translating the function once it's hot.
+        profile = self.profile
+
+        if profile.code is not None:
+            return False
+        if profile.tier != INTERPRETED:
+            return True
+
+        profile.count += 1
+        if profile.count < HOT_CALLS:
+            return True
+
+        self._interpreter.compile_function(profile, self._declaration, arguments)
+        return profile.code is None
+
+    def _enter(self, *arguments: LoxObject) -> LoxObject:
+        if self.walks(arguments):
+            return self._walk(arguments)
+
+        self._use((self._unbound or self)._get_raw())
+        return self.impl(*arguments)
+
+    def _use(self, raw: Callable[..., LoxObject | TailCall]) -> None:
+        step = raw if self._this is None else partial(raw, self._this)
+        self.step = step
+        if self.profile.tail_calls:
+            self.impl = partial(_make_tail_calls, step)
+        else:
+            self.impl = step  # type: ignore[assignment]
+
+    def _get_raw(self) -> Callable[..., LoxObject]:
+        code = cast(Callable[..., Callable[..., LoxObject]], self.profile.code)
+
+        if self._raw is None or self._raw_code is not code:
+            if self.profile.guards:
+                self._raw = code(*self._cells, self._deopt)
+            else:
+                self._raw = code(*self._cells)
+            self._raw_code = code
+
+        return self._raw
+
+    def _deopt(self, *arguments: LoxObject) -> LoxObject:
+        # Called by the translation when its guards fail, with 'this' first for
+        # methods.
+        profile = self.profile
+
+        if self._raw_code is not profile.code:
+            # It's been translated again since, without the guard.
+            raw = self._get_raw()
+            if self._this is None:
+                self._use(raw)
+            return raw(*arguments)
+
+        profile.deopts += 1
+        if profile.deopts >= MAX_DEOPTS:
+            self._interpreter.compile_function(profile, self._declaration, None)
+
+        function = self
+        if self._is_method:
+            this, *arguments = arguments  # type: ignore[assignment]
+            function = self.bind(cast(LoxInstance, this))
+
+        return function._walk(arguments)
+
+
+def first_line(node: AstNode) -> int:
+    # The line of the first token in the node, for loops, which have none of
+    # their own.
+    stack: list[object] = [node]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, Token):
+            return value.line
+        if isinstance(value, AstNode):
+            stack.extend(
+                getattr(value, field_.name)
+                for field_ in reversed(fields(value))  # type: ignore[arg-type]
+            )
+        elif type(value) is tuple:
+            stack.extend(reversed(value))
+
+    return 0
+
+
+class TieredInterpreter(Interpreter):
+    """
+    Walks the AST like the tree walker, counting calls to each function and
+    back edges of each loop, and runs the ones that get hot as Python, the way
+    PythonInterpreter runs everything.
+    """
+
+    _function_type = TieredFunction
+
+    profiles: dict[AstNode, Profile]
+    # The function declarations and loops a profile says get hot.
+    _primed: set[AstNode]
+
+    def __init__(self, logger: Logger, op_mode: OpMode) -> None:
+        super().__init__(logger, op_mode)
+        self.profiles = {}
+        self._primed = set()
+
+    def prime(self, node: Stmt.Function | Stmt.While) -> None:
+        """
+        Has a function declaration or loop compiled the first time it's called
+        or goes round, rather than once it's hot.
+        """
+
+        self._primed.add(node)
+
+    def _new_function(
+        self, declaration: Stmt.Function, is_method: bool
+    ) -> TieredFunction:
+        profile = self.profiles.get(declaration)
+        if profile is None:
+            kind = "method" if is_method else "fun"
+            profile = Profile(kind, declaration.name.lexeme, declaration.name.line)
+            if declaration in self._primed:
+                profile.count = HOT_CALLS - 1
+            self.profiles[declaration] = profile
+
+        return TieredFunction(
+            declaration,
+            self._capture(declaration),
+            is_method and declaration.name.lexeme == CONSTRUCTOR_METHOD_NAME,
+            interpreter=self,
+            profile=profile,
+            is_method=is_method,
+        )
+
+    def compile_function(
+        self,
+        profile: Profile,
+        declaration: Stmt.Function,
+        arguments: Sequence[LoxObject] | None,
+    ) -> None:
+        """
+        Translates a function, assuming its parameters that are numbers in
+        the arguments stay numbers, or without assuming anything if there are
+        no arguments.
+        """
+
+        if not self._fits(profile, declaration.body):
+            return
+
+        is_method = profile.kind == "method"
+        offset = 1 if is_method else 0
+        assumed = {
+            slot: _NUMBER
+            for slot, argument in enumerate(arguments or (), offset)
+            if type(argument) is float and slot not in declaration.cell_slots
+        }
+        types = local_types(declaration.body, assumed)
+        guards = tuple(slot for slot in assumed if types[slot] == _NUMBER)
+
+        transpiler = TieredTranspiler(self)
+        source = transpiler.factory(declaration, is_method, "_factory", types, guards)
+        self._install(profile, transpiler, source, "_factory", guards)
+        profile.tail_calls = transpiler.tail_calls
+
+    def _compile_loop(
+        self, stmt: Stmt.While, profile: Profile, specialize: bool
+    ) -> None:
+        if not self._fits(profile, [stmt]):
+            return
+
+        variables = LoopVariables.of(stmt)
+        frame = self._frame
+        assumed: dict[int, StaticType] = {}
+        if specialize:
+            assumed = {
+                slot: _NUMBER
+                for (_, slot), storage in variables.loads.items()
+                if storage is _LOCAL and type(frame[slot]) is float
+            }
+        types = local_types([stmt], assumed)
+        guards = tuple(sorted(slot for slot in assumed if types[slot] == _NUMBER))
+
+        transpiler = TieredTranspiler(self)
+        source = transpiler.loop(stmt, "_loop", variables, types)
+        self._install(profile, transpiler, source, "_loop", guards)
+
+    def _fits(self, profile: Profile, nodes: Sequence[Stmt.Stmt]) -> bool:
+        # Code too deeply nested to translate stays walked, or keeps the
+        # translation it had.
+        if fits(nodes):
+            return True
+
+        if profile.code is None:
+            profile.tier = FAILED
+        return False
+
+    def _install(
+        self,
+        profile: Profile,
+        transpiler: Transpiler,
+        source: str,
+        name: str,
+        guards: tuple[int, ...],
+    ) -> None:
+        namespace = transpiler.namespace()
+
+        try:
+            code = compile(source, f"<lox {profile.name}>", "exec")
+        except (SyntaxError, RecursionError, MemoryError):
+            # Too deeply nested for Python, so it stays walked, or keeps the
+            # translation it had.
+            if profile.code is None:
+                profile.tier = FAILED
+            return
+
+        exec(code, namespace)
+        profile.code = namespace[name]
+        profile.guards = guards
+        profile.tier = SPECIALIZED if guards else GENERIC
+
+    def _run_compiled_loop(
+        self, stmt: Stmt.While, profile: Profile
+    ) -> tuple[bool, Completion]:
+        """
+        Runs the rest of a loop as Python, unless a guard fails, in which case
+        it has to be walked and this returns False. Returns how the loop
+        completed with it.
+        """
+
+        frame = self._frame
+        for slot in profile.guards:
+            if type(frame[slot]) is not float:
+                profile.deopts += 1
+                if profile.deopts >= MAX_DEOPTS:
+                    self._compile_loop(stmt, profile, False)
+                return False, None
+
+        result = cast(Callable[..., Any], profile.code)(frame, self._cells)
+        if result is not None:
+            self._returned, keyword = result
+            return True, keyword
+
+        return True, None
+
+    def visit_while_stmt(self, stmt: Stmt.While) -> Completion:
+        profile = self.profiles.get(stmt)
+        if profile is None:
+            profile = self.profiles[stmt] = Profile("loop", "while", first_line(stmt))
+            if stmt in self._primed:
+                profile.count = HOT_LOOP - 1
+
+        if profile.code is not None:
+            ran, completion = self._run_compiled_loop(stmt, profile)
+            if ran:
+                return completion
+
+        condition = stmt.condition
+        body = stmt.body
+        evaluate = self._evaluate
+        execute = self._execute
+
+        while util.is_truthy(evaluate(condition)):
+            completion = execute(body)
+            if completion is not None:
+                if completion.type_ is _BREAK:
+                    break
+                if completion.type_ is not _CONTINUE:
+                    return completion
+
+            if profile.tier == INTERPRETED:
+                profile.count += 1
+                if profile.count >= HOT_LOOP:
+                    # On-stack replacement: the loop carries on from its
+                    # condition, as Python.
+                    self._compile_loop(stmt, profile, True)
+                    if profile.code is not None:
+                        ran, completion = self._run_compiled_loop(stmt, profile)
+                        if ran:
+                            return completion
+
+        return None
+
+    def stats_report(self) -> str:
+        """
+        A table of the functions and loops that ran, with how often they were
+        walked, the tier they ended up in and how often they left it.
+        """
+
+        lines = [
+            f"{'kind':<7} {'name':<16} {'line':>5} {'walked':>8} {'tier':<12}"
+            f" {'deopts':>6}"
+        ]
+        for profile in self.profiles.values():
+            if profile.count == 0 and profile.code is None:
+                continue
+            lines.append(
+                f"{profile.kind:<7} {profile.name:<16} {profile.line:>5}"
+                f" {profile.count:>8} {profile.tier:<12} {profile.deopts:>6}"
+            )
+
+        return "\n".join(lines)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from array import array
+from collections.abc import Iterator
+import sys
+
+from app.schema import Token, TokenType
+
+# Token types are stored as their index in this tuple, which fits in a byte.
+TOKEN_TYPES: tuple[TokenType, ...] = tuple(TokenType)
+TYPE_CODES: dict[TokenType, int] = {type_: i for i, type_ in enumerate(TOKEN_TYPES)}
+
+IDENTIFIER_CODE = TYPE_CODES[TokenType.IDENTIFIER]
+STRING_CODE = TYPE_CODES[TokenType.STRING]
+NUMBER_CODE = TYPE_CODES[TokenType.NUMBER]
+EOF_CODE = TYPE_CODES[TokenType.EOF]
+
+
+def build_token(source: str, code: int, start: int, end: int, line: int) -> Token:
+    lexeme = source[start:end]
+
+    literal = None
+    if code == NUMBER_CODE:
+        literal = float(lexeme)
+    elif code == STRING_CODE:
+        literal = lexeme[1:-1]
+    else:
+        # identifiers, keywords and operators
+        lexeme = sys.intern(lexeme)
+
+    return Token(TOKEN_TYPES[code], lexeme, literal, line)
+
+
+class TokenBuffer:
+    """
+    Columnar token storage: one small-int type code, the start and end offset
+    of the lexeme in the source, and the line number per token. Token objects
+    are only built when asked for, by indexing or iterating.
+    """
+
+    source: str
+    types: array[int]
+    starts: array[int]
+    ends: array[int]
+    lines: array[int]
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.types = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.lines = array("I")
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> Token:
+        return build_token(
+            self.source,
+            self.types[index],
+            self.starts[index],
+            self.ends[index],
+            self.lines[index],
+        )
+
+    def __iter__(self) -> Iterator[Token]:
+        # Same as build_token, inlined since the parser iterates every token.
+        source = self.source
+        intern = sys.intern
+        columns = zip(self.types, self.starts, self.ends, self.lines)
+
+        for code, start, end, line in columns:
+            lexeme = source[start:end]
+
+            literal = None
+            if code == NUMBER_CODE:
+                literal = float(lexeme)
+            elif code == STRING_CODE:
+                literal = lexeme[1:-1]
+            else:
+                lexeme = intern(lexeme)
+
+            yield Token(TOKEN_TYPES[code], lexeme, literal, line)
+
+    def append(self, code: int, start: int, end: int, line: int) -> None:
+        self.types.append(code)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lines.append(line)
+
+    def nbytes(self) -> int:
+        columns = (self.types, self.starts, self.ends, self.lines)
+        return sum(column.itemsize * len(column) for column in columns)
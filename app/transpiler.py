@@ -0,0 +1,1139 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from dataclasses import dataclass, field, fields
+from functools import partial
+import operator
+import os
+import py_compile
+import sys
+from typing import Any, cast
+
+from app import util
+from app.constants import CONSTRUCTOR_METHOD_NAME
+from app.environment import UNDEFINED, Cell
+from app.errors import LoxRuntimeError
+from app import expression as Expr
+from app.inference import StaticType, Types, local_types, type_of, walk
+from app.interpreter import Completion, Interpreter
+from app.logger import Logger
+from app.runtime import LoxCallable, LoxClass, LoxFunction, LoxInstance, LoxObject
+from app.schema import AstNode, OpMode, Storage, Token, TokenType
+from app import statement as Stmt
+from app import validate
+
+# Lox programs are translated into Python source, which CPython compiles to its
+# own bytecode. Lox locals become Python locals, named after the variable and
+# its slot so that shadowing works, and captured locals become Python locals
+# holding a Cell, which each function declaration passes to a factory that
+# makes the Python function. Globals, tokens for error messages and function
+# declarations are referred to by index into G, T and K. A loop translated on
+# its own takes the frame it runs in and the running function's cells as F and
+# C.
+#
+# Every name the translation makes up either ends in _<slot> after a Lox name,
+# or starts with an underscore and has no Lox name before it, so it can't
+# collide with another.
+
+# Makes a function value's Python function, given the cells it captures.
+Factory = Callable[..., Callable[..., LoxObject]]
+
+# Python's parser gives up at 100 levels of indentation or 200 of brackets, so
+# code nested deeper than this is walked instead, without translating it first.
+MAX_NESTING = 90
+
+_LOCAL = Storage.LOCAL
+_CELL = Storage.CELL
+_FREE = Storage.FREE
+
+# The kinds of value Python compares the way Lox does.
+_PRIMITIVE = StaticType.NIL | StaticType.BOOL | StaticType.NUMBER | StaticType.STRING
+
+_ARITHMETIC = {
+    TokenType.MINUS: "-",
+    TokenType.STAR: "*",
+    TokenType.SLASH: "/",
+    TokenType.LESS: "<",
+    TokenType.LESS_EQUAL: "<=",
+    TokenType.GREATER: ">",
+    TokenType.GREATER_EQUAL: ">=",
+}
+
+
+def fits(nodes: Iterable[AstNode]) -> bool:
+    """
+    Whether the nodes are nested shallowly enough to translate, not counting
+    the bodies of the functions they declare. A block adds no level, and nor
+    does an else-if, which is translated to an elif.
+    """
+
+    stack = [(node, 1) for node in nodes]
+    while stack:
+        node, depth = stack.pop()
+        if depth > MAX_NESTING:
+            return False
+        if type(node) is Stmt.Function:
+            continue
+
+        inner = depth if type(node) is Stmt.Block else depth + 1
+        for field_ in fields(node):  # type: ignore[arg-type]
+            value = getattr(node, field_.name)
+            if field_.name == "else_stmt" and type(value) is Stmt.If:
+                stack.append((value, depth))
+            elif isinstance(value, AstNode):
+                stack.append((value, inner))
+            elif type(value) is tuple:
+                stack.extend(
+                    (child, inner) for child in value if isinstance(child, AstNode)
+                )
+
+    return True
+
+
+class PythonCode:
+    """
+    A function declaration, and the factory it translates to. In a running
+    program the factory is compiled on the first call, once the body is loaded
+    if it was lazy; in a built module it's defined up front.
+    """
+
+    __slots__ = ("name", "arity", "is_method", "factory", "declaration", "interpreter")
+
+    name: str
+    arity: int
+    is_method: bool
+    factory: Factory | None
+    declaration: Stmt.Function | None
+    interpreter: Interpreter | None
+
+    def __init__(
+        self,
+        name: str,
+        arity: int,
+        is_method: bool,
+        factory: Factory | None = None,
+        declaration: Stmt.Function | None = None,
+        interpreter: Interpreter | None = None,
+    ) -> None:
+        self.name = name
+        self.arity = arity
+        self.is_method = is_method
+        self.factory = factory
+        self.declaration = declaration
+        self.interpreter = interpreter
+
+    def compile(self) -> Factory:
+        declaration = cast(Stmt.Function, self.declaration)
+        interpreter = cast(Interpreter, self.interpreter)
+        if declaration.body_tokens is not None:
+            interpreter.load_body(declaration)
+
+        # Python can't compile code nested as deep as Lox can, so such
+        # functions are walked instead.
+        if not fits(declaration.body):
+            self.factory = self._walker_factory(declaration, interpreter)
+            return self.factory
+
+        transpiler = Transpiler(interpreter)
+        source = transpiler.factory(declaration, self.is_method, "_factory")
+        namespace = transpiler.namespace()
+
+        try:
+            code = compile(source, f"<lox {self.name}>", "exec")
+        except (SyntaxError, RecursionError, MemoryError):
+            self.factory = self._walker_factory(declaration, interpreter)
+            return self.factory
+
+        exec(code, namespace)
+        self.factory = cast(Factory, namespace["_factory"])
+        return self.factory
+
+    def _walker_factory(
+        self, declaration: Stmt.Function, interpreter: Interpreter
+    ) -> Factory:
+        is_initializer = self.is_method and self.name == CONSTRUCTOR_METHOD_NAME
+
+        def factory(*cells: Cell) -> Callable[..., LoxObject]:
+            def walk(*arguments: LoxObject) -> LoxObject:
+                this = None
+                if self.is_method:
+                    this, *arguments = arguments  # type: ignore[assignment]
+                function = LoxFunction(
+                    declaration, cells, is_initializer, cast(LoxInstance, this)
+                )
+                return function.call(interpreter, arguments, declaration.name)
+
+            return walk
+
+        return factory
+
+
+class PyFunction(LoxCallable):
+    """
+    A function value whose body runs as Python code. impl takes just the
+    arguments, and translated code calls it directly when the arity matches.
+    """
+
+    __slots__ = ("code", "cells", "this", "n", "impl", "_raw", "_unbound")
+
+    code: PythonCode
+    cells: tuple[Cell, ...]
+    this: LoxInstance | None
+    n: int
+    impl: Callable[..., LoxObject]
+    # The factory's function for these cells, which takes 'this' first for
+    # methods, and the method this was bound from, which keeps it.
+    _raw: Callable[..., LoxObject] | None
+    _unbound: PyFunction | None
+
+    def __init__(
+        self,
+        code: PythonCode,
+        cells: tuple[Cell, ...],
+        this: LoxInstance | None = None,
+        unbound: PyFunction | None = None,
+    ) -> None:
+        self.code = code
+        self.cells = cells
+        self.this = this
+        self.n = code.arity
+        self.impl = self._first_call
+        self._raw = None
+        self._unbound = unbound
+
+    def _get_raw(self) -> Callable[..., LoxObject]:
+        if self._raw is None:
+            factory = self.code.factory or self.code.compile()
+            self._raw = factory(*self.cells)
+
+        return self._raw
+
+    def _first_call(self, *arguments: LoxObject) -> LoxObject:
+        raw = (self._unbound or self)._get_raw()
+        self.impl = raw if self.this is None else partial(raw, self.this)
+        return self.impl(*arguments)
+
+    def bind(self, instance: LoxInstance) -> PyFunction:
+        bound = PyFunction(self.code, self.cells, instance, self)
+        if self._raw is not None:
+            bound.impl = partial(self._raw, instance)
+
+        return bound
+
+    def call(
+        self, interpreter: Interpreter, arguments: Sequence[LoxObject], token: Token
+    ) -> LoxObject:
+        return self.impl(*arguments)
+
+    def arity(self) -> int:
+        return self.n
+
+    def __str__(self) -> str:
+        return f"<fn {self.code.name}>"
+
+
+# The slow paths of translated code, which also raise its runtime errors.
+
+
+def _numeric(
+    operation: Callable[[float, float], LoxObject],
+) -> Callable[[LoxObject, LoxObject, Token], LoxObject]:
+    def slow_path(left: LoxObject, right: LoxObject, token: Token) -> LoxObject:
+        return operation(*validate.number_operands(token, left, right))
+
+    return slow_path
+
+
+def _plus(left: LoxObject, right: LoxObject, token: Token) -> LoxObject:
+    return util.add(*validate.number_or_string_operands(token, left, right))
+
+
+def _negate(value: LoxObject, token: Token) -> LoxObject:
+    return -validate.number_operand(token, value)
+
+
+def _undefined(name: Token) -> LoxObject:
+    raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+
+
+def _assign_global(
+    values: list[LoxObject], slot: int, value: LoxObject, name: Token
+) -> LoxObject:
+    if values[slot] is UNDEFINED:
+        _undefined(name)
+
+    values[slot] = value
+    return value
+
+
+def _set_cell(cell: Cell, value: LoxObject) -> LoxObject:
+    cell.value = value
+    return value
+
+
+def _callable(
+    callee: LoxObject, paren: Token, interpreter: Interpreter
+) -> Callable[..., LoxObject]:
+    def call(*arguments: LoxObject) -> LoxObject:
+        if not isinstance(callee, LoxCallable):
+            raise LoxRuntimeError(paren, "Can only call functions and classes.")
+        if callee.arity() != len(arguments):
+            raise LoxRuntimeError(
+                paren, f"Expected {callee.arity()} arguments but got {len(arguments)}."
+            )
+
+        return callee.call(interpreter, list(arguments), paren)
+
+    return call
+
+
+def _callable_global(
+    callee: LoxObject, name: Token, paren: Token, interpreter: Interpreter
+) -> Callable[..., LoxObject]:
+    if callee is UNDEFINED:
+        _undefined(name)
+
+    return _callable(callee, paren, interpreter)
+
+
+def _get(object_: LoxObject, name: Token) -> LoxObject:
+    if not isinstance(object_, LoxInstance):
+        raise LoxRuntimeError(name, "Only instances have properties.")
+
+    return object_.get(name)
+
+
+def _check_instance(object_: LoxObject, name: Token) -> LoxInstance:
+    if not isinstance(object_, LoxInstance):
+        raise LoxRuntimeError(name, "Only instances have fields.")
+
+    return object_
+
+
+def _set(object_: LoxInstance, name: Token, value: LoxObject) -> LoxObject:
+    object_.set(name, value)
+    return value
+
+
+def _super(superclass: LoxObject, object_: LoxObject, method_name: Token) -> LoxObject:
+    assert isinstance(superclass, LoxClass)
+    assert isinstance(object_, LoxInstance)
+
+    method = superclass.find_method(method_name.lexeme)
+    if method is None:
+        raise LoxRuntimeError(
+            method_name, f"Undefined property '{method_name.lexeme}'."
+        )
+
+    return method.bind(object_)
+
+
+def _superclass(superclass: LoxObject, name: Token) -> LoxClass:
+    if not isinstance(superclass, LoxClass):
+        raise LoxRuntimeError(name, "Superclass must be a class.")
+
+    return superclass
+
+
+def _flow_error(token: Token) -> None:
+    raise LoxRuntimeError(token, "Flow statement used outside loop.")
+
+
+_minus = _numeric(operator.sub)
+_times = _numeric(operator.mul)
+_divide = _numeric(operator.truediv)
+_less = _numeric(operator.lt)
+_less_equal = _numeric(operator.le)
+_greater = _numeric(operator.gt)
+_greater_equal = _numeric(operator.ge)
+_eq = util.is_equal
+_str = util.stringify
+
+# What translated code can refer to besides G, I, T and K, and U for UNDEFINED.
+HELPER_NAMES = (
+    "Cell",
+    "LoxClass",
+    "PyFunction",
+    "_assign_global",
+    "_callable",
+    "_callable_global",
+    "_check_instance",
+    "_divide",
+    "_eq",
+    "_flow_error",
+    "_get",
+    "_greater",
+    "_greater_equal",
+    "_less",
+    "_less_equal",
+    "_minus",
+    "_negate",
+    "_plus",
+    "_set",
+    "_set_cell",
+    "_str",
+    "_super",
+    "_superclass",
+    "_times",
+    "_undefined",
+)
+HELPERS: dict[str, Any] = {
+    "U": UNDEFINED,
+    **{name: globals()[name] for name in HELPER_NAMES},
+}
+
+_SLOW_PATHS = {
+    TokenType.PLUS: "_plus",
+    TokenType.MINUS: "_minus",
+    TokenType.STAR: "_times",
+    TokenType.SLASH: "_divide",
+    TokenType.LESS: "_less",
+    TokenType.LESS_EQUAL: "_less_equal",
+    TokenType.GREATER: "_greater",
+    TokenType.GREATER_EQUAL: "_greater_equal",
+}
+
+
+@dataclass
+class LoopVariables:
+    """
+    What a loop translated on its own has to take from the frame it runs in:
+    the locals it uses but doesn't declare, by name and slot, the ones of those
+    it assigns, which it writes back, the slots of cells the functions it
+    declares capture, and the indices of the running function's cells it uses.
+    """
+
+    loads: dict[tuple[str, int], Storage] = field(default_factory=dict)
+    stores: set[tuple[str, int]] = field(default_factory=set)
+    captured: set[int] = field(default_factory=set)
+    free: set[int] = field(default_factory=set)
+
+    @classmethod
+    def of(cls, stmt: Stmt.While) -> LoopVariables:
+        variables = cls()
+        declared: set[tuple[str, int]] = set()
+        assigned: set[tuple[str, int]] = set()
+
+        for node in walk([stmt]):
+            if isinstance(node, (Expr.Variable, Expr.Assign, Expr.This, Expr.Super)):
+                if node.storage is _FREE:
+                    variables.free.add(node.slot)
+                elif node.storage is _LOCAL or node.storage is _CELL:
+                    # As the Transpiler names them.
+                    if type(node) is Expr.This:
+                        lexeme = "this"
+                    elif type(node) is Expr.Super:
+                        lexeme = "super"
+                    else:
+                        lexeme = node.name.lexeme  # type: ignore[union-attr]
+
+                    variables.loads[lexeme, node.slot] = node.storage
+                    if type(node) is Expr.Assign:
+                        assigned.add((lexeme, node.slot))
+            elif isinstance(node, (Stmt.Var, Stmt.Function, Stmt.Class)):
+                if node.storage is _LOCAL or node.storage is _CELL:
+                    declared.add((node.name.lexeme, node.slot))
+
+            if type(node) is Stmt.Class and node.superclass is not None:
+                declared.add(("super", node.super_slot))
+            elif type(node) is Stmt.Function:
+                for capture in node.captures:
+                    if capture >= 0:
+                        variables.captured.add(capture)
+                    else:
+                        variables.free.add(~capture)
+
+        for name in declared:
+            variables.loads.pop(name, None)
+        variables.stores = {
+            name for name in assigned if variables.loads.get(name) is _LOCAL
+        }
+
+        return variables
+
+
+class Transpiler(Expr.Visitor[str], Stmt.Visitor[None]):
+    """
+    Translates resolved statements to Python source. Expressions translate to
+    Python expressions, with the common case inline and a call to one of the
+    HELPERS for anything else, and statements to lines of Python.
+    """
+
+    # The check a translated call makes that it can call the callee's impl,
+    # given a temp and the callee.
+    _DIRECT_CALL = "type({0} := {1}) is PyFunction"
+
+    _interpreter: Interpreter
+    # The tokens and function declarations the source refers to, as T[i] and
+    # K[i].
+    tokens: list[Token]
+    codes: list[PythonCode]
+    _token_indices: dict[int, int]
+
+    _lines: list[str]
+    _indent: int
+    _temps: int
+    # Loops the statement being translated is in, in the current function.
+    _loops: int
+    # The Python name of the local in each slot of the current function, as
+    # last declared, for functions declared in it to capture.
+    _names: dict[int, str]
+    # What an initializer returns, if translating one.
+    _this: str | None
+    # The static types of the current function's locals, by slot, and of the
+    # expressions in it as they're worked out.
+    _types: Types
+    _expr_types: dict[Expr.Expr, StaticType]
+    # Whether translating a loop on its own, which returns the value and
+    # keyword of a Lox return statement in it, or None if the loop ends.
+    _in_loop_unit: bool
+
+    def __init__(self, interpreter: Interpreter) -> None:
+        self._interpreter = interpreter
+        self.tokens = []
+        self.codes = []
+        self._token_indices = {}
+
+        self._lines = []
+        self._indent = 0
+        self._temps = 0
+        self._loops = 0
+        self._names = {}
+        self._this = None
+        self._types = {}
+        self._expr_types = {}
+        self._in_loop_unit = False
+
+    def namespace(self) -> dict[str, Any]:
+        return {
+            **HELPERS,
+            "G": self._interpreter.globals.values,
+            "I": self._interpreter,
+            "T": tuple(self.tokens),
+            "K": tuple(self.codes),
+        }
+
+    def unit(
+        self, statements: Sequence[Stmt.Stmt], name: str, result: Expr.Expr | None = None
+    ) -> str:
+        """
+        Translates top-level statements to a function of no arguments, which
+        returns the result expression's value if there is one.
+        """
+
+        self._begin_function()
+        self._types = local_types(statements)
+        self._emit(f"def {name}():")
+        self._indent += 1
+        start = len(self._lines)
+        for statement in statements:
+            self._stmt(statement)
+        if result is not None:
+            self._emit(f"return {self._expr(result)}")
+        if len(self._lines) == start:
+            self._emit("pass")
+        self._indent -= 1
+
+        return self._source()
+
+    def factory(
+        self,
+        declaration: Stmt.Function,
+        is_method: bool,
+        name: str,
+        types: Types | None = None,
+        guards: Sequence[int] = (),
+    ) -> str:
+        """
+        Translates a function declaration to a factory, which takes the cells
+        the function captures and returns a Python function taking 'this' for
+        methods, then the arguments.
+
+        The locals are taken to have the static types in types, which default
+        to those local_types finds. Those can assume the parameters in the
+        slots of guards are numbers, in which case the factory takes a function
+        to call instead, with the same arguments, when they aren't.
+        """
+
+        self._begin_function()
+        self._types = local_types(declaration.body) if types is None else types
+        cells = [f"_c{i}" for i in range(len(declaration.captures))]
+        if guards:
+            cells.append("_deopt")
+        self._emit(f"def {name}({', '.join(cells)}):")
+        self._indent += 1
+
+        params = list(declaration.params)
+        if is_method:
+            params.insert(0, Token(TokenType.THIS, "this", None, declaration.name.line))
+        names = [self._declare(slot, param.lexeme) for slot, param in enumerate(params)]
+        self._emit(f"def {declaration.name.lexeme}_fn({', '.join(names)}):")
+        self._indent += 1
+
+        if guards:
+            checks = " and ".join(f"type({names[slot]}) is float" for slot in guards)
+            self._emit(f"if not ({checks}):")
+            self._emit(f"    return _deopt({', '.join(names)})")
+
+        for slot in declaration.cell_slots:
+            if slot < len(names):
+                self._emit(f"{names[slot]} = Cell({names[slot]})")
+
+        if is_method and declaration.name.lexeme == CONSTRUCTOR_METHOD_NAME:
+            self._this = names[0] + (".value" if 0 in declaration.cell_slots else "")
+
+        start = len(self._lines)
+        for statement in declaration.body:
+            self._stmt(statement)
+        if self._this is not None:
+            self._emit(f"return {self._this}")
+        if len(self._lines) == start:
+            self._emit("pass")
+
+        self._indent -= 1
+        self._emit(f"return {declaration.name.lexeme}_fn")
+        self._indent -= 1
+
+        return self._source()
+
+    def loop(
+        self,
+        stmt: Stmt.While,
+        name: str,
+        variables: LoopVariables,
+        types: Types | None = None,
+    ) -> str:
+        """
+        Translates a loop on its own, to a function that takes the frame and
+        cells of the code it's in and runs the loop from its condition, so it
+        can take over from a tree walker in the middle of the loop. The locals
+        have the static types in types, as for factory.
+        """
+
+        self._begin_function()
+        self._types = local_types([stmt]) if types is None else types
+        self._in_loop_unit = True
+        self._emit(f"def {name}(F, C):")
+        self._indent += 1
+
+        for lexeme, slot in sorted(variables.loads, key=lambda name: name[1]):
+            self._emit(f"{self._declare(slot, lexeme)} = F[{slot}]")
+        for slot in sorted(variables.captured - self._names.keys()):
+            self._names[slot] = f"_s{slot}"
+            self._emit(f"_s{slot} = F[{slot}]")
+        for index in sorted(variables.free):
+            self._emit(f"_c{index} = C[{index}]")
+
+        self._stmt(stmt)
+
+        for lexeme, slot in sorted(variables.stores, key=lambda name: name[1]):
+            self._emit(f"F[{slot}] = {lexeme}_{slot}")
+        self._indent -= 1
+
+        return self._source()
+
+    def _begin_function(self) -> None:
+        self._lines = []
+        self._indent = 0
+        self._loops = 0
+        self._names = {}
+        self._this = None
+        self._types = {}
+        self._expr_types = {}
+        self._in_loop_unit = False
+
+    def _source(self) -> str:
+        return "\n".join(self._lines) + "\n"
+
+    def _emit(self, line: str) -> None:
+        self._lines.append("    " * self._indent + line)
+
+    def _temp(self) -> str:
+        self._temps += 1
+        return f"_t{self._temps}"
+
+    def _token(self, token: Token) -> str:
+        index = self._token_indices.get(id(token))
+        if index is None:
+            index = self._token_indices[id(token)] = len(self.tokens)
+            self.tokens.append(token)
+
+        return f"T[{index}]"
+
+    def _code(self, declaration: Stmt.Function, is_method: bool) -> str:
+        self.codes.append(
+            PythonCode(
+                declaration.name.lexeme,
+                len(declaration.params),
+                is_method,
+                declaration=declaration,
+                interpreter=self._interpreter,
+            )
+        )
+        return f"K[{len(self.codes) - 1}]"
+
+    def _declare(self, slot: int, name: str) -> str:
+        self._names[slot] = python_name = f"{name}_{slot}"
+        return python_name
+
+    def _stmt(self, statement: Stmt.Stmt) -> None:
+        statement.accept(self)
+
+    def _expr(self, expression: Expr.Expr) -> str:
+        return expression.accept(self)
+
+    def _block(self, statement: Stmt.Stmt) -> None:
+        self._indent += 1
+        start = len(self._lines)
+        self._stmt(statement)
+        if len(self._lines) == start:
+            self._emit("pass")
+        self._indent -= 1
+
+    def _test(self, expr: Expr.Expr) -> str:
+        # A Python expression that's true when the expression is truthy in Lox.
+        if self._type(expr) == StaticType.BOOL:
+            return self._expr(expr)
+
+        temp = self._temp()
+        return f"(({temp} := {self._expr(expr)}) is not None and {temp} is not False)"
+
+    def _type(self, expr: Expr.Expr) -> StaticType:
+        return type_of(expr, self._types, self._expr_types)
+
+    def _load(self, node: Expr.Variable | Expr.This | Expr.Super, name: Token) -> str:
+        storage = node.storage
+
+        if storage is _LOCAL:
+            return f"{name.lexeme}_{node.slot}"
+        if storage is _CELL:
+            return f"{name.lexeme}_{node.slot}.value"
+        if storage is _FREE:
+            return f"_c{node.slot}.value"
+
+        temp = self._temp()
+        return (
+            f"({temp} if ({temp} := G[{node.slot}]) is not U"
+            f" else _undefined({self._token(name)}))"
+        )
+
+    def _define(self, stmt: Stmt.Var | Stmt.Function | Stmt.Class, value: str) -> None:
+        storage = stmt.storage
+
+        if storage is _LOCAL:
+            self._emit(f"{self._declare(stmt.slot, stmt.name.lexeme)} = {value}")
+        elif storage is _CELL:
+            self._emit(f"{self._declare(stmt.slot, stmt.name.lexeme)} = Cell({value})")
+        else:
+            slot = self._interpreter.globals.slot(stmt.name.lexeme)
+            self._emit(f"G[{slot}] = {value}")
+
+    def _captures(self, declaration: Stmt.Function) -> str:
+        cells = [
+            self._names[capture] if capture >= 0 else f"_c{~capture}"
+            for capture in declaration.captures
+        ]
+        return "(" + "".join(f"{cell}, " for cell in cells) + ")"
+
+    def visit_binary_expr(self, expr: Expr.Binary) -> str:
+        operator_ = expr.operator.type_
+        left = self._expr(expr.left)
+        right = self._expr(expr.right)
+        left_type = self._type(expr.left)
+        right_type = self._type(expr.right)
+
+        if operator_ in (TokenType.EQUAL_EQUAL, TokenType.BANG_EQUAL):
+            if (left_type | right_type) & ~_PRIMITIVE == 0:
+                symbol = "==" if operator_ == TokenType.EQUAL_EQUAL else "!="
+                return f"({left} {symbol} {right})"
+            if operator_ == TokenType.EQUAL_EQUAL:
+                return f"_eq({left}, {right})"
+            return f"(not _eq({left}, {right}))"
+
+        slow_path = _SLOW_PATHS.get(operator_)
+        if slow_path is None:
+            # As in the tree walker, anything else evaluates to nil.
+            return f"({left}, {right}, None)[2]"
+
+        symbol = _ARITHMETIC.get(operator_, "+")
+        token = self._token(expr.operator)
+
+        left_float = left_type == StaticType.NUMBER
+        right_float = right_type == StaticType.NUMBER
+        if left_float and right_float:
+            return f"({left} {symbol} {right})"
+        if (
+            operator_ == TokenType.PLUS
+            and left_type == right_type == StaticType.STRING
+        ):
+            return f"({left} + {right})"
+
+        # Numbers that take no evaluating need no check.
+        guards = []
+        if left_float and type(expr.left) in (Expr.Literal, Expr.Variable):
+            left_name = left
+        else:
+            left_name = self._temp()
+            guards.append(f"(type({left_name} := {left}) is float)")
+        if right_float and type(expr.right) in (Expr.Literal, Expr.Variable):
+            right_name = right
+        else:
+            right_name = self._temp()
+            guards.append(f"(type({right_name} := {right}) is float)")
+
+        if not guards:
+            guards.append("True")
+
+        # & rather than and, so both sides are evaluated whatever the first is.
+        return (
+            f"({left_name} {symbol} {right_name} if {' & '.join(guards)}"
+            f" else {slow_path}({left_name}, {right_name}, {token}))"
+        )
+
+    def visit_grouping_expr(self, expr: Expr.Grouping) -> str:
+        return self._expr(expr.expr)
+
+    def visit_literal_expr(self, expr: Expr.Literal) -> str:
+        return repr(expr.value)
+
+    def visit_unary_expr(self, expr: Expr.Unary) -> str:
+        operator_ = expr.operator.type_
+
+        if operator_ == TokenType.MINUS:
+            value = self._expr(expr.expr)
+            if self._type(expr.expr) == StaticType.NUMBER:
+                return f"(-{value})"
+
+            temp = self._temp()
+            return (
+                f"(-{temp} if type({temp} := {value}) is float"
+                f" else _negate({temp}, {self._token(expr.operator)}))"
+            )
+        if operator_ == TokenType.BANG:
+            if self._type(expr.expr) == StaticType.BOOL:
+                return f"(not {self._expr(expr.expr)})"
+
+            temp = self._temp()
+            return f"(({temp} := {self._expr(expr.expr)}) is None or {temp} is False)"
+
+        return f"({self._expr(expr.expr)}, None)[1]"
+
+    def visit_ternary_expr(self, expr: Expr.Ternary) -> str:
+        condition = self._test(expr.condition)
+        return (
+            f"({self._expr(expr.true_expr)} if {condition}"
+            f" else {self._expr(expr.false_expr)})"
+        )
+
+    def visit_variable_expr(self, expr: Expr.Variable) -> str:
+        return self._load(expr, expr.name)
+
+    def visit_assign_expr(self, expr: Expr.Assign) -> str:
+        value = self._expr(expr.value_expr)
+        storage = expr.storage
+
+        if storage is _LOCAL:
+            return f"({expr.name.lexeme}_{expr.slot} := {value})"
+        if storage is _CELL:
+            return f"_set_cell({expr.name.lexeme}_{expr.slot}, {value})"
+        if storage is _FREE:
+            return f"_set_cell(_c{expr.slot}, {value})"
+
+        return f"_assign_global(G, {expr.slot}, {value}, {self._token(expr.name)})"
+
+    def visit_logical_expr(self, expr: Expr.Logical) -> str:
+        is_or = expr.operator.type_ == TokenType.OR
+
+        if self._type(expr.left) == self._type(expr.right) == StaticType.BOOL:
+            operator_ = "or" if is_or else "and"
+            return f"({self._expr(expr.left)} {operator_} {self._expr(expr.right)})"
+
+        temp = self._temp()
+        left = self._expr(expr.left)
+        right = self._expr(expr.right)
+        test = f"({temp} := {left}) is not None and {temp} is not False"
+        if is_or:
+            return f"({temp} if {test} else {right})"
+
+        return f"({right} if {test} else {temp})"
+
+    def visit_call_expr(self, expr: Expr.Call) -> str:
+        temp = self._temp()
+        count = len(expr.arguments)
+        paren = self._token(expr.paren)
+        callee = expr.callee
+
+        # Calls to Lox functions with the right number of arguments go straight
+        # to their Python function, and anything else to a slow path that
+        # checks the call first.
+        if type(callee) is Expr.Variable and callee.storage is Storage.GLOBAL:
+            value = f"G[{callee.slot}]"
+            slow_path = f"_callable_global({temp}, {self._token(callee.name)}, {paren}, I)"
+        else:
+            value = self._expr(callee)
+            slow_path = f"_callable({temp}, {paren}, I)"
+
+        direct_call = self._DIRECT_CALL.format(temp, value)
+        function = (
+            f"({temp}.impl if {direct_call} and {temp}.n == {count} else {slow_path})"
+        )
+        arguments = ", ".join(self._expr(argument) for argument in expr.arguments)
+
+        return f"{function}({arguments})"
+
+    def visit_get_expr(self, expr: Expr.Get) -> str:
+        return f"_get({self._expr(expr.object)}, {self._token(expr.name)})"
+
+    def visit_set_expr(self, expr: Expr.Set) -> str:
+        name = self._token(expr.name)
+
+        # The tree walker checks the object before it evaluates the value.
+        return (
+            f"_set(_check_instance({self._expr(expr.object)}, {name}), {name},"
+            f" {self._expr(expr.value)})"
+        )
+
+    def visit_this_expr(self, expr: Expr.This) -> str:
+        return self._load(expr, expr.keyword)
+
+    def visit_super_expr(self, expr: Expr.Super) -> str:
+        superclass = self._load(expr, expr.keyword)
+        this = Token(TokenType.THIS, "this", None, expr.keyword.line)
+        object_ = self._load(expr.this, this)
+        return f"_super({superclass}, {object_}, {self._token(expr.method)})"
+
+    def visit_expression_stmt(self, stmt: Stmt.Expression) -> None:
+        expr = stmt.expr
+
+        # Assignments are statements of their own in Python too.
+        if type(expr) is Expr.Assign and expr.storage is _LOCAL:
+            self._emit(f"{expr.name.lexeme}_{expr.slot} = {self._expr(expr.value_expr)}")
+        elif type(expr) is Expr.Assign and expr.storage is _CELL:
+            value = self._expr(expr.value_expr)
+            self._emit(f"{expr.name.lexeme}_{expr.slot}.value = {value}")
+        elif type(expr) is Expr.Assign and expr.storage is _FREE:
+            self._emit(f"_c{expr.slot}.value = {self._expr(expr.value_expr)}")
+        else:
+            self._emit(self._expr(expr))
+
+    def visit_print_stmt(self, stmt: Stmt.Print) -> None:
+        self._emit(f"print(_str({self._expr(stmt.expr)}))")
+
+    def visit_var_stmt(self, stmt: Stmt.Var) -> None:
+        value = "None"
+        if stmt.initializer is not None:
+            value = self._expr(stmt.initializer)
+
+        self._define(stmt, value)
+
+    def visit_block_stmt(self, stmt: Stmt.Block) -> None:
+        for statement in stmt.statements:
+            self._stmt(statement)
+
+    def visit_if_stmt(self, stmt: Stmt.If) -> None:
+        self._emit(f"if {self._test(stmt.condition)}:")
+        self._block(stmt.then_stmt)
+
+        # An else-if ladder stays at one level of indentation.
+        else_stmt = stmt.else_stmt
+        while type(else_stmt) is Stmt.If:
+            self._emit(f"elif {self._test(else_stmt.condition)}:")
+            self._block(else_stmt.then_stmt)
+            else_stmt = else_stmt.else_stmt
+
+        if else_stmt is not None:
+            self._emit("else:")
+            self._block(else_stmt)
+
+    def visit_while_stmt(self, stmt: Stmt.While) -> None:
+        self._emit(f"while {self._test(stmt.condition)}:")
+
+        self._loops += 1
+        self._block(stmt.body)
+        self._loops -= 1
+
+    def visit_flow_stmt(self, stmt: Stmt.Flow) -> None:
+        if self._loops == 0:
+            self._emit(f"_flow_error({self._token(stmt.token)})")
+        elif stmt.token.type_ == TokenType.BREAK:
+            self._emit("break")
+        else:
+            self._emit("continue")
+
+    def visit_function_stmt(self, stmt: Stmt.Function) -> None:
+        code = self._code(stmt, False)
+
+        # A function that calls itself captures its own cell, so the cell has
+        # to exist before the function does.
+        if stmt.storage is _CELL:
+            name = self._declare(stmt.slot, stmt.name.lexeme)
+            self._emit(f"{name} = Cell(None)")
+            self._emit(f"{name}.value = PyFunction({code}, {self._captures(stmt)})")
+            return
+
+        self._define(stmt, f"PyFunction({code}, {self._captures(stmt)})")
+
+    def visit_return_stmt(self, stmt: Stmt.Return) -> None:
+        if self._in_loop_unit:
+            value = "None" if stmt.value is None else self._expr(stmt.value)
+            self._emit(f"return {value}, {self._token(stmt.keyword)}")
+        elif self._this is not None:
+            self._emit(f"return {self._this}")
+        elif stmt.value is not None:
+            self._emit(f"return {self._expr(stmt.value)}")
+        else:
+            self._emit("return None")
+
+    def visit_class_stmt(self, stmt: Stmt.Class) -> None:
+        superclass = "None"
+        if stmt.superclass is not None:
+            superclass = self._temp()
+            value = self._expr(stmt.superclass)
+            self._emit(
+                f"{superclass} = _superclass({value}, {self._token(stmt.superclass.name)})"
+            )
+
+        # As for functions, methods that use the class capture its cell.
+        name = None
+        if stmt.storage is _CELL:
+            name = self._declare(stmt.slot, stmt.name.lexeme)
+            self._emit(f"{name} = Cell(None)")
+
+        if stmt.superclass is not None:
+            self._emit(f"{self._declare(stmt.super_slot, 'super')} = Cell({superclass})")
+
+        methods = ", ".join(
+            f"{method.name.lexeme!r}:"
+            f" PyFunction({self._code(method, True)}, {self._captures(method)})"
+            for method in stmt.methods
+        )
+        class_ = f"LoxClass({stmt.name.lexeme!r}, {superclass}, {{{methods}}})"
+
+        if name is not None:
+            self._emit(f"{name}.value = {class_}")
+        else:
+            self._define(stmt, class_)
+
+
+class PythonInterpreter(Interpreter):
+    """
+    Runs programs by translating each top-level statement, and each function
+    body on its first call, to Python with a Transpiler, and running what
+    CPython compiles that to.
+    """
+
+    def _execute_mode(self, statement: Stmt.Stmt) -> Completion:
+        result = None
+        statements = [statement]
+        if self._op_mode == OpMode.REPL and isinstance(statement, Stmt.Expression):
+            result = statement.expr
+            statements = []
+
+        if not fits([statement]):
+            return super()._execute_mode(statement)
+
+        transpiler = Transpiler(self)
+        source = transpiler.unit(statements, "_unit", result)
+        namespace = transpiler.namespace()
+
+        try:
+            code = compile(source, "<lox>", "exec")
+        except (SyntaxError, RecursionError, MemoryError):
+            # Too deeply nested for Python, so walk it instead.
+            return super()._execute_mode(statement)
+
+        exec(code, namespace)
+        value = namespace["_unit"]()
+
+        if result is not None:
+            print(util.stringify(value), file=sys.stdout)
+
+        return None
+
+
+def build_module(
+    interpreter: Interpreter, statements: Sequence[Stmt.Stmt], source_name: str
+) -> str:
+    """
+    Translates a whole resolved program, with no lazy bodies left, to the
+    source of a Python module. Importing the module doesn't run the program;
+    run() does, and returns the exit code.
+    """
+
+    transpiler = Transpiler(interpreter)
+    parts = [transpiler.unit(statements, "main")]
+
+    for index, code in enumerate(transpiler.codes):
+        declaration = cast(Stmt.Function, code.declaration)
+        parts.append(transpiler.factory(declaration, code.is_method, f"_make_{index}"))
+
+    tokens = "".join(
+        f"    Token(TokenType.{token.type_.name}, {token.lexeme!r}, None,"
+        f" {token.line}),\n"
+        for token in transpiler.tokens
+    )
+    codes = "".join(
+        f"    PythonCode({code.name!r}, {code.arity}, {code.is_method},"
+        f" _make_{index}),\n"
+        for index, code in enumerate(transpiler.codes)
+    )
+    names = "".join(
+        f"    {name!r},\n" for name in interpreter.globals.names()
+    )
+    helpers = "".join(f"    {name},\n" for name in HELPER_NAMES)
+
+    return (
+        f'"""Translated from {source_name} by `./run.sh build`. Needs the app'
+        " package\nto be importable.\n"
+        '"""\n\n'
+        "from app.environment import UNDEFINED as U\n"
+        "from app.schema import Token, TokenType\n"
+        f"from app.transpiler import (\n{helpers}    PythonCode,\n"
+        "    run_module,\n)\n\n"
+        f"T = (\n{tokens})\n"
+        f"GLOBALS = (\n{names})\n\n\n"
+        + "\n\n".join(parts)
+        + f"\n\nK = (\n{codes})\n\n"
+        "\ndef run() -> int:\n"
+        "    return run_module(globals(), GLOBALS, main)\n\n\n"
+        'if __name__ == "__main__":\n'
+        "    raise SystemExit(run())\n"
+    )
+
+
+def write_module(module_source: str, path: str) -> str:
+    """
+    Writes a built module and, next to it, the module compiled to a .pyc,
+    which can be shipped and imported without the source. Returns the .pyc's
+    path.
+    """
+
+    with open(path, "w") as file:
+        file.write(module_source)
+
+    compiled_path = os.path.splitext(path)[0] + ".pyc"
+    py_compile.compile(path, cfile=compiled_path, doraise=True)
+    return compiled_path
+
+
+def run_module(namespace: dict[str, Any], names: Sequence[str], main: Callable[[], None]) -> int:
+    """
+    Runs a built module's program, with its globals given the slots they had
+    when it was built.
+    """
+
+    logger = Logger()
+    interpreter = PythonInterpreter(logger, OpMode.PROGRAM)
+    for slot, name in enumerate(names):
+        assert interpreter.globals.slot(name) == slot
+
+    namespace["G"] = interpreter.globals.values
+    namespace["I"] = interpreter
+
+    try:
+        main()
+    except LoxRuntimeError as err:
+        logger.report_runtime(err)
+        return 70
+
+    return 0
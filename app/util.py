@@ -1,5 +1,5 @@
-from collections.abc import Iterable
-from typing import Any, Protocol, TypeVar, Union, cast
+from collections.abc import Iterable, Iterator
+from typing import Any, Protocol, TextIO, TypeVar, Union, cast
 
 
 def is_alpha(char: str, *, underscore_allowed: bool = False) -> bool:
@@ -88,3 +88,8 @@ class SupportsLenAndGetItem(Protocol[T]):
 
 def reverse_enumerate(iterable: SupportsLenAndGetItem[T]) -> Iterable[tuple[int, T]]:
     return zip(reversed(range(len(iterable))), reversed(iterable))
+
+
+def read_chunks(file: TextIO, chunk_size: int) -> Iterator[str]:
+    while chunk := file.read(chunk_size):
+        yield chunk
@@ -0,0 +1,492 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+import sys
+from typing import cast
+
+from app import util
+from app.bytecode import (
+    ADD,
+    CALL,
+    CHECK_INSTANCE,
+    CLASS,
+    CLOSURE,
+    CONSTANT,
+    DEFINE_CELL,
+    DEFINE_GLOBAL,
+    DIVIDE,
+    EQUAL,
+    FALSE,
+    FLOW_ERROR,
+    GET_CELL,
+    GET_GLOBAL,
+    GET_LOCAL,
+    GET_PROPERTY,
+    GET_SUPER,
+    GREATER,
+    GREATER_EQUAL,
+    JUMP,
+    JUMP_IF_FALSE,
+    JUMP_IF_FALSE_OR_POP,
+    JUMP_IF_TRUE_OR_POP,
+    LESS,
+    LESS_EQUAL,
+    MULTIPLY,
+    NEGATE,
+    NEW_CELL,
+    NIL,
+    NOT,
+    NOT_EQUAL,
+    POP,
+    PRINT,
+    RETURN,
+    SET_CELL,
+    SET_GLOBAL,
+    SET_LOCAL,
+    SET_PROPERTY,
+    STORE_LOCAL,
+    SUBTRACT,
+    TRUE,
+    BytecodeCompiler,
+    Chunk,
+    ClassProto,
+    FunctionProto,
+)
+from app.constants import CONSTRUCTOR_METHOD_NAME
+from app.environment import UNDEFINED, Cell, Frame
+from app.errors import LoxRuntimeError
+from app.interpreter import Interpreter
+from app.runtime import LoxCallable, LoxClass, LoxFunction, LoxInstance, LoxObject
+from app.schema import OpMode, Token
+from app import statement as Stmt
+from app import validate
+
+# Lox calls don't use the Python stack in the VM, so this is what stops runaway
+# recursion instead of Python's recursion limit.
+FRAMES_MAX = 1 << 16
+
+
+class VMFunction(LoxFunction):
+    proto: FunctionProto
+
+    def __init__(
+        self,
+        proto: FunctionProto,
+        cells: tuple[Cell, ...],
+        is_initializer: bool,
+        this: LoxInstance | None = None,
+    ) -> None:
+        super().__init__(proto.declaration, cells, is_initializer, this)
+        self.proto = proto
+
+    def bind(self, instance: LoxInstance) -> VMFunction:
+        return VMFunction(self.proto, self._cells, self._is_initializer, instance)
+
+    def call(
+        self, interpreter: Interpreter, arguments: Sequence[LoxObject], token: Token
+    ) -> LoxObject:
+        vm = cast(VirtualMachine, interpreter)
+        chunk = self.proto.chunk or vm.compile_function(self.proto)
+
+        frame = self._new_frame(arguments)
+        frame.extend(self._cells)
+
+        return vm.run(chunk, frame, self._this if self._is_initializer else None)
+
+
+class VirtualMachine(Interpreter):
+    """
+    Runs programs by compiling each top-level statement, and each function
+    body on its first call, to bytecode, and running that on a stack machine.
+    Calls between Lox functions push a frame record rather than recursing in
+    Python, so returns are just jumps back to the caller.
+    """
+
+    def _execute_mode(self, statement: Stmt.Stmt) -> None:
+        if self._op_mode == OpMode.REPL and isinstance(statement, Stmt.Expression):
+            chunk = BytecodeCompiler.expression(self, statement.expr)
+            print(util.stringify(self.run(chunk, self._frame)), file=sys.stdout)
+            return
+
+        self.run(BytecodeCompiler.script(self, [statement]), self._frame)
+
+    def compile_function(self, proto: FunctionProto) -> Chunk:
+        declaration = proto.declaration
+        if declaration.body_tokens is not None:
+            self.load_body(declaration)
+
+        with self.nested(declaration.depth):
+            proto.chunk = BytecodeCompiler.function(self, proto)
+        return proto.chunk
+
+    def run(
+        self, chunk: Chunk, slots: Frame, init_this: LoxInstance | None = None
+    ) -> LoxObject:
+        """
+        Runs a chunk in the given frame until it returns, and returns its
+        value, or init_this if it's given, as an initializer's.
+        """
+
+        code = chunk.code
+        constants = chunk.constants
+        tokens = chunk.tokens
+        ip = 0
+
+        stack: list[LoxObject] = []
+        push = stack.append
+        pop = stack.pop
+        # The callers of the running function, each with where to resume.
+        frames: list[
+            tuple[
+                list[int], list[object], list[Token | None], int, Frame, LoxInstance | None
+            ]
+        ] = []
+        globals_ = self.globals.values
+
+        # Ordered roughly by how often each opcode runs.
+        while True:
+            opcode = code[ip]
+            ip += 1
+
+            if opcode == GET_LOCAL:
+                push(slots[code[ip]])  # type: ignore[arg-type]
+                ip += 1
+
+            elif opcode == CONSTANT:
+                push(constants[code[ip]])  # type: ignore[arg-type]
+                ip += 1
+
+            elif opcode == GET_GLOBAL:
+                value = globals_[code[ip]]
+                if value is UNDEFINED:
+                    name = cast(Token, tokens[ip - 1])
+                    raise LoxRuntimeError(
+                        name, f"Undefined variable '{name.lexeme}'."
+                    )
+                push(value)  # type: ignore[arg-type]
+                ip += 1
+
+            elif opcode == JUMP_IF_FALSE:
+                value = pop()
+                if value is None or value is False:
+                    ip = code[ip]
+                else:
+                    ip += 1
+
+            elif opcode == ADD:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left + right
+                else:
+                    stack[-1] = util.add(
+                        *validate.number_or_string_operands(
+                            cast(Token, tokens[ip - 1]), left, right
+                        )
+                    )
+
+            elif opcode == SUBTRACT:
+                right = pop()
+                left = stack[-1]
+                if type(left) is not float or type(right) is not float:
+                    left, right = validate.number_operands(
+                        cast(Token, tokens[ip - 1]), left, right
+                    )
+                stack[-1] = left - right  # type: ignore[operator]
+
+            elif opcode == LESS:
+                right = pop()
+                left = stack[-1]
+                if type(left) is not float or type(right) is not float:
+                    left, right = validate.number_operands(
+                        cast(Token, tokens[ip - 1]), left, right
+                    )
+                stack[-1] = left < right  # type: ignore[operator]
+
+            elif opcode == STORE_LOCAL:
+                slots[code[ip]] = pop()
+                ip += 1
+
+            elif opcode == SET_LOCAL:
+                slots[code[ip]] = stack[-1]
+                ip += 1
+
+            elif opcode == POP:
+                pop()
+
+            elif opcode == JUMP:
+                ip = code[ip]
+
+            elif opcode == CALL:
+                count = code[ip]
+                ip += 1
+                callee = stack[-1 - count]
+
+                if type(callee) is LoxClass:
+                    instance = LoxInstance(callee)
+                    initializer = callee.find_method(CONSTRUCTOR_METHOD_NAME)
+                    if initializer is None:
+                        if count != 0:
+                            raise LoxRuntimeError(
+                                cast(Token, tokens[ip - 2]),
+                                f"Expected 0 arguments but got {count}.",
+                            )
+                        stack[-1] = instance
+                        continue
+
+                    callee = initializer.bind(instance)
+
+                if type(callee) is not VMFunction:
+                    if not isinstance(callee, LoxCallable):
+                        raise LoxRuntimeError(
+                            cast(Token, tokens[ip - 2]),
+                            "Can only call functions and classes.",
+                        )
+                    if callee.arity() != count:
+                        raise LoxRuntimeError(
+                            cast(Token, tokens[ip - 2]),
+                            f"Expected {callee.arity()} arguments but got {count}.",
+                        )
+
+                    arguments = stack[len(stack) - count :]
+                    del stack[len(stack) - count - 1 :]
+                    push(callee.call(self, arguments, cast(Token, tokens[ip - 2])))
+                    continue
+
+                declaration = callee._declaration
+                if len(declaration.params) != count:
+                    raise LoxRuntimeError(
+                        cast(Token, tokens[ip - 2]),
+                        f"Expected {len(declaration.params)} arguments but got {count}.",
+                    )
+                if len(frames) == FRAMES_MAX:
+                    raise LoxRuntimeError(
+                        cast(Token, tokens[ip - 2]), "Stack overflow."
+                    )
+
+                proto = callee.proto
+                chunk = proto.chunk or self.compile_function(proto)
+
+                # As LoxFunction._new_frame, with the captured cells after the
+                # locals.
+                frame: Frame = stack[len(stack) - count :]  # type: ignore[assignment]
+                del stack[len(stack) - count - 1 :]
+                this = callee._this
+                if this is not None:
+                    frame.insert(0, this)
+                frame.extend([None] * (declaration.frame_size - len(frame)))
+                for slot in declaration.cell_slots:
+                    frame[slot] = Cell(frame[slot])  # type: ignore[arg-type]
+                frame.extend(callee._cells)
+
+                frames.append((code, constants, tokens, ip, slots, init_this))
+                code = chunk.code
+                constants = chunk.constants
+                tokens = chunk.tokens
+                ip = 0
+                slots = frame
+                init_this = this if callee._is_initializer else None
+
+            elif opcode == RETURN:
+                value = pop()
+                if init_this is not None:
+                    value = init_this
+
+                if not frames:
+                    return value
+
+                code, constants, tokens, ip, slots, init_this = frames.pop()
+                push(value)
+
+            elif opcode == GET_CELL:
+                push(slots[code[ip]].value)  # type: ignore[union-attr]
+                ip += 1
+
+            elif opcode == SET_CELL:
+                slots[code[ip]].value = stack[-1]  # type: ignore[union-attr]
+                ip += 1
+
+            elif opcode == MULTIPLY:
+                right = pop()
+                left = stack[-1]
+                if type(left) is not float or type(right) is not float:
+                    left, right = validate.number_operands(
+                        cast(Token, tokens[ip - 1]), left, right
+                    )
+                stack[-1] = left * right  # type: ignore[operator]
+
+            elif opcode == GREATER:
+                right = pop()
+                left = stack[-1]
+                if type(left) is not float or type(right) is not float:
+                    left, right = validate.number_operands(
+                        cast(Token, tokens[ip - 1]), left, right
+                    )
+                stack[-1] = left > right  # type: ignore[operator]
+
+            elif opcode == LESS_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if type(left) is not float or type(right) is not float:
+                    left, right = validate.number_operands(
+                        cast(Token, tokens[ip - 1]), left, right
+                    )
+                stack[-1] = left <= right  # type: ignore[operator]
+
+            elif opcode == GREATER_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if type(left) is not float or type(right) is not float:
+                    left, right = validate.number_operands(
+                        cast(Token, tokens[ip - 1]), left, right
+                    )
+                stack[-1] = left >= right  # type: ignore[operator]
+
+            elif opcode == DIVIDE:
+                right = pop()
+                left = stack[-1]
+                if type(left) is not float or type(right) is not float:
+                    left, right = validate.number_operands(
+                        cast(Token, tokens[ip - 1]), left, right
+                    )
+                stack[-1] = left / right  # type: ignore[operator]
+
+            elif opcode == EQUAL:
+                right = pop()
+                stack[-1] = util.is_equal(stack[-1], right)
+
+            elif opcode == NOT_EQUAL:
+                right = pop()
+                stack[-1] = not util.is_equal(stack[-1], right)
+
+            elif opcode == GET_PROPERTY:
+                name = cast(Token, constants[code[ip]])
+                ip += 1
+                object_ = stack[-1]
+                if not isinstance(object_, LoxInstance):
+                    raise LoxRuntimeError(name, "Only instances have properties.")
+                stack[-1] = object_.get(name)
+
+            elif opcode == CHECK_INSTANCE:
+                if not isinstance(stack[-1], LoxInstance):
+                    raise LoxRuntimeError(
+                        cast(Token, constants[code[ip]]),
+                        "Only instances have fields.",
+                    )
+                ip += 1
+
+            elif opcode == SET_PROPERTY:
+                name = cast(Token, constants[code[ip]])
+                ip += 1
+                value = pop()
+                cast(LoxInstance, stack[-1]).set(name, value)
+                stack[-1] = value
+
+            elif opcode == NIL:
+                push(None)
+
+            elif opcode == TRUE:
+                push(True)
+
+            elif opcode == FALSE:
+                push(False)
+
+            elif opcode == NOT:
+                value = stack[-1]
+                stack[-1] = value is None or value is False
+
+            elif opcode == NEGATE:
+                value = stack[-1]
+                if type(value) is not float:
+                    value = validate.number_operand(cast(Token, tokens[ip - 1]), value)
+                stack[-1] = -value  # type: ignore[operator]
+
+            elif opcode == JUMP_IF_FALSE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip = code[ip]
+                else:
+                    pop()
+                    ip += 1
+
+            elif opcode == JUMP_IF_TRUE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    pop()
+                    ip += 1
+                else:
+                    ip = code[ip]
+
+            elif opcode == SET_GLOBAL:
+                slot = code[ip]
+                if globals_[slot] is UNDEFINED:
+                    name = cast(Token, tokens[ip - 1])
+                    raise LoxRuntimeError(
+                        name, f"Undefined variable '{name.lexeme}'."
+                    )
+                globals_[slot] = stack[-1]
+                ip += 1
+
+            elif opcode == DEFINE_GLOBAL:
+                globals_[code[ip]] = pop()
+                ip += 1
+
+            elif opcode == PRINT:
+                print(util.stringify(pop()), file=sys.stdout)
+
+            elif opcode == CLOSURE:
+                proto = cast(FunctionProto, constants[code[ip]])
+                ip += 1
+                push(VMFunction(proto, proto.capture(slots), False))
+
+            elif opcode == NEW_CELL:
+                slots[code[ip]] = Cell(None)
+                ip += 1
+
+            elif opcode == DEFINE_CELL:
+                slots[code[ip]] = Cell(pop())
+                ip += 1
+
+            elif opcode == GET_SUPER:
+                method_name = cast(Token, constants[code[ip]])
+                ip += 1
+                object_ = pop()
+                superclass = stack[-1]
+
+                assert isinstance(superclass, LoxClass)
+                assert isinstance(object_, LoxInstance)
+
+                method = superclass.find_method(method_name.lexeme)
+                if method is None:
+                    raise LoxRuntimeError(
+                        method_name, f"Undefined property '{method_name.lexeme}'."
+                    )
+                stack[-1] = method.bind(object_)
+
+            elif opcode == CLASS:
+                class_proto = cast(ClassProto, constants[code[ip]])
+                ip += 1
+
+                superclass = None
+                if class_proto.superclass is not None:
+                    superclass = pop()
+                    if not isinstance(superclass, LoxClass):
+                        raise LoxRuntimeError(
+                            class_proto.superclass, "Superclass must be a class."
+                        )
+
+                    slots[class_proto.super_slot] = Cell(superclass)
+
+                methods: dict[str, LoxFunction] = {
+                    name: VMFunction(method, method.capture(slots), method.is_initializer)
+                    for name, method in class_proto.methods
+                }
+                push(LoxClass(class_proto.name, superclass, methods))
+
+            elif opcode == FLOW_ERROR:
+                raise LoxRuntimeError(
+                    cast(Token, tokens[ip - 1]), "Flow statement used outside loop."
+                )
+
+            else:
+                raise AssertionError(f"Unknown opcode {opcode}.")
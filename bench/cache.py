@@ -0,0 +1,65 @@
+"""Time to load a compiled program from the cache, against scanning, parsing and
+resolving it again.
+
+Usage: python -m bench.cache [copies]
+"""
+
+import sys
+import time
+
+from app import cache
+from app.interpreter import Interpreter
+from app.logger import Logger
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import OpMode
+
+DEFAULT_COPIES = 50
+REPEATS = 3
+
+
+def _compile(source: str) -> float:
+    start = time.perf_counter()
+
+    logger = Logger()
+    interpreter = Interpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, source).iter_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+
+    return time.perf_counter() - start
+
+
+def _load(data: bytes) -> float:
+    start = time.perf_counter()
+
+    interpreter = Interpreter(Logger(), OpMode.PROGRAM)
+    cache.load(data, interpreter)
+
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    copies = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_COPIES
+
+    # Each copy of test.lox in its own block, so its declarations don't clash.
+    with open("test.lox") as file:
+        source = f"{{\n{file.read()}\n}}\n" * copies
+
+    logger = Logger()
+    interpreter = Interpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, source).iter_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+    data = cache.dump(statements, interpreter)
+
+    lines = source.count("\n")
+    print(f"{lines} lines, {len(source)} bytes, {len(data)} bytes cached")
+
+    compile_time = min(_compile(source) for _ in range(REPEATS))
+    load_time = min(_load(data) for _ in range(REPEATS))
+    print(f"scan, parse and resolve: {compile_time * 1e3:.0f} ms")
+    print(f"load from cache: {load_time * 1e3:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Time and Python calls per Lox call for functions that return in different
+ways, on the tree walker.
+
+Calls count every Python function the interpreter enters, which unlike the
+time doesn't depend on how busy the machine is.
+
+Usage: python -m bench.calls [calls]
+"""
+
+from contextlib import redirect_stdout
+import io
+import sys
+import time
+from types import FrameType
+from typing import Any
+
+from app.interpreter import Interpreter
+from app.logger import Logger
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import OpMode
+
+DEFAULT_CALLS = 20_000
+REPEATS = 3
+
+# Functions of one argument, called in a counted loop.
+FUNCTIONS = {
+    "no return": "fun f(n) { n; }",
+    "return": "fun f(n) { return n; }",
+    "nested return": "fun f(n) { if (n > -1) { { return n; } } return 0; }",
+    "return in loop": "fun f(n) { while (true) { return n; } }",
+    "break": "fun f(n) { while (true) { break; } return n; }",
+}
+
+PROGRAM = """
+{function}
+fun run(n) {{
+    for (var i = 0; i < n; i = i + 1) {{
+        f(i);
+    }}
+}}
+print run({calls});
+"""
+
+
+def _compile(source: str) -> tuple[Interpreter, list]:
+    logger = Logger()
+    interpreter = Interpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, source).scan_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+    return interpreter, statements
+
+
+def _time(source: str) -> float:
+    interpreter, statements = _compile(source)
+
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        interpreter.interpret(statements)
+        return time.perf_counter() - start
+
+
+def _count(source: str) -> int:
+    interpreter, statements = _compile(source)
+    calls = 0
+
+    def profile(frame: FrameType, event: str, arg: Any) -> None:
+        nonlocal calls
+        if event == "call":
+            calls += 1
+
+    with redirect_stdout(io.StringIO()):
+        sys.setprofile(profile)
+        try:
+            interpreter.interpret(statements)
+        finally:
+            sys.setprofile(None)
+
+    return calls
+
+
+def main() -> None:
+    calls = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_CALLS
+
+    for name, function in FUNCTIONS.items():
+        source = PROGRAM.format(function=function, calls=calls)
+        best = min(_time(source) for _ in range(REPEATS))
+
+        print(
+            f"{name:>14}: {best / calls * 1e6:5.1f} us"
+            f"  {calls / best / 1e3:6.1f}k calls/s"
+            f"  {_count(source) / calls:5.1f} Python calls per call"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Latency of IncrementalLexer.edit for random small edits on a large file,
+against rescanning the whole file after each edit.
+
+Usage: python -m bench.incremental [lines] [edits]
+"""
+
+from contextlib import redirect_stderr
+import io
+import random
+import statistics
+import sys
+import time
+
+from app.incremental import IncrementalLexer
+from app.logger import Logger
+from app.scanner import Scanner
+
+DEFAULT_LINES = 100_000
+DEFAULT_EDITS = 2_000
+FULL_SCANS = 3
+
+# Typing, deleting and pasting. Quotes are kept separate, since an unmatched
+# quote changes every token up to the next quote.
+SNIPPETS = ["x", "a", " ", "\n", "1.5", "+", "=", ";", "(", ")", "// c", "var y"]
+QUOTE_SNIPPETS = ['"']
+
+
+def _load_source(line_count: int) -> str:
+    with open("test.lox") as file:
+        lines = file.read().splitlines()
+
+    repeats = line_count // len(lines) + 1
+    return "\n".join((lines * repeats)[:line_count]) + "\n"
+
+
+def _random_edit(source: str, snippets: list[str]) -> tuple[int, int, str]:
+    offset = random.randrange(len(source))
+    deleted = min(random.choice((0, 0, 1, 3)), len(source) - offset)
+    return offset, deleted, random.choice(snippets + [""])
+
+
+def _time_edits(
+    lexer: IncrementalLexer, snippets: list[str], count: int
+) -> list[float]:
+    timings = []
+
+    for _ in range(count):
+        offset, deleted, inserted = _random_edit(lexer.source, snippets)
+        start = time.perf_counter()
+        lexer.edit(offset, deleted, inserted)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def _describe(name: str, timings: list[float]) -> None:
+    timings = sorted(timings)
+    p50 = statistics.median(timings) * 1e3
+    p99 = timings[int(len(timings) * 0.99)] * 1e3
+    print(f"{name:>14}: p50 {p50:8.3f} ms  p99 {p99:8.3f} ms")
+
+
+def main() -> None:
+    line_count = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_LINES
+    edit_count = int(sys.argv[2]) if len(sys.argv) >= 3 else DEFAULT_EDITS
+    random.seed(0)
+
+    source = _load_source(line_count)
+    print(f"source: {line_count} lines, {len(source) / 1e6:.2f} MB")
+
+    with redirect_stderr(io.StringIO()):
+        full_scans = []
+        for _ in range(FULL_SCANS):
+            start = time.perf_counter()
+            Scanner(Logger(), source).scan_buffer()
+            full_scans.append(time.perf_counter() - start)
+
+        lexer = IncrementalLexer(Logger(), source)
+        edits = _time_edits(lexer, SNIPPETS, edit_count)
+        quote_edits = _time_edits(lexer, QUOTE_SNIPPETS, edit_count // 10)
+
+    _describe("full rescan", full_scans)
+    _describe("edit", edits)
+    _describe("quote edit", quote_edits)
+
+
+if __name__ == "__main__":
+    main()
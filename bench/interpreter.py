@@ -0,0 +1,136 @@
+"""A table of the run time of each engine on call- and closure-heavy programs,
+and the speedup of each over the tree walker.
+
+Usage: python -m bench.interpreter [program ...]
+"""
+
+from contextlib import redirect_stdout
+import io
+import sys
+import time
+
+from app.logger import Logger
+from app.main import ENGINES
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import Engine, OpMode
+
+REPEATS = 3
+
+PROGRAMS = {
+    # The function from fib.lox, without the timing table around it.
+    "fib": """
+fun fib(n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+}
+print fib(20);
+""",
+    "closures": """
+fun makeCounter() {
+    var count = 0;
+    fun increment(by) {
+        count = count + by;
+        return count;
+    }
+    return increment;
+}
+
+fun compose(f, g) {
+    fun composed(x) { return f(g(x)); }
+    return composed;
+}
+
+var total = 0;
+for (var i = 0; i < 2000; i = i + 1) {
+    var counter = makeCounter();
+    var twice = compose(counter, counter);
+    for (var j = 0; j < 5; j = j + 1) {
+        total = total + twice(j);
+    }
+}
+print total;
+""",
+    "loops": """
+var sum = 0;
+for (var i = 0; i < 150; i = i + 1) {
+    var row = 0;
+    for (var j = 0; j < 150; j = j + 1) {
+        var product = i * j;
+        row = row + product;
+    }
+    sum = sum + row;
+}
+print sum;
+""",
+    "globals": """
+var a = 1;
+var b = 2;
+var c = 0;
+fun f() { return a + b; }
+for (var i = 0; i < 20000; i = i + 1) {
+    c = c + a * b + f();
+}
+print c;
+""",
+    "methods": """
+class Vector {
+    init(x, y) { this.x = x; this.y = y; }
+    add(other) { return Vector(this.x + other.x, this.y + other.y); }
+    dot(other) { return this.x * other.x + this.y * other.y; }
+}
+
+var v = Vector(0, 0);
+var step = Vector(1, 2);
+var dots = 0;
+for (var i = 0; i < 10000; i = i + 1) {
+    v = v.add(step);
+    dots = dots + v.dot(step);
+}
+print dots;
+""",
+}
+
+
+def _run(source: str, engine: Engine) -> float:
+    logger = Logger()
+    interpreter = ENGINES[engine](logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, source).scan_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        interpreter.interpret(statements)
+        return time.perf_counter() - start
+
+
+def main() -> None:
+    names = sys.argv[1:] or list(PROGRAMS)
+    engines = list(Engine)
+
+    # One row per program, with each engine's time and speedup over the tree
+    # walker.
+    rows = [["program", *engines]]
+    for name in names:
+        times = {
+            engine: min(_run(PROGRAMS[name], engine) for _ in range(REPEATS))
+            for engine in engines
+        }
+        rows.append(
+            [
+                name,
+                *(
+                    f"{times[engine] * 1e3:.0f} ms"
+                    f" ({times[Engine.TREE] / times[engine]:.2f}x)"
+                    for engine in engines
+                ),
+            ]
+        )
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+if __name__ == "__main__":
+    main()
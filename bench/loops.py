@@ -0,0 +1,109 @@
+"""Time, scope allocations and Python calls per iteration of loops with small
+bodies.
+
+Allocations are the objects app.environment creates to hold variables
+(environments before locals moved to flat frames, cells since). Calls count
+every Python function the interpreter enters, which unlike the time doesn't
+depend on how busy the machine is.
+
+Usage: python -m bench.loops [iterations]
+"""
+
+from contextlib import redirect_stdout
+import io
+import sys
+import time
+from types import FrameType
+from typing import Any
+
+from app.interpreter import Interpreter
+from app.logger import Logger
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import OpMode
+
+DEFAULT_ITERATIONS = 20_000
+REPEATS = 3
+
+# Loop bodies, run inside a function as in fib.lox's pow() and spaces().
+BODIES = {
+    "assignment": "total = total + i;",
+    "if/else": "if (i > 5) { total = total + i; } else { total = total - 1; }",
+    "nested block": "{ { total = total + i; } }",
+    "local": "var twice = i * 2; total = total + twice;",
+}
+
+PROGRAM = """
+fun run(n) {{
+    var total = 0;
+    for (var i = 0; i < n; i = i + 1) {{
+        {body}
+    }}
+    return total;
+}}
+print run({iterations});
+"""
+
+
+def _compile(source: str) -> tuple[Interpreter, list]:
+    logger = Logger()
+    interpreter = Interpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, source).scan_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+    return interpreter, statements
+
+
+def _time(source: str) -> float:
+    interpreter, statements = _compile(source)
+
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        interpreter.interpret(statements)
+        return time.perf_counter() - start
+
+
+def _count(source: str) -> tuple[int, int]:
+    interpreter, statements = _compile(source)
+    allocations = 0
+    calls = 0
+
+    def profile(frame: FrameType, event: str, arg: Any) -> None:
+        nonlocal allocations, calls
+        if event != "call":
+            return
+
+        calls += 1
+        if (
+            frame.f_code.co_name == "__init__"
+            and frame.f_globals["__name__"] == "app.environment"
+        ):
+            allocations += 1
+
+    with redirect_stdout(io.StringIO()):
+        sys.setprofile(profile)
+        try:
+            interpreter.interpret(statements)
+        finally:
+            sys.setprofile(None)
+
+    return allocations, calls
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_ITERATIONS
+
+    for name, body in BODIES.items():
+        source = PROGRAM.format(body=body, iterations=iterations)
+        best = min(_time(source) for _ in range(REPEATS))
+        allocations, calls = _count(source)
+
+        print(
+            f"{name:>12}: {best / iterations * 1e6:5.1f} us"
+            f"  {allocations / iterations:4.1f} allocations"
+            f"  {calls / iterations:5.1f} calls per iteration"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Time to scan test.lox scaled up with parallel.scan_buffer for a range of
+job counts.
+
+Usage: python -m bench.parallel_scanner [scale] [max_jobs]
+"""
+
+import os
+import sys
+import time
+
+from app import parallel
+from app.logger import Logger
+
+DEFAULT_SCALE = 8000
+
+
+def main() -> None:
+    scale = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_SCALE
+    max_jobs = int(sys.argv[2]) if len(sys.argv) >= 3 else os.cpu_count() or 1
+
+    with open("test.lox") as file:
+        source = (file.read() + "\n") * scale
+
+    megabytes = len(source.encode()) / 1_000_000
+    print(f"source: {megabytes:.1f} MB, {os.cpu_count()} cpus")
+
+    jobs = 1
+    baseline = None
+    while jobs <= max_jobs:
+        start = time.perf_counter()
+        buffer = parallel.scan_buffer(Logger(), source, jobs)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+
+        print(
+            f"jobs {jobs:>3}: {elapsed:7.2f} s  {megabytes / elapsed:6.2f} MB/s  "
+            f"{baseline / elapsed:5.1f}x  {len(buffer)} tokens"
+        )
+        jobs *= 2
+
+
+if __name__ == "__main__":
+    main()
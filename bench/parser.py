@@ -0,0 +1,45 @@
+"""Parse throughput and AST size on expression-heavy source.
+
+Usage: python -m bench.parser [statements]
+"""
+
+import sys
+import time
+
+from app.logger import Logger
+from app.mem_stats import ast_mem_stats
+from app.parser import Parser
+from app.scanner import Scanner
+
+DEFAULT_STATEMENTS = 20_000
+REPEATS = 3
+
+STATEMENTS = (
+    "print a + b * (c - d) / -e == f and g or !h;",
+    "x = y = fib(n - 1) + fib(n - 2) * 3 >= limit;",
+    'total = total + items.get(i).price * (1 - discount) + "!";',
+    "ok = a < b and b <= c or c > d and d >= e or a != e;",
+    "print ((((1 + 2) * 3) - 4) / 5) + obj.field.method(1, 2, 3).other;",
+)
+
+
+def main() -> None:
+    statement_count = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_STATEMENTS
+    lines = STATEMENTS * (statement_count // len(STATEMENTS))
+    source = "\n".join(lines)
+
+    tokens = Scanner(Logger(), source).scan_tokens()
+    print(f"{len(lines)} statements, {len(tokens)} tokens")
+
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        statements = Parser(Logger(), tokens).parse()
+        best = min(best, time.perf_counter() - start)
+
+    print(f"parse: {best:.3f} s  {len(tokens) / best / 1e3:.0f}k tokens/s")
+    print(ast_mem_stats(statements).report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Scanner throughput for each ScannerEngine.
+
+Usage: python -m bench.scanner [scale]
+"""
+
+import sys
+import time
+
+from app.logger import Logger
+from app.scanner import Scanner
+from app.schema import ScannerEngine
+
+SOURCE_FILES = ("test.lox", "fib.lox")
+DEFAULT_SCALE = 200
+REPEATS = 3
+
+
+def _load_source(scale: int) -> str:
+    parts = []
+    for filename in SOURCE_FILES:
+        with open(filename) as file:
+            parts.append(file.read())
+
+    return "\n".join(parts) * scale
+
+
+def _time_scan(engine: ScannerEngine, source: str) -> tuple[float, int]:
+    best = float("inf")
+    token_count = 0
+
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        tokens = Scanner(Logger(), source, engine).scan_tokens()
+        best = min(best, time.perf_counter() - start)
+        token_count = len(tokens)
+
+    return best, token_count
+
+
+def main() -> None:
+    scale = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_SCALE
+    source = _load_source(scale)
+    megabytes = len(source.encode()) / 1_000_000
+
+    print(f"source: {megabytes:.2f} MB")
+
+    baseline = None
+    for engine in (ScannerEngine.CHAR, ScannerEngine.REGEX):
+        elapsed, token_count = _time_scan(engine, source)
+        baseline = baseline or elapsed
+        throughput = megabytes / elapsed
+        speedup = baseline / elapsed
+        print(
+            f"{engine:>6}: {elapsed:7.3f} s  {throughput:6.2f} MB/s  "
+            f"{token_count} tokens  {speedup:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Startup time for a large library of which a run only calls a few functions.
+
+Usage: python -m bench.startup [functions]
+"""
+
+import sys
+import time
+
+from app.interpreter import Interpreter
+from app.logger import Logger
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import OpMode
+
+DEFAULT_FUNCTIONS = 2_000
+REPEATS = 3
+
+FUNCTION = """
+fun helper{i}(a, b) {{
+    var total = 0;
+    for (var j = 0; j < a; j = j + 1) {{
+        if (j > b) total = total + j * (a - b); else total = total - 1;
+    }}
+    return total;
+}}
+
+class Shape{i} {{
+    init(w, h) {{ this.w = w; this.h = h; }}
+    area() {{ return this.w * this.h; }}
+    scaled(k) {{ return Shape{i}(this.w * k, this.h * k); }}
+}}
+"""
+
+
+def _load(tokens: list, strict: bool) -> float:
+    start = time.perf_counter()
+
+    logger = Logger()
+    interpreter = Interpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, tokens, lazy=not strict).parse()
+    Resolver(logger, interpreter).resolve(statements)
+    interpreter.interpret(statements)
+
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    function_count = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_FUNCTIONS
+    library = "".join(FUNCTION.format(i=i) for i in range(function_count))
+    source = library + "var result = helper0(10, 5) + Shape1(2, 3).area();\n"
+
+    tokens = Scanner(Logger(), source).scan_tokens()
+    print(f"{function_count} functions and classes, {len(tokens)} tokens")
+
+    for strict in (True, False):
+        best = min(_load(tokens, strict) for _ in range(REPEATS))
+        mode = "strict" if strict else "lazy"
+        print(f"{mode}: {best * 1e3:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Time and peak RSS of running deeply nested and very long generated programs.
+
+Each case is written to a temporary file and run by the interpreter in its own
+process, so the peak RSS is that of the case alone.
+
+Usage: python -m bench.stress [depth] [statements]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_DEPTH = 100_000
+DEFAULT_STATEMENTS = 1_000_000
+
+
+def _cases(depth: int, statement_count: int) -> dict[str, str]:
+    parentheses = "(" * depth + "1" + ")" * depth
+    sum_ = "1 + (" * depth + "1" + ")" * depth
+    blocks = "{" * depth + "print 1;" + "}" * depth
+    ladder = "\nelse ".join(f"if (x < {i}) x = {i};" for i in range(depth))
+    statements = "x = x + 1;\n" * statement_count
+
+    return {
+        f"{depth}-deep parentheses": f"print {parentheses};",
+        f"{depth}-deep right-nested +": f"print {sum_};",
+        f"{depth}-deep blocks": blocks,
+        f"{depth}-long else if ladder": f"var x = {depth};\n{ladder}\nprint x;",
+        f"{statement_count} statements": f"var x = 0;\n{statements}print x;",
+    }
+
+
+def _run(source: str) -> tuple[float, int, int]:
+    with tempfile.NamedTemporaryFile("w", suffix=".lox") as file:
+        file.write(source)
+        file.flush()
+
+        command = [sys.executable, "-m", "app.main", "interpret", file.name]
+        command.append("--strict")
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, os.waitstatus_to_exitcode(status), usage.ru_maxrss
+
+
+def main() -> None:
+    depth = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_DEPTH
+    statement_count = int(sys.argv[2]) if len(sys.argv) >= 3 else DEFAULT_STATEMENTS
+
+    for name, source in _cases(depth, statement_count).items():
+        elapsed, exit_code, max_rss = _run(source)
+        status = "ok" if exit_code == 0 else f"exit {exit_code}"
+        print(f"{name}: {elapsed:.2f} s  {max_rss / 1024:.0f} MiB peak RSS  {status}")
+
+
+if __name__ == "__main__":
+    main()
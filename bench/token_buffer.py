@@ -0,0 +1,69 @@
+"""Memory and time to scan and parse test.lox scaled up, with the tokens held
+in a list of Token objects versus a columnar TokenBuffer.
+
+Usage: python -m bench.token_buffer [scale]
+"""
+
+from collections.abc import Callable, Iterable
+import gc
+import sys
+import time
+import tracemalloc
+
+from app.logger import Logger
+from app.parser import Parser
+from app.scanner import Scanner
+from app.schema import Token
+
+DEFAULT_SCALE = 1000
+
+
+def _scan_list(source: str) -> Iterable[Token]:
+    return Scanner(Logger(), source).scan_tokens()
+
+
+def _scan_buffer(source: str) -> Iterable[Token]:
+    return Scanner(Logger(), source).scan_buffer()
+
+
+def _measure(
+    scan: Callable[[str], Iterable[Token]], source: str
+) -> tuple[float, float, float, float]:
+    gc.collect()
+    start = time.perf_counter()
+    tokens = scan(source)
+    scanned = time.perf_counter()
+    Parser(Logger(), tokens).parse()
+    parsed = time.perf_counter()
+    del tokens
+
+    gc.collect()
+    tracemalloc.start()
+    tokens = scan(source)
+    tokens_size, _ = tracemalloc.get_traced_memory()
+    Parser(Logger(), tokens).parse()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return scanned - start, parsed - scanned, tokens_size / 1e6, peak / 1e6
+
+
+def main() -> None:
+    scale = int(sys.argv[1]) if len(sys.argv) >= 2 else DEFAULT_SCALE
+
+    with open("test.lox") as file:
+        source = (file.read() + "\n") * scale
+
+    print(f"source: {len(source) / 1e6:.2f} MB (test.lox x {scale})")
+    print(f"{'':>7}  {'scan s':>7}  {'parse s':>7}  {'tokens MB':>9}  {'peak MB':>8}")
+
+    for name, scan in (("list", _scan_list), ("buffer", _scan_buffer)):
+        scan_time, parse_time, tokens_size, peak = _measure(scan, source)
+        print(
+            f"{name:>7}  {scan_time:7.2f}  {parse_time:7.2f}  "
+            f"{tokens_size:9.1f}  {peak:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
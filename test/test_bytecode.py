@@ -0,0 +1,72 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+
+from app import main
+from app.schema import Command, Engine
+
+
+def _run(command: Command, text: str) -> tuple[str, str, int]:
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        with io.StringIO() as stderr, redirect_stderr(stderr):
+            exit_code = main.run_text(command, text, engine=Engine.BYTECODE)
+            return stdout.getvalue(), stderr.getvalue(), exit_code
+
+
+def test_disassemble() -> None:
+    code = (
+        "fun add(a, b) {\n"
+        "    return a + b;\n"
+        "}\n"
+        "var x = 0;\n"
+        "while (x < 3) x = add(x, 1);\n"
+    )
+    output, error, exit_code = _run(Command.DISASSEMBLE, code)
+
+    assert (error, exit_code) == ("", 0)
+    assert output == (
+        "== <script> ==\n"
+        "0000    1 CLOSURE              0 <fn add>\n"
+        "0002    | DEFINE_GLOBAL        7\n"
+        "0004    | CONSTANT             1 '0'\n"
+        "0006    | DEFINE_GLOBAL        6\n"
+        "0008    5 GET_GLOBAL           6\n"
+        "0010    | CONSTANT             2 '3'\n"
+        "0012    | LESS\n"
+        "0013    | JUMP_IF_FALSE        -> 0028\n"
+        "0015    | GET_GLOBAL           7\n"
+        "0017    | GET_GLOBAL           6\n"
+        "0019    | CONSTANT             3 '1'\n"
+        "0021    | CALL                 2\n"
+        "0023    | SET_GLOBAL           6\n"
+        "0025    | POP\n"
+        "0026    | JUMP                 -> 0008\n"
+        "0028    | NIL\n"
+        "0029    | RETURN\n"
+        "\n"
+        "== add ==\n"
+        "0000    | GET_LOCAL            0\n"
+        "0002    | GET_LOCAL            1\n"
+        "0004    2 ADD\n"
+        "0005    | RETURN\n"
+        "0006    | NIL\n"
+        "0007    | RETURN\n"
+    )
+
+
+def test_deep_recursion() -> None:
+    # Lox calls don't recurse in Python, so this is far past the recursion
+    # limit the tree walker would run into.
+    code = (
+        "fun count(n) { if (n == 0) return 0; return 1 + count(n - 1); }\n"
+        "print count(20000);\n"
+    )
+
+    assert _run(Command.INTERPRET, code) == ("20000\n", "", 0)
+
+
+def test_stack_overflow() -> None:
+    code = "fun f() { return f(); }\nf();\n"
+    output, error, _ = _run(Command.INTERPRET, code)
+
+    assert output == ""
+    assert "Stack overflow." in error
@@ -0,0 +1,131 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import os
+from app import cache, main
+from app import resolver as resolver_module
+from app.cache import ProgramCache
+from app.interpreter import Interpreter
+from app.logger import Logger
+from app.schema import Command, OpMode
+from test.test_lazy import PROGRAM
+
+
+def _run(text: str, program_cache: ProgramCache) -> tuple[str, str, int]:
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        with io.StringIO() as stderr, redirect_stderr(stderr):
+            exit_code = main.run_text(Command.INTERPRET, text, cache=program_cache)
+            return stdout.getvalue(), stderr.getvalue(), exit_code
+
+
+def _cached_files(directory: str) -> list[str]:
+    return [name for name in os.listdir(directory) if name.endswith(cache.SUFFIX)]
+
+
+def test_cached_program_matches(tmp_path) -> None:
+    program_cache = ProgramCache(str(tmp_path))
+    expected = ("global\nglobal\n2\nhi lox!\n", "", 0)
+
+    assert _run(PROGRAM, program_cache) == expected
+    assert len(_cached_files(tmp_path)) == 1
+
+    assert _run(PROGRAM, program_cache) == expected
+    assert len(_cached_files(tmp_path)) == 1
+
+
+def test_cached_globals_are_relinked(tmp_path) -> None:
+    program_cache = ProgramCache(str(tmp_path))
+    code = "fun f() { return b; }\nvar a = 1;\nvar b = 2;\nprint f() + a;"
+
+    assert _run(code, program_cache) == ("3\n", "", 0)
+    assert _run(code, program_cache) == ("3\n", "", 0)
+
+
+def test_changed_source_is_recompiled(tmp_path) -> None:
+    program_cache = ProgramCache(str(tmp_path))
+
+    assert _run("print 1;", program_cache) == ("1\n", "", 0)
+    assert _run("print 2;", program_cache) == ("2\n", "", 0)
+    assert len(_cached_files(tmp_path)) == 2
+
+
+def test_changed_interpreter_source_invalidates_cache(tmp_path, monkeypatch) -> None:
+    program_cache = ProgramCache(str(tmp_path / "cache"))
+    assert _run(PROGRAM, program_cache)[2] == 0
+
+    # As if the resolver had been edited since the program was cached.
+    resolver = tmp_path / "resolver.py"
+    with open(resolver_module.__file__) as file:
+        resolver.write_text(file.read() + "\n# edited\n")
+    source_files = [
+        str(resolver) if path == resolver_module.__file__ else path
+        for path in cache.SOURCE_FILES
+    ]
+    tag = cache._version_tag(source_files)
+    assert tag != cache.VERSION_TAG
+    monkeypatch.setattr(cache, "VERSION_TAG", tag)
+
+    assert _run(PROGRAM, program_cache) == ("global\nglobal\n2\nhi lox!\n", "", 0)
+    assert len(_cached_files(tmp_path / "cache")) == 2
+
+
+def test_mem_stats_on_cache_hit(tmp_path) -> None:
+    program_cache = ProgramCache(str(tmp_path))
+    reports = []
+
+    for _ in range(2):
+        with io.StringIO() as stdout, redirect_stdout(stdout):
+            with io.StringIO() as stderr, redirect_stderr(stderr):
+                main.run_text(
+                    Command.INTERPRET, PROGRAM, mem_stats=True, cache=program_cache
+                )
+                reports.append(stderr.getvalue())
+
+    assert len(_cached_files(tmp_path)) == 1
+    # Byte counts differ, as the loaded tree is the resolved one.
+    assert reports[0].startswith("AST nodes: ")
+    assert reports[1].splitlines()[0] == reports[0].splitlines()[0]
+
+
+def test_errors_are_not_cached(tmp_path) -> None:
+    program_cache = ProgramCache(str(tmp_path))
+    code = "fun bad() { var a = 1; var a = 2; }"
+
+    assert _run(code, program_cache)[2] == 65
+    assert _cached_files(tmp_path) == []
+
+
+def test_shared_cache_is_only_read(tmp_path) -> None:
+    shared = tmp_path / "shared"
+    local = tmp_path / "local"
+    shared.mkdir()
+
+    _run(PROGRAM, ProgramCache(str(shared)))
+    _run(PROGRAM, ProgramCache(str(local), [str(shared)]))
+    assert len(_cached_files(shared)) == 1 and not local.exists()
+
+    _run("print 1;", ProgramCache(None, [str(shared)]))
+    assert len(_cached_files(shared)) == 1
+
+
+def test_stale_or_corrupt_data_is_ignored() -> None:
+    interpreter = Interpreter(Logger(), OpMode.PROGRAM)
+
+    assert cache.load(b"LOXC" + bytes(16) + b"junk", interpreter) is None
+    assert cache.load(cache.MAGIC + cache.VERSION_TAG + b"junk", interpreter) is None
+
+
+def test_unreadable_cache_file_is_recompiled(tmp_path) -> None:
+    program_cache = ProgramCache(str(tmp_path))
+    path = tmp_path / (ProgramCache.key(PROGRAM) + cache.SUFFIX)
+    path.write_bytes(b"not a program")
+
+    assert _run(PROGRAM, program_cache)[0] == "global\nglobal\n2\nhi lox!\n"
+
+
+def test_deep_program_loads(tmp_path) -> None:
+    program_cache = ProgramCache(str(tmp_path))
+    depth = 5000
+    code = f"print {'(' * depth}1{')' * depth};\n" + "{" * depth + "}" * depth
+
+    assert _run(code, program_cache) == ("1\n", "", 0)
+    assert _run(code, program_cache) == ("1\n", "", 0)
@@ -0,0 +1,94 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import sys
+import pytest
+from app import main
+from app.schema import Command, Engine
+
+# Well past Python's default recursion limit.
+DEPTH = 5_000
+
+CALLS = "f(" * DEPTH + "4" + ")" * DEPTH
+LADDER = "\nelse ".join(f"if (x < {i}) print {i};" for i in range(DEPTH))
+
+CASES = {
+    "parentheses": ("print " + "(" * DEPTH + "1" + ")" * DEPTH + ";", "1"),
+    "right-nested +": ("print " + "1 + (" * DEPTH + "1" + ")" * DEPTH + ";", "5001"),
+    "unary -": ("print " + "-" * DEPTH + "1;", "1"),
+    "unary !": ("print " + "!" * (DEPTH + 1) + "true;", "false"),
+    "assignment": ("var a;\n" + "a = " * DEPTH + "2;\nprint a;", "2"),
+    "ternary": ("print " + "false ? 0 : " * DEPTH + "3;", "3"),
+    "calls": (f"fun f(x) {{ return x; }}\nprint {CALLS};", "4"),
+    "blocks": ("{" * DEPTH + "print 5;" + "}" * DEPTH, "5"),
+    "else if ladder": (f"var x = {DEPTH};\n{LADDER}\nelse print x;", "5000"),
+    "if": ("if (true) " * DEPTH + "print 7;", "7"),
+}
+
+
+def _run(
+    text: str, strict: bool = True, engine: Engine = Engine.TREE
+) -> tuple[str, str, int]:
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        with io.StringIO() as stderr, redirect_stderr(stderr):
+            exit_code = main.run_text(
+                Command.INTERPRET, text, strict=strict, engine=engine
+            )
+            return stdout.getvalue(), stderr.getvalue(), exit_code
+
+
+@pytest.mark.parametrize("engine", Engine)
+@pytest.mark.parametrize("case", CASES)
+def test_deep_nesting(case: str, engine: Engine) -> None:
+    code, output = CASES[case]
+
+    assert _run(code, engine=engine) == (output + "\n", "", 0)
+
+
+@pytest.mark.parametrize("engine", Engine)
+def test_deep_nesting_in_lazy_body(engine: Engine) -> None:
+    code = "fun f() {\n" + "{" * DEPTH + "print 8;" + "}" * DEPTH + "\n}\nf();"
+
+    assert _run(code, strict=False, engine=engine) == ("8\n", "", 0)
+
+
+@pytest.mark.parametrize("engine", Engine)
+def test_recursion_limit_restored(engine: Engine) -> None:
+    parentheses = "(" * DEPTH + "1" + ")" * DEPTH
+    code = f"fun f() {{ return {parentheses}; }}\nprint f();\nprint {parentheses};"
+    limit = sys.getrecursionlimit()
+
+    for strict in (True, False):
+        assert _run(code, strict=strict, engine=engine) == ("1\n1\n", "", 0)
+        assert sys.getrecursionlimit() == limit
+
+
+def test_error_deep_inside_nesting() -> None:
+    code = "{" * DEPTH + "\nprint 1 +;\n" + "}" * DEPTH
+
+    output, error, exit_code = _run(code)
+
+    assert exit_code == 65
+    assert error.strip() == "[line 2] Error at ';': Expect expression."
+
+
+def test_deep_tail_calls() -> None:
+    depth = 50_000
+    code = (
+        "fun count(n, total) {\n"
+        "    if (n == 0) return total;\n"
+        "    return count(n - 1, total + 2);\n"
+        "}\n"
+        "fun isEven(n) { if (n == 0) return true; return isOdd(n - 1); }\n"
+        "fun isOdd(n) { if (n == 0) return false; return isEven(n - 1); }\n"
+        "class Box { init(n) { this.n = n; } }\n"
+        "class Walker {\n"
+        "    walk(n) { if (n == 0) return Box(n); return this.walk(n - 1); }\n"
+        "}\n"
+        f"print count({depth}, 0);\n"
+        f"print isEven({depth + 1});\n"
+        f"print Walker().walk({depth}).n;\n"
+    )
+
+    # Bodies loaded on the first call, between tail calls, too.
+    for strict in (True, False):
+        assert _run(code, strict=strict) == (f"{depth * 2}\nfalse\n0\n", "", 0)
@@ -0,0 +1,58 @@
+from contextlib import redirect_stderr
+import io
+import random
+import pytest
+from app import incremental
+from app.incremental import IncrementalLexer
+from app.logger import Logger
+from app.scanner import Scanner
+from app.schema import Token
+
+
+def _scan(text: str) -> list[Token]:
+    with io.StringIO() as stderr, redirect_stderr(stderr):
+        return Scanner(Logger(), text).scan_tokens()
+
+
+def _edit(lexer: IncrementalLexer, offset: int, deleted: int, inserted: str) -> None:
+    with io.StringIO() as stderr, redirect_stderr(stderr):
+        lexer.edit(offset, deleted, inserted)
+
+
+@pytest.fixture(autouse=True)
+def _small_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    # so edits cross page boundaries
+    monkeypatch.setattr(incremental, "PAGE_SIZE", 8)
+
+
+def test_edits_that_open_and_close_strings_and_comments() -> None:
+    text = 'var a = 1;\nprint a; // done\nvar b = "x";\nprint b;\n'
+    lexer = IncrementalLexer(Logger(), text)
+
+    edits = [
+        (text.index("1;"), 0, '"'),  # opens a string up to the next quote
+        (text.index("1;"), 1, ""),  # closes it again
+        (text.index("print a"), 0, "//"),  # comments out a line
+        (text.index("print a"), 2, ""),
+        (text.index("// done"), 1, ""),  # turns a comment into two slashes
+        (len(text) - 1, 0, '"'),  # unterminated string at the end
+    ]
+    for offset, deleted, inserted in edits:
+        _edit(lexer, offset, deleted, inserted)
+        assert list(lexer) == _scan(lexer.source)
+
+
+def test_random_edits_match_full_rescan() -> None:
+    random.seed(0)
+
+    with open("test.lox") as file:
+        lexer = IncrementalLexer(Logger(), file.read()[:2000])
+
+    snippets = ["", "x", " ", "\n", '"', "//", "1.5", ".", "=", 'a"b\nc"']
+    for _ in range(300):
+        source = lexer.source
+        offset = random.randint(0, len(source))
+        deleted = min(random.choice((0, 1, 3)), len(source) - offset)
+        _edit(lexer, offset, deleted, random.choice(snippets))
+
+        assert list(lexer) == _scan(lexer.source)
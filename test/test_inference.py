@@ -0,0 +1,101 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+
+from app import inference, main
+from app.inference import StaticType
+from app.logger import Logger
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import Command, Engine, OpMode
+from app import statement as Stmt
+from app.transpiler import PythonInterpreter, Transpiler
+
+
+def _resolve(text: str) -> tuple[PythonInterpreter, list[Stmt.Stmt]]:
+    logger = Logger()
+    interpreter = PythonInterpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, text).scan_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+    return interpreter, statements
+
+
+def _function(text: str) -> tuple[PythonInterpreter, Stmt.Function]:
+    interpreter, statements = _resolve(text)
+    function = statements[0]
+    assert isinstance(function, Stmt.Function)
+    return interpreter, function
+
+
+def test_local_types() -> None:
+    _, function = _function(
+        "fun f(n) {\n"
+        "    var count = 0;\n"
+        '    var text = "";\n'
+        "    var either = nil;\n"
+        "    var sum = n + count;\n"
+        "    while (count < n) {\n"
+        "        count = count + 1;\n"
+        '        text = text + "x";\n'
+        '        either = count > 2 ? "big" : count;\n'
+        "    }\n"
+        "    return text;\n"
+        "}\n"
+    )
+
+    # Slot 0 is n, which can be anything, and n + count is still a number.
+    assert inference.local_types(function.body) == {
+        1: StaticType.NUMBER,
+        2: StaticType.STRING,
+        3: StaticType.NIL | StaticType.NUMBER | StaticType.STRING,
+        4: StaticType.NUMBER,
+    }
+    # A string plus a number raises, so nothing is ever assigned.
+    assert inference.local_types(function.body, {0: StaticType.STRING})[4] == 0
+
+
+def test_compiled_without_checks() -> None:
+    interpreter, function = _function(
+        "fun f() {\n"
+        '    var s = "";\n'
+        "    for (var i = 0; i < 3; i = i + 1) {\n"
+        '        if (!(i == 1)) s = s + "x";\n'
+        "    }\n"
+        "    return s;\n"
+        "}\n"
+    )
+
+    source = Transpiler(interpreter).factory(function, False, "_f")
+
+    assert "while (i_1 < 3.0):" in source
+    assert "if (not (i_1 == 1.0)):" in source
+    assert "s_0 = (s_0 + 'x')" in source
+    assert "i_1 = (i_1 + 1.0)" in source
+    assert "_plus" not in source and "_less" not in source and "_eq" not in source
+
+
+def test_type_stats() -> None:
+    code = (
+        "fun spaces(num) {\n"
+        '    var result = "";\n'
+        '    for (var i = 0; i < num; i = i + 1) result = result + " ";\n'
+        "    return result;\n"
+        "}\n"
+        'print spaces(3) + "|";\n'
+    )
+
+    for engine in Engine:
+        with io.StringIO() as stdout, redirect_stdout(stdout):
+            with io.StringIO() as stderr, redirect_stderr(stderr):
+                exit_code = main.run_text(
+                    Command.INTERPRET, code, engine=engine, type_stats=True
+                )
+                output, report = stdout.getvalue(), stderr.getvalue()
+
+        assert (output, exit_code) == ("   |\n", 0)
+        assert [line.split() for line in report.splitlines()] == [
+            ["function", "line", "locals", "expressions", "typed"],
+            ["<script>", "0", "0/0", "3/5", "60.0%"],
+            ["spaces", "1", "2/3", "13/14", "92.9%"],
+            ["total", "2/3", "16/19", "84.2%"],
+        ]
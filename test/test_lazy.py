@@ -0,0 +1,192 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import pytest
+from app import main
+from app.schema import Command, Engine
+
+
+def _run(
+    text: str, strict: bool, engine: Engine = Engine.TREE
+) -> tuple[str, str, int]:
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        with io.StringIO() as stderr, redirect_stderr(stderr):
+            exit_code = main.run_text(
+                Command.INTERPRET, text, strict=strict, engine=engine
+            )
+            return stdout.getvalue(), stderr.getvalue(), exit_code
+
+
+PROGRAM = """
+var a = "global";
+{
+    fun show() { print a; }
+    show();
+    var a = "local";
+    show();
+}
+
+fun counter() {
+    var count = 0;
+    fun increment() { count = count + 1; return count; }
+    return increment;
+}
+var next = counter();
+next();
+print next();
+
+class Base {
+    init(name) { this.name = name; }
+    greet() { return "hi " + this.name; }
+}
+class Derived < Base {
+    greet() { return super.greet() + "!"; }
+}
+print Derived("lox").greet();
+
+fun unused() { return 1; }
+"""
+
+
+CLOSURES = """
+var fns = nil;
+fun keep(f, rest) {
+    fun node(i) { if (i < 1) return f; return rest(i - 1); }
+    return node;
+}
+fun none(i) { return nil; }
+fns = none;
+for (var i = 0; i < 3; i = i + 1) {
+    var j = i * 10;
+    fun get() { return j + i; }
+    fns = keep(get, fns);
+}
+print fns(0)();
+print fns(1)();
+print fns(2)();
+
+fun outer() {
+    var a = "a";
+    fun middle() {
+        var b = "b";
+        fun inner() {
+            a = a + "!";
+            return a + b;
+        }
+        return inner;
+    }
+    return middle();
+}
+var inner = outer();
+print inner();
+print inner();
+
+{
+    fun countdown(n) { if (n > 0) return countdown(n - 1); return "done"; }
+    print countdown(3);
+    class Node {
+        init(next) { this.next = next; }
+        grow() { return Node(this); }
+        depth() { if (!this.next) return 1; return 1 + this.next.depth(); }
+    }
+    print Node(nil).grow().grow().depth();
+}
+
+class Base {
+    greet() { return "base"; }
+}
+class Derived < Base {
+    greet() {
+        fun later() { return super.greet() + " via " + this.name; }
+        return later;
+    }
+}
+var d = Derived();
+d.name = "derived";
+print d.greet()();
+"""
+
+
+@pytest.mark.parametrize(
+    "program, output",
+    [
+        (PROGRAM, "global\nglobal\n2\nhi lox!\n"),
+        (CLOSURES, "23\n13\n3\na!b\na!!b\ndone\n3\nbase via derived\n"),
+    ],
+)
+def test_lazy_matches_strict(program: str, output: str) -> None:
+    expected = _run(program, strict=True)
+
+    assert _run(program, strict=False) == expected
+    assert expected == (output, "", 0)
+
+    for engine in (Engine.CLOSURE, Engine.BYTECODE, Engine.PYTHON, Engine.TIERED):
+        for strict in (True, False):
+            assert _run(program, strict=strict, engine=engine) == expected
+
+
+NESTED_SUPER = {
+    "super alone": (
+        "fun inner() { return super.m(); }",
+        "inner",
+        "A.m",
+    ),
+    "super after a local": (
+        'var x = "1"; fun inner() { return super.m() + x; }',
+        "inner",
+        "A.m1",
+    ),
+    "super and this": (
+        'fun inner() { return super.m() + this.name; } this.name = "!";',
+        "inner",
+        "A.m!",
+    ),
+    "two functions deep": (
+        "fun middle() { fun inner() { return super.m(); } return inner; }",
+        "middle()",
+        "A.m",
+    ),
+}
+
+
+@pytest.mark.parametrize("engine", Engine)
+@pytest.mark.parametrize("case", NESTED_SUPER)
+def test_lazy_super_in_nested_function(case: str, engine: Engine) -> None:
+    body, returned, output = NESTED_SUPER[case]
+    code = (
+        'class A { m() { return "A.m"; } }\n'
+        f"class B < A {{ m() {{ {body} return {returned}; }} }}\n"
+        "print B().m()();"
+    )
+
+    assert _run(code, strict=False, engine=engine) == (output + "\n", "", 0)
+    assert _run(code, strict=True, engine=engine) == (output + "\n", "", 0)
+
+
+def test_lazy_skips_errors_in_uncalled_bodies() -> None:
+    code = 'fun bad() { var a = 1; var a = 2; }\nprint "ok";'
+
+    assert _run(code, strict=False) == ("ok\n", "", 0)
+
+    _, error, exit_code = _run(code, strict=True)
+    assert exit_code == 65
+    assert "Already a variable with this name in this scope." in error
+
+
+@pytest.mark.parametrize(
+    "body, message",
+    [
+        ("print 1 }", "[line 2] Error at '}': Expect ';' after value."),
+        (
+            "print this; }",
+            "[line 2] Error at 'this': Can't use 'this' outside of a class.",
+        ),
+    ],
+)
+def test_lazy_reports_errors_on_first_call(body: str, message: str) -> None:
+    code = f'print "before";\nfun bad() {{ {body}\nbad();\nprint "after";'
+
+    output, error, exit_code = _run(code, strict=False)
+
+    assert exit_code == 65
+    assert output == "before\n"
+    assert error.splitlines()[0] == message
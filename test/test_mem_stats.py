@@ -0,0 +1,22 @@
+from app.logger import Logger
+from app.mem_stats import ast_mem_stats
+from app.parser import Parser
+from app.scanner import Scanner
+from app.schema import AstNode
+
+
+def test_mem_stats_counts_each_node_once() -> None:
+    text = "fun add(a, b) {\n  return a + b;\n}\nprint add(1, 2);\n"
+    statements = Parser(Logger(), Scanner(Logger(), text).iter_tokens()).parse()
+
+    stats = ast_mem_stats(statements)
+
+    # Function, Return, Binary, 2 Variables, Print, Call, Variable, 2 Literals
+    assert stats.nodes == 10
+    assert stats.lines == 4
+    assert stats.total_bytes == stats.node_bytes + stats.token_bytes
+
+    function = statements[0]
+    assert isinstance(function, AstNode)
+    assert not hasattr(function, "__dict__")
+    assert isinstance(function.body, tuple)
@@ -0,0 +1,32 @@
+from contextlib import redirect_stderr
+import io
+import pytest
+from app import parallel
+from app.logger import Logger
+from app.scanner import Scanner
+
+
+@pytest.mark.parametrize("jobs", [2, 3])
+def test_parallel_scan_matches_serial_scan(
+    jobs: int, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(parallel, "MIN_PARALLEL_CHARS", 0)
+
+    with open("test.lox") as file:
+        program = file.read()
+
+    # newlines inside strings aren't safe split points, and quotes inside
+    # comments don't start strings
+    extra = 'var s = "a\n\nb"; // "not a string\n@\n'
+    text = (program + extra) * 8 + '"unterminated\n\n'
+
+    with io.StringIO() as stderr, redirect_stderr(stderr):
+        expected = list(Scanner(Logger(), text).scan_buffer())
+        expected_error = stderr.getvalue()
+
+    with io.StringIO() as stderr, redirect_stderr(stderr):
+        tokens = list(parallel.scan_buffer(Logger(), text, jobs))
+        error = stderr.getvalue()
+
+    assert tokens == expected
+    assert error == expected_error
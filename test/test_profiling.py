@@ -0,0 +1,134 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+
+import pytest
+
+from app import expression as Expr
+from app import main, profiling, quicken, tiered
+from app.interpreter import Interpreter
+from app.logger import Logger
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import Command, Engine, OpMode
+from app import statement as Stmt
+
+PROGRAM = (
+    "fun add(a, b) {\n"
+    "    return a + b;\n"
+    "}\n"
+    "fun sign(x) {\n"
+    "    if (x < 0) return -1;\n"
+    "    return 1;\n"
+    "}\n"
+    "var total = 0;\n"
+    "for (var i = 0; i < 10; i = i + 1) total = add(total, sign(i - 2));\n"
+    "print total;\n"
+)
+
+
+def _run(text: str, engine: Engine = Engine.TREE, **kwargs) -> tuple[str, str, int]:
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        with io.StringIO() as stderr, redirect_stderr(stderr):
+            exit_code = main.run_text(Command.INTERPRET, text, engine=engine, **kwargs)
+            return stdout.getvalue(), stderr.getvalue(), exit_code
+
+
+def _resolve(text: str) -> tuple[Interpreter, list[Stmt.Stmt]]:
+    logger = Logger()
+    interpreter = Interpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, text).scan_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+    return interpreter, statements
+
+
+def _record(text: str, path: str) -> profiling.Entries:
+    assert _run(text, profile_out=path)[2] == 0
+    with open(path, "rb") as file:
+        entries = profiling.load(file.read())
+    assert entries is not None
+    return entries
+
+
+def _quick(statements: list[Stmt.Stmt]) -> dict[str, int]:
+    return {
+        key: node.quick
+        for key, node in profiling.keyed_nodes(statements)
+        if isinstance(node, (Expr.Binary, Expr.Unary, Expr.Logical, Expr.Call))
+    }
+
+
+def test_profile_records_run(tmp_path) -> None:
+    entries = _record(PROGRAM, str(tmp_path / "profile"))
+
+    assert entries["add:0:f0"] == (2, 10, 0b11, False)
+    assert entries["add:1:b0"] == ("+", "number-add")
+    # Taken for i = 0 and 1.
+    assert entries["sign:1:i0"] == (None, 2, 8)
+    assert entries["sign:1:u0"] == ("-", "number-negate")
+    assert entries[":9:w0"] == (None, 1, 10, False)
+    assert entries[":9:c0"] == (2, "call-function", 1)
+
+
+def test_profile_prespecializes(tmp_path) -> None:
+    path = str(tmp_path / "profile")
+    entries = _record(PROGRAM, path)
+
+    interpreter, statements = _resolve(PROGRAM)
+    assert profiling.apply(statements, interpreter, entries) == len(entries)
+    assert _quick(statements)["add:1:b0"] == quicken.NUMBER_ADD
+    assert _quick(statements)[":9:c1"] == quicken.CALL_FUNCTION
+
+    output, _, exit_code = _run(PROGRAM, profile_in=path)
+    assert (output, exit_code) == ("6\n", 0)
+
+
+def test_stale_profile(tmp_path) -> None:
+    entries = _record(PROGRAM, str(tmp_path / "profile"))
+
+    # Moving a function leaves the keys in it as they were, and the entries for
+    # an edited line are skipped.
+    edited = (
+        "fun sign(x) {\n"
+        "    if (x < 0) return -1;\n"
+        "    return 1;\n"
+        "}\n"
+        "fun add(a, b) {\n"
+        "    return a - b;\n"
+        "}\n"
+    ) + PROGRAM.split("}\n")[-1]
+    interpreter, statements = _resolve(edited)
+    matched = profiling.apply(statements, interpreter, entries)
+
+    assert matched == len(entries) - 1
+    quick = _quick(statements)
+    assert quick["add:1:b0"] == 0
+    assert quick["sign:1:b0"] == quicken.NUMBER_LESS
+    assert _run(edited, profile_in=str(tmp_path / "profile"))[::2] == ("-6\n", 0)
+
+
+def test_profile_primes_tiered(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(tiered, "HOT_CALLS", 3)
+    monkeypatch.setattr(tiered, "HOT_LOOP", 3)
+    path = str(tmp_path / "profile")
+
+    assert _run(PROGRAM, Engine.TIERED, profile_out=path)[2] == 0
+
+    # Compiled the first time they run, rather than the third.
+    once = "fun add(a, b) {\n    return a + b;\n}\nprint add(1, 2);\n"
+    output, error, _ = _run(once, Engine.TIERED, profile_in=path, jit_stats=True)
+    assert output == "3\n"
+    assert error.splitlines()[1].split() == ["fun", "add", "1", "3", "specialized", "0"]
+
+
+def test_bad_profile(tmp_path) -> None:
+    path = tmp_path / "profile"
+    path.write_bytes(b"not a profile")
+
+    output, error, exit_code = _run(PROGRAM, profile_in=str(path))
+
+    assert (output, exit_code) == ("6\n", 0)
+    assert error == f"Ignoring {path}, which isn't a profile from this version.\n"
+    assert profiling.load(profiling.dump({"a:0:b0": ("+", "number-add")})) == {
+        "a:0:b0": ("+", "number-add")
+    }
@@ -1,10 +1,22 @@
 from collections.abc import Generator
 from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from functools import cache
+import gc
 import io
 from typing import Any
+import pytest
+from app import expression as Expr
 from app import main
-from app.schema import Command
+from app.interpreter import Interpreter
+from app.logger import Logger
+from app.runtime import LoxInstance
+from app.schema import Command, Engine, OpMode
+
+
+# Every test runs once per engine.
+@pytest.fixture(params=list(Engine))
+def engine(request: pytest.FixtureRequest) -> Engine:
+    return request.param
 
 
 def _code(text: str) -> str:
@@ -21,10 +33,10 @@ def _redirect() -> Generator[tuple[io.StringIO, io.StringIO], None, None]:
             yield stdout, stderr
 
 
-def _run(text: str) -> tuple[str, str, int]:
+def _run(text: str, engine: Engine) -> tuple[str, str, int]:
     with _redirect() as (stdout, stderr):
         try:
-            exit_code = main.run_text(Command.INTERPRET, text)
+            exit_code = main.run_text(Command.INTERPRET, text, engine=engine)
         except Exception:
             exit_code = 1
 
@@ -34,6 +46,10 @@ def _run(text: str) -> tuple[str, str, int]:
     return output, error, exit_code
 
 
+def _interpreter(engine: Engine, logger: Logger, op_mode: OpMode) -> Interpreter:
+    return main.ENGINES[engine](logger, op_mode)
+
+
 def _lines(*lines: Any) -> str:
     if len(lines) == 1 and isinstance(lines[0], Generator):
         lines = tuple(lines[0])
@@ -47,7 +63,7 @@ def _fib(n: int) -> int:
     return _fib(n - 2) + _fib(n - 1)
 
 
-def test_fib() -> None:
+def test_fib(engine: Engine) -> None:
     code = _code(
         """
         fun fib(n) {
@@ -60,14 +76,14 @@ def test_fib() -> None:
         }
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == _lines(_fib(i) for i in range(20))
     assert error == ""
 
 
-def test_closure() -> None:
+def test_closure(engine: Engine) -> None:
     code = _code(
         """
         fun makeCounter() {
@@ -85,14 +101,14 @@ def test_closure() -> None:
         print counter();
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == _lines(1, 2, 3)
     assert error == ""
 
 
-def test_shadowing() -> None:
+def test_shadowing(engine: Engine) -> None:
     code = _code(
         """
         var a = "global";
@@ -107,14 +123,134 @@ def test_shadowing() -> None:
         }
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == _lines("global", "global")
     assert error == ""
 
 
-def test_hello_word() -> None:
+def test_nested_blocks(engine: Engine) -> None:
+    # The resolver splices blocks into the block or body they're in, and
+    # unwraps one-statement bodies, which mustn't change what names refer to.
+    code = _code(
+        """
+        var a = "global";
+        {
+            var a = "outer";
+            {
+                var a = "inner";
+                { { print a; } }
+            }
+            print a;
+        }
+        print a;
+
+        fun shadow() {
+            var x = "outer";
+            fun get() { return x; }
+            { var x = "inner"; print x; print get(); }
+            { x = "assigned"; }
+            print x;
+        }
+        shadow();
+
+        fun run(n) {
+            var total = 0;
+            var first;
+            var last;
+            for (var i = 0; i < n; i = i + 1) {
+                { var twice = i * 2; total = total + twice; }
+                if (i > 0) { var x = i; total = total + x; } else { total = total - 1; }
+                while (false) { print "never"; }
+                {
+                    var j = i;
+                    fun get() { return j; }
+                    if (i == 0) { first = get; }
+                    last = get;
+                }
+            }
+            print first();
+            print last();
+            return total;
+        }
+        print run(3);
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert exit_code == 0, error
+    assert output.strip() == _lines(
+        "inner", "outer", "global", "inner", "outer", "assigned", 0, 2, 8
+    )
+    assert error == ""
+
+
+def test_local_slots(engine: Engine) -> None:
+    code = _code(
+        """
+        fun outer(a, b) {
+            var c = a + b;
+            {
+                var d = c * 2;
+                class Pair {
+                    init(x) { this.x = x; }
+                    sum() { return this.x + d; }
+                }
+                fun bump() {
+                    a = a + 1;
+                    c = c + a;
+                    return Pair(c).sum();
+                }
+                print bump();
+                print bump();
+            }
+            return a + b + c;
+        }
+
+        print outer(1, 2);
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert exit_code == 0, error
+    assert output.strip() == _lines(11, 14, 13)
+    assert error == ""
+
+
+def test_globals(engine: Engine) -> None:
+    code = _code(
+        """
+        fun show() { print later; }
+        var later = "defined later";
+        show();
+        var later = "redefined";
+        show();
+        print clock() > 0;
+        missing = 1;
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert output.strip() == _lines("defined later", "redefined", "true")
+    assert error.startswith("Undefined variable 'missing'.\n[line 7]")
+
+
+def test_undefined_global_in_function(engine: Engine) -> None:
+    code = _code(
+        """
+        fun show() { print later; }
+        show();
+        var later = 1;
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert output == ""
+    assert error.startswith("Undefined variable 'later'.\n[line 1]")
+
+
+def test_hello_word(engine: Engine) -> None:
     code = _code(
         """
         var hello = "hello";
@@ -122,14 +258,14 @@ def test_hello_word() -> None:
         print "world";
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == _lines("hello", "world")
     assert error == ""
 
 
-def test_semicolon_error() -> None:
+def test_semicolon_error(engine: Engine) -> None:
     code = _code(
         """
         var hello = "hello";
@@ -137,14 +273,14 @@ def test_semicolon_error() -> None:
         print "world";
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 65, output
     assert output == ""
     assert error.strip() == "[line 3] Error at 'print': Expect ';' after value."
 
 
-def test_duplicate_declaration() -> None:
+def test_duplicate_declaration(engine: Engine) -> None:
     code = _code(
         """
         fun bad() {
@@ -153,7 +289,7 @@ def test_duplicate_declaration() -> None:
         }
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 65, output
     assert output == ""
@@ -163,13 +299,13 @@ def test_duplicate_declaration() -> None:
     )
 
 
-def test_global_return() -> None:
+def test_global_return(engine: Engine) -> None:
     code = _code(
         """
         return 1;
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 65, output
     assert output == ""
@@ -178,7 +314,7 @@ def test_global_return() -> None:
     )
 
 
-def test_simple_class() -> None:
+def test_simple_class(engine: Engine) -> None:
     code = _code(
         """
         class Bacon {
@@ -190,14 +326,14 @@ def test_simple_class() -> None:
         Bacon().eat(); // Prints "Crunch crunch crunch!".
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == "Crunch crunch crunch!"
     assert error == ""
 
 
-def test_class_this() -> None:
+def test_class_this(engine: Engine) -> None:
     code = _code(
         """
         class Cake {
@@ -212,14 +348,14 @@ def test_class_this() -> None:
         cake.taste();
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == "The German chocolate cake is delicious!"
     assert error == ""
 
 
-def test_class_binding() -> None:
+def test_class_binding(engine: Engine) -> None:
     code = _code(
         """
         class Person {
@@ -238,14 +374,14 @@ def test_class_binding() -> None:
         bill.sayName();
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == "Jane"
     assert error == ""
 
 
-def test_this_outside_class() -> None:
+def test_this_outside_class(engine: Engine) -> None:
     code = _code(
         """
         fun notAMethod() {
@@ -253,7 +389,7 @@ def test_this_outside_class() -> None:
         }
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 65, output
     assert output == ""
@@ -263,7 +399,7 @@ def test_this_outside_class() -> None:
     )
 
 
-def test_class_init() -> None:
+def test_class_init(engine: Engine) -> None:
     code = _code(
         """
         class Cake {
@@ -280,14 +416,14 @@ def test_class_init() -> None:
         cake.taste();
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == "The German chocolate cake is delicious!"
     assert error == ""
 
 
-def test_class_inheritance() -> None:
+def test_class_inheritance(engine: Engine) -> None:
     code = _code(
         """
         class Doughnut {
@@ -301,14 +437,14 @@ def test_class_inheritance() -> None:
         BostonCream().cook();
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == "Fry until golden brown."
     assert error == ""
 
 
-def test_class_super() -> None:
+def test_class_super(engine: Engine) -> None:
     code = _code(
         """
         class Doughnut {
@@ -327,7 +463,7 @@ def test_class_super() -> None:
         BostonCream().cook();
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == _lines(
@@ -336,7 +472,7 @@ def test_class_super() -> None:
     assert error == ""
 
 
-def test_super_on_subclass() -> None:
+def test_super_on_subclass(engine: Engine) -> None:
     code = _code(
         """
         class A {
@@ -360,14 +496,14 @@ def test_super_on_subclass() -> None:
         C().test();
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == "A method"
     assert error == ""
 
 
-def test_break() -> None:
+def test_break(engine: Engine) -> None:
     code = _code(
         """
         for (var i = 0; i < 10; i = i + 1) {
@@ -379,8 +515,235 @@ def test_break() -> None:
         }
         """
     )
-    output, error, exit_code = _run(code)
+    output, error, exit_code = _run(code, engine)
 
     assert exit_code == 0, error
     assert output.strip() == _lines(0, 1, 2, 3, 4)
     assert error == ""
+
+
+def test_flow_outside_loop(engine: Engine) -> None:
+    code = _code(
+        """
+        fun stop() {
+            break;
+        }
+        fun find(limit) {
+            for (var i = 0; ; i = i + 1) {
+                while (true) {
+                    if (i == limit) return i;
+                    break;
+                }
+            }
+        }
+        print find(3);
+        for (var i = 0; i < 3; i = i + 1) {
+            print i;
+            stop();
+        }
+        print "unreachable";
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert exit_code == 0, error
+    assert output.strip() == _lines(3, 0)
+    assert error.strip() == "Flow statement used outside loop.\n[line 2])"
+
+
+# Deeper than Python's recursion limit, and than the tiered engine's threshold
+# for translating a function, so translations make tail calls too.
+@pytest.mark.parametrize("engine", [Engine.TREE, Engine.TIERED])
+def test_tail_calls(engine: Engine) -> None:
+    code = _code(
+        """
+        fun sum(n, acc) { if (n == 0) return acc; return sum(n - 1, acc + n); }
+        fun isEven(n) { if (n == 0) return true; return isOdd(n - 1); }
+        fun isOdd(n) { if (n == 0) return false; return isEven(n - 1); }
+        class Box { init(n) { this.n = n; } }
+        class Walker {
+            walk(n) { if (n == 0) return Box(n); return this.walk(n - 1); }
+        }
+        fun apply(f, n) { if (n == 0) return f(n); return apply(f, n - 1); }
+        fun next(n) { return n + 1; }
+        print sum(5000, 0);
+        print isEven(5001);
+        print Walker().walk(5000).n;
+        print apply(next, 5000);
+        print apply(nil, 5000);
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert exit_code == 0, error
+    assert output.strip() == _lines(12502500, "false", 0, 1)
+    assert error.strip() == "Can only call functions and classes.\n[line 8])"
+
+
+def test_counted_loops(engine: Engine) -> None:
+    code = _code(
+        """
+        fun pow(base, exponent) {
+            var result = 1;
+            for (var i = 0; i < exponent; i = i + 1) {
+                result = result * base;
+            }
+            return result;
+        }
+
+        fun odd_steps(n) {
+            var out = "";
+            for (var i = 0; i < n; i = i + 1) {
+                if (i > 6) break;
+                out = out + "x";
+                i = i + 1;
+            }
+            return out;
+        }
+
+        fun countdown() {
+            var total = 0;
+            for (var i = 5; i >= 1; i = i - 2) total = total + i;
+            return total;
+        }
+
+        fun last_closure() {
+            var last = nil;
+            for (var i = 0; i < 3; i = i + 1) {
+                fun get() { return i; }
+                last = get;
+            }
+            return last();
+        }
+
+        print pow(2, 10);
+        print odd_steps(10);
+        print countdown();
+        print last_closure();
+        for (var i = 0; i < 2; i = i + 1) print i;
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert exit_code == 0, error
+    assert output.strip() == _lines(1024, "xxxx", 9, 3, 0, 1)
+    assert error == ""
+
+
+@pytest.mark.parametrize(
+    "limit, body, message",
+    [
+        ('"n"', "", "Operands to < must be numbers."),
+        ("3", 'i = "a";', "Operands to + must be numbers or strings."),
+    ],
+)
+def test_counted_loop_type_errors(
+    engine: Engine, limit: str, body: str, message: str
+) -> None:
+    code = _code(
+        f"""
+        fun loop(n) {{
+            for (var i = 0; i < n; i = i + 1) {{ {body} }}
+        }}
+        loop({limit});
+        """
+    )
+    output, error, _ = _run(code, engine)
+
+    assert output == ""
+    assert message in error
+
+
+def test_equality(engine: Engine) -> None:
+    code = _code(
+        """
+        print 1 == 1;
+        print "a" == "b";
+        print nil == nil;
+        print nil != false;
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert exit_code == 0, error
+    assert output.strip() == _lines("true", "false", "true", "true")
+    assert error == ""
+
+
+def test_ternary(engine: Engine) -> None:
+    code = _code(
+        """
+        fun sign(n) {
+            return n < 0 ? "negative" : n > 0 ? "positive" : "zero";
+        }
+
+        var a;
+        a = 1 < 2 ? 3 : 4;
+        print a;
+        print sign(-2);
+        print sign(0);
+        print sign(5);
+        """
+    )
+    output, error, exit_code = _run(code, engine)
+
+    assert exit_code == 0, error
+    assert output.strip() == _lines(3, "negative", "zero", "positive")
+    assert error == ""
+
+
+def test_repl_frees_finished_lines(engine: Engine) -> None:
+    def count_variables() -> int:
+        gc.collect()
+        return sum(isinstance(obj, Expr.Variable) for obj in gc.get_objects())
+
+    logger = Logger()
+    interpreter = _interpreter(engine, logger, OpMode.REPL)
+    before = count_variables()
+
+    with _redirect() as (stdout, _):
+        for i in range(100):
+            line = f"{{ var a = {i}; print a; }}"
+            main._run(logger, interpreter, Command.INTERPRET, line)
+
+        assert stdout.getvalue() == _lines(*range(100)) + "\n"
+
+    assert count_variables() - before < 10
+
+
+def test_repl_redefinition(engine: Engine) -> None:
+    logger = Logger()
+    interpreter = _interpreter(engine, logger, OpMode.REPL)
+    lines = ("fun f() { return x; }", "var x = 1;", "f();", "var x = 2;", "f();")
+
+    with _redirect() as (stdout, _):
+        for line in lines:
+            main._run(logger, interpreter, Command.INTERPRET, line)
+
+        assert stdout.getvalue() == _lines(1, 2) + "\n"
+
+
+def test_closures_only_keep_captured_locals(engine: Engine) -> None:
+    def count_instances() -> int:
+        gc.collect()
+        return sum(isinstance(obj, LoxInstance) for obj in gc.get_objects())
+
+    code = _code(
+        """
+        class Big {}
+        fun make() {
+            var big = Big();
+            var small = 1;
+            fun get() { return small; }
+            return get;
+        }
+        """
+    )
+    code += "".join(f"var get{i} = make();\n" for i in range(20))
+
+    logger = Logger()
+    interpreter = _interpreter(engine, logger, OpMode.PROGRAM)
+    main._run(logger, interpreter, Command.INTERPRET, code)
+
+    assert not logger.had_error
+    assert count_instances() < 5
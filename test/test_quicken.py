@@ -0,0 +1,85 @@
+from contextlib import redirect_stdout
+import io
+
+from app import expression as Expr
+from app import quicken
+from app.interpreter import Interpreter
+from app.logger import Logger
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import OpMode
+from app import statement as Stmt
+
+
+def _interpret(text: str) -> tuple[Interpreter, list[Stmt.Stmt], str]:
+    logger = Logger()
+    interpreter = Interpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, text).scan_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        interpreter.interpret(statements)
+        return interpreter, statements, stdout.getvalue()
+
+
+def _variants(stats: quicken.QuickenStats) -> dict[str, tuple[int, int, int]]:
+    return {
+        name: (stats.nodes[variant], stats.hits[variant], stats.misses[variant])
+        for variant, name in enumerate(quicken.VARIANTS, quicken.WARMUP)
+        if stats.nodes[variant] or stats.hits[variant]
+    }
+
+
+def test_nodes_specialize() -> None:
+    code = (
+        "fun add(a, b) { return a + b; }\n"
+        "for (var i = 0; i < 5; i = i + 1) print add(i, -i) == 0 and !false;\n"
+    )
+    interpreter, statements, output = _interpret(code)
+
+    assert output == "true\n" * 5
+    function = statements[0]
+    assert isinstance(function, Stmt.Function)
+    body = function.body[0]
+    assert isinstance(body, Stmt.Return) and isinstance(body.value, Expr.Binary)
+    assert body.value.quick == quicken.NUMBER_ADD
+
+    # Each node runs generically until it has run WARMUP times.
+    runs = 5 - quicken.WARMUP
+    assert _variants(interpreter.quicken_stats) == {
+        "number-add": (1, runs, 0),
+        "number-equal": (1, runs, 0),
+        "number-negate": (1, runs, 0),
+        "bool-not": (1, runs, 0),
+        "bool-and": (1, runs, 0),
+        "call-function": (1, runs, 0),
+    }
+
+
+def test_failed_check_falls_back() -> None:
+    code = (
+        "fun add(a, b) { return a + b; }\n"
+        "print add(1, 2);\n"
+        "print add(3, 4);\n"
+        "print add(5, 6);\n"
+        'print add("a", "b");\n'
+        "print add(7, 8);\n"
+    )
+    interpreter, statements, output = _interpret(code)
+
+    assert output == "3\n7\n11\nab\n15\n"
+    stats = _variants(interpreter.quicken_stats)
+    assert stats["number-add"] == (1, 1, 1)
+    assert stats["generic"] == (1, 1, 0)
+
+
+def test_report() -> None:
+    code = "var a = 1;\nfor (var i = 0; i < 4; i = i + 1) a = a * 2;\n"
+    interpreter, _, _ = _interpret(code)
+    header, *rows = interpreter.quicken_stats.report().splitlines()
+
+    assert header.split() == ["variant", "nodes", "hits", "misses", "hit", "rate"]
+    assert [row.split() for row in rows] == [
+        ["number-multiply", "1", "2", "0", "100.0%"],
+    ]
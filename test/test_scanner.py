@@ -0,0 +1,109 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import pytest
+from app import main, scanner
+from app.logger import Logger
+from app.scanner import Scanner
+from app.schema import Command, ScannerEngine, Token, TokenType
+
+
+def _scan(text: str, engine: ScannerEngine) -> tuple[list[Token], str]:
+    with io.StringIO() as stderr, redirect_stderr(stderr):
+        tokens = Scanner(Logger(), text, engine).scan_tokens()
+        error = stderr.getvalue()
+
+    return tokens, error
+
+
+@pytest.mark.parametrize("filename", ["test.lox", "fib.lox"])
+def test_engines_agree_on_programs(filename: str) -> None:
+    with open(filename) as file:
+        text = file.read()
+
+    expected = _scan(text, ScannerEngine.CHAR)
+    assert _scan(text, ScannerEngine.REGEX) == expected
+    assert expected[1] == ""
+
+
+def test_engines_agree_on_errors() -> None:
+    text = 'var a = "multi\nline";\n@ x.y >= 1.5 12. != // note\n# "open\n\nb'
+
+    expected = _scan(text, ScannerEngine.CHAR)
+    tokens, error = _scan(text, ScannerEngine.REGEX)
+
+    assert (tokens, error) == expected
+    assert error.splitlines() == [
+        "[line 3] Error: Unexpected character: @",
+        "[line 4] Error: Unexpected character: #",
+        "[line 6] Error: Unterminated string.",
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64])
+def test_chunked_source_matches_whole_source(chunk_size: int) -> None:
+    text = 'var s = "two\nlines"; // note\nprint 12.5 >= 1. or s != "x"; @ "open'
+    chunks = [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+    with io.StringIO() as stderr, redirect_stderr(stderr):
+        tokens = list(Scanner(Logger(), iter(chunks)).iter_tokens())
+        error = stderr.getvalue()
+
+    assert (tokens, error) == _scan(text, ScannerEngine.CHAR)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        'print "' + "long string " * 10_000 + '";',
+        "// " + "long comment " * 10_000 + "\nprint 1;",
+        'print 1; "' + "unterminated " * 10_000,
+    ],
+)
+def test_long_lexemes_are_scanned_once(text: str, monkeypatch) -> None:
+    chunks = [text[i : i + 100] for i in range(0, len(text), 100)]
+    scanned = 0
+
+    class CountingPattern:
+        def finditer(self, buffer: str):
+            nonlocal scanned
+            scanned += len(buffer)
+            return pattern.finditer(buffer)
+
+    pattern = scanner._TOKEN_PATTERN
+    monkeypatch.setattr(scanner, "_TOKEN_PATTERN", CountingPattern())
+
+    with io.StringIO() as stderr, redirect_stderr(stderr):
+        tokens = list(Scanner(Logger(), iter(chunks)).iter_tokens())
+        error = stderr.getvalue()
+
+    monkeypatch.undo()
+    assert (tokens, error) == _scan(text, ScannerEngine.CHAR)
+    assert scanned < 2 * len(text)
+
+
+def test_token_buffer_matches_token_list() -> None:
+    with open("test.lox") as file:
+        text = file.read() + '\n"multi\nline" @ "open'
+
+    tokens, error = _scan(text, ScannerEngine.REGEX)
+
+    with io.StringIO() as stderr, redirect_stderr(stderr):
+        buffer = Scanner(Logger(), text).scan_buffer()
+        buffer_error = stderr.getvalue()
+
+    assert (list(buffer), buffer_error) == (tokens, error)
+    # identifier lexemes are interned
+    assert tokens[1].type_ == TokenType.IDENTIFIER
+    assert buffer[1].lexeme is tokens[1].lexeme
+
+
+@pytest.mark.parametrize("command", [Command.PARSE, Command.INTERPRET])
+def test_scan_error_stops_run(command: Command) -> None:
+    # Nothing is parsed, so the missing semicolon isn't reported either.
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        with io.StringIO() as stderr, redirect_stderr(stderr):
+            exit_code = main.run_text(command, iter(["1 + ", "@ 2"]))
+            output, error = stdout.getvalue(), stderr.getvalue()
+
+    assert (output, exit_code) == ("", 65)
+    assert error == "[line 1] Error: Unexpected character: @\n"
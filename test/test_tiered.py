@@ -0,0 +1,138 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+
+import pytest
+
+from app import main, tiered
+from app.schema import Command, Engine
+
+
+@pytest.fixture(autouse=True)
+def _thresholds(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(tiered, "HOT_CALLS", 3)
+    monkeypatch.setattr(tiered, "HOT_LOOP", 3)
+    monkeypatch.setattr(tiered, "MAX_DEOPTS", 2)
+
+
+def _run(text: str, engine: Engine = Engine.TIERED) -> tuple[str, str, int]:
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        with io.StringIO() as stderr, redirect_stderr(stderr):
+            exit_code = main.run_text(
+                Command.INTERPRET,
+                text,
+                engine=engine,
+                jit_stats=engine == Engine.TIERED,
+            )
+            return stdout.getvalue(), stderr.getvalue(), exit_code
+
+
+def _stats(report: str) -> dict[tuple[str, str, int], tuple[int, str, int]]:
+    header, *rows = report.splitlines()
+    assert header.split() == ["kind", "name", "line", "walked", "tier", "deopts"]
+
+    stats = {}
+    for row in rows:
+        kind, name, line, walked, tier, deopts = row.split()
+        stats[kind, name, int(line)] = (int(walked), tier, int(deopts))
+    return stats
+
+
+def test_hot_function() -> None:
+    code = (
+        "fun fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }\n"
+        "print fib(20);\n"
+    )
+    output, error, exit_code = _run(code)
+
+    assert (output, exit_code) == ("6765\n", 0)
+    assert _stats(error) == {("fun", "fib", 1): (3, "specialized", 0)}
+
+
+def test_deopt() -> None:
+    # Specialized on numbers, then called with strings until it's compiled
+    # again without assuming anything.
+    code = (
+        "fun twice(x) { return x + x; }\n"
+        "for (var i = 0; i < 3; i = i + 1) print twice(i);\n"
+        'print twice("a");\n'
+        'print twice("b");\n'
+        'print twice("c");\n'
+        "print twice(4);\n"
+    )
+    output, error, exit_code = _run(code)
+
+    assert (output, exit_code) == _run(code, Engine.TREE)[::2]
+    assert output == "0\n2\n4\naa\nbb\ncc\n8\n"
+    assert _stats(error)["fun", "twice", 1] == (3, "generic", 2)
+
+
+def test_hot_loop() -> None:
+    # The loops carry on as Python from the middle, and the return in the
+    # inner one returns from the function.
+    code = (
+        "fun find(limit, target) {\n"
+        "    var i = 0;\n"
+        "    while (i < limit) {\n"
+        "        var j = 0;\n"
+        "        while (j < i) {\n"
+        "            if (i * j == target) return i + j;\n"
+        "            j = j + 1;\n"
+        "        }\n"
+        "        i = i + 1;\n"
+        "    }\n"
+        '    return "none";\n'
+        "}\n"
+        "print find(100, 391);\n"
+        'var s = "";\n'
+        "while (true) {\n"
+        '    s = s + "x";\n'
+        "    if (s == \"xxxxxx\") break;\n"
+        "}\n"
+        "print s;\n"
+    )
+    output, error, exit_code = _run(code)
+
+    assert (output, exit_code) == ("40\nxxxxxx\n", 0)
+    stats = _stats(error)
+    assert stats["loop", "while", 3] == (3, "specialized", 0)
+    assert stats["loop", "while", 5][1] == "specialized"
+    # The first token in the loop is on the line after its literal condition.
+    assert stats["loop", "while", 16] == (3, "generic", 0)
+
+
+def test_loop_deopt() -> None:
+    code = (
+        "fun repeat(x, times) {\n"
+        "    var out = x;\n"
+        "    var i = 1;\n"
+        "    while (i < times) { out = out + x; i = i + 1; }\n"
+        "    return out;\n"
+        "}\n"
+        "print repeat(2, 5);\n"
+        'print repeat("ab", 5);\n'
+    )
+    output, error, exit_code = _run(code)
+
+    assert (output, exit_code) == ("10\nababababab\n", 0)
+    assert _stats(error)["loop", "while", 4] == (3, "specialized", 1)
+
+
+def test_closures_and_methods() -> None:
+    code = (
+        "fun counter() { var c = 0; fun inc() { c = c + 1; return c; } return inc; }\n"
+        "class Box {\n"
+        "    init(value) { this.value = value; }\n"
+        "    add(other) { return Box(this.value + other.value); }\n"
+        "}\n"
+        "var inc = counter();\n"
+        "var box = Box(0);\n"
+        "for (var i = 0; i < 10; i = i + 1) { inc(); box = box.add(Box(i)); }\n"
+        "print inc();\n"
+        "print box.value;\n"
+    )
+    output, error, exit_code = _run(code)
+
+    assert (output, exit_code) == ("11\n45\n", 0)
+    stats = _stats(error)
+    assert stats["fun", "inc", 1][1] == "generic"
+    assert stats["method", "add", 4][1] == "generic"
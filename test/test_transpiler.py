@@ -0,0 +1,122 @@
+from contextlib import redirect_stderr, redirect_stdout
+import importlib.util
+import io
+from pathlib import Path
+from types import ModuleType
+
+from app.logger import Logger
+from app.parser import Parser
+from app.resolver import Resolver
+from app.scanner import Scanner
+from app.schema import OpMode
+from app import statement as Stmt
+from app.transpiler import (
+    MAX_NESTING,
+    PythonInterpreter,
+    Transpiler,
+    build_module,
+    fits,
+    write_module,
+)
+
+PROGRAM = """
+class Counter {
+    init(start) { this.count = start; }
+    add(by) { this.count = this.count + by; return this; }
+}
+
+fun fib(n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+}
+
+fun adder(x) {
+    fun add(y) { return x + y; }
+    return add;
+}
+
+print fib(15);
+print adder("a")("b");
+print Counter(1).add(2).add(3).count;
+print nil == false or "ok";
+"""
+
+
+def _resolve(text: str) -> tuple[PythonInterpreter, list[Stmt.Stmt]]:
+    logger = Logger()
+    interpreter = PythonInterpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, text).scan_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+    assert not logger.had_error
+    return interpreter, statements
+
+
+def _build(tmp_path: Path, text: str) -> Path:
+    logger = Logger()
+    interpreter = PythonInterpreter(logger, OpMode.PROGRAM)
+    statements = Parser(logger, Scanner(logger, text).scan_tokens()).parse()
+    Resolver(logger, interpreter).resolve(statements)
+    assert not logger.had_error
+
+    path = tmp_path / "program.py"
+    write_module(build_module(interpreter, statements, "program.lox"), str(path))
+    return path
+
+
+def _import(path: Path) -> ModuleType:
+    spec = importlib.util.spec_from_file_location("program", path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _run(module: ModuleType) -> tuple[str, str, int]:
+    with io.StringIO() as stdout, redirect_stdout(stdout):
+        with io.StringIO() as stderr, redirect_stderr(stderr):
+            exit_code = module.run()
+            return stdout.getvalue(), stderr.getvalue(), exit_code
+
+
+def test_built_module(tmp_path: Path) -> None:
+    module = _import(_build(tmp_path, PROGRAM))
+
+    assert _run(module) == ("610\nab\n6\nok\n", "", 0)
+
+
+def test_built_module_without_source(tmp_path: Path) -> None:
+    path = _build(tmp_path, PROGRAM)
+    path.unlink()
+
+    module = _import(path.with_suffix(".pyc"))
+
+    assert _run(module) == ("610\nab\n6\nok\n", "", 0)
+
+
+def test_built_module_runtime_error(tmp_path: Path) -> None:
+    module = _import(_build(tmp_path, 'print "before";\nprint 1 + nil;\n'))
+    output, error, exit_code = _run(module)
+
+    assert (output, exit_code) == ("before\n", 70)
+    assert "Operands to + must be numbers or strings." in error
+    assert "[line 2]" in error
+
+
+def test_else_if_ladder_is_flat() -> None:
+    ladder = "\nelse ".join(f"if (x < {i}) print {i};" for i in range(1000))
+    interpreter, statements = _resolve(f"var x = 5;\n{ladder}\nelse print x;")
+
+    assert fits(statements)
+    source = Transpiler(interpreter).unit(statements, "_unit")
+    lines = source.splitlines()
+    assert sum(line.startswith("    elif ") for line in lines) == 999
+    assert max(len(line) - len(line.lstrip()) for line in lines) == 8
+
+
+def test_too_deep_to_translate() -> None:
+    _, shallow = _resolve("{" * MAX_NESTING + "print 1;" + "}" * MAX_NESTING)
+    _, nested = _resolve("if (true) " * MAX_NESTING + "print 1;")
+    _, expression = _resolve("print " + "-" * MAX_NESTING + "1;")
+
+    assert fits(shallow)
+    assert not fits(nested) and not fits(expression)